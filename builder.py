@@ -1,21 +1,34 @@
 import os
 import json
 import sys
-from openai import OpenAI
 import prompt
 import search # New
 import ast  # Required for Python syntax validation
 import github_utils  # Used but never imported
 import mentor as mentor_module  # Used but never imported
-
-# Reuse the client from kimi_code or create a new one
-client = OpenAI(
-    api_key=os.getenv("MOONSHOT_API_KEY"),
-    base_url="https://api.moonshot.ai/v1"
-)
+import model_router
+import llm_gateway
+import dep_cache
+import tracing
+import metrics
+import usage
 
 import xml.etree.ElementTree as ET
 
+def clean_file_content(content, filename):
+    """
+    Strip the markdown code fence models like to wrap file contents in.
+    """
+    if not content:
+        return content
+    text = content.strip("\n")
+    lines = text.split("\n")
+    if len(lines) >= 2 and lines[0].strip().startswith("```") and lines[-1].strip() == "```":
+        text = "\n".join(lines[1:-1])
+    if not filename.endswith((".md", ".markdown")) and not text.endswith("\n"):
+        text += "\n"
+    return text
+
 def validate_file_content(content, filename):
     """
     Returns (True, None) if valid, or (False, error_message).
@@ -69,14 +82,30 @@ def validate_file_content(content, filename):
     return True, None
 
 
-def build_project_stream(agents_data, github_token=None, image_data=None):
+def timing_event(role, agent_span):
+    """
+    NDJSON event with how long an agent took and where the time went (llm,
+    search, fs, github...); also recorded in the agent duration histograms.
+    """
+    total_ms, breakdown = tracing.timing_ms(agent_span)
+    metrics.AGENT_DURATION.observe(total_ms / 1000)
+    for part, ms in breakdown.items():
+        metrics.AGENT_COMPONENT.labels(part).observe(ms / 1000)
+    return json.dumps({"status": "timing", "agent": role, "total_ms": total_ms, "breakdown": breakdown}) + "\n"
+
+
+def build_project_stream(agents_data, github_token=None, image_data=None, user_id=None, budget=None):
     """
     Orchestrates the build process with streaming:
     1. Iterates through ALL agents.
     2. Prompts LLM for each agent's contribution.
     3. Yields JSON strings for real-time frontend updates.
     4. Uploads to GitHub if token provided.
+    After each agent a "timing" event reports its latency breakdown.
+    `budget` (usage.check_build) may drop web search or agents, and the build
+    stops scheduling agents once its LLM allowance is spent.
     """
+    metrics.BUILDS_STARTED.inc()
     try:
         project_name = agents_data.get("project", {}).get("name", "Untitled")
         tech_stack = agents_data.get("project", {}).get("tech_stack", [])
@@ -87,13 +116,21 @@ def build_project_stream(agents_data, github_token=None, image_data=None):
              safe_name = project_name.replace(" ", "_").replace("/", "-")
         base_dir = os.path.join("projects", safe_name, "src")
         os.makedirs(base_dir, exist_ok=True)
+
+        # Queue this build's LLM calls fairly against other users' projects
+        llm_gateway.bind_tenant(f"{llm_gateway.current_tenant()}:{safe_name}")
+        usage.bind_project(safe_name)
+        spend = usage.start_build(budget.allowance_usd if budget else None)
+        allow_search = budget is None or budget.allow_search
         
         yield json.dumps({"status": "start", "message": f"Starting build for {project_name}..."}) + "\n"
+        if budget is not None and budget.reason:
+            yield json.dumps({"status": "budget", "message": budget.reason}) + "\n"
 
         # Setup GitHub
         repo = None
         if github_token:
-            client, user = github_utils.get_github_client(github_token)
+            gh_client, user = github_utils.get_github_client(github_token)
             if user:
                  yield json.dumps({"status": "start", "message": f"GitHub Sync Enabled: {user.login}"}) + "\n"
                  # Repo should likely already exist from generation step, but we check/get again
@@ -102,128 +139,155 @@ def build_project_stream(agents_data, github_token=None, image_data=None):
             else:
                  yield json.dumps({"status": "error", "message": "GitHub Authentication Failed"}) + "\n"
 
-        # Iterate through agents
-        agents = agents_data.get("agents", [])
+        # Iterate through agents. Agents whose calls are still rate-limited after
+        # the gateway's retries are re-queued once at the end instead of dropped.
+        agents = list(agents_data.get("agents", []))
+        if budget is not None:
+            agents = agents[:budget.max_agents]
+        requeued = set()
         
         for agent in agents:
             role = agent.get("role", "Agent")
             goal = agent.get("goal", "Contribute to project")
 
-            yield json.dumps({"status": "thinking", "agent": role, "message": "Analyzing requirements..."}) + "\n"
+            if spend.exhausted:
+                yield json.dumps({"status": "budget", "message": f"LLM budget for this build (${spend.allowance_usd:.2f}) is used up, skipping the remaining agents"}) + "\n"
+                break
 
-            project_context = f"""
+            with tracing.span("build.agent", agent=role) as agent_span:
+                yield json.dumps({"status": "thinking", "agent": role, "message": "Analyzing requirements..."}) + "\n"
+
+                project_context = f"""
             Project: {project_name}
             Stack: {', '.join(tech_stack)}
             Your Role: {role}
             Your Goal: {goal}
             """
 
-            # --- TOOL USE LOOP (Search) ---
-            max_tool_loops = 3
-            current_loop = 0
+                # --- TOOL USE LOOP (Search) ---
+                max_tool_loops = 3 if allow_search else 1
+                current_loop = 0
             
-            # Initial prompt content
-            messages = [
-                {"role": "system", "content": prompt.AGENT_ARTIFACT_PROMPT + "\n\nYou have access to Realtime Internet. To search, output `SEARCH: <query>` on a single line. I will return results. Then you can generate artifacts."},
-                {"role": "user", "content": f"Generate artifacts for:\n{project_context}"}
-            ]
+                # Initial prompt content
+                system_prompt = prompt.AGENT_ARTIFACT_PROMPT
+                if allow_search:
+                    system_prompt += "\n\nYou have access to Realtime Internet. To search, output `SEARCH: <query>` on a single line. I will return results. Then you can generate artifacts."
+                messages = [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f"Generate artifacts for:\n{project_context}"}
+                ]
             
-            while current_loop < max_tool_loops:
-                current_loop += 1
+                content = None
+                while current_loop < max_tool_loops:
+                    current_loop += 1
                 
-                try:
-                    response = client.chat.completions.create(
-                        model="kimi-k2-0905-preview",
-                        messages=messages,
-                        temperature=0.3, # Low temp for tool use
-                        max_tokens=4096,
-                        stream=False 
-                    )
-                    content = response.choices[0].message.content
+                    try:
+                        response = model_router.complete(
+                            "artifacts",
+                            messages,
+                            temperature=0.3, # Low temp for tool use
+                            max_tokens=4096,
+                            stream=False 
+                        )
+                        content = response.choices[0].message.content
                     
-                    # Check for Search Command
-                    import re
-                    search_match = re.search(r"SEARCH:\s*(.*)", content)
+                        # Check for Search Command
+                        import re
+                        search_match = re.search(r"SEARCH:\s*(.*)", content)
                     
-                    if search_match:
-                        query = search_match.group(1).strip().strip('"').strip("'")
-                        yield json.dumps({"status": "search", "query": query}) + "\n"
-                        mentor_module.mentor.log_event(f"Agent {role} is searching: {query}")
+                        if search_match and allow_search:
+                            query = search_match.group(1).strip().strip('"').strip("'")
+                            yield json.dumps({"status": "search", "query": query}) + "\n"
+                            mentor_module.mentor.log_event(f"Agent {role} is searching: {query}", project_name, user_id=user_id)
                         
-                        # Execute Search
-                        results = search.search_web(query)
+                            # Execute Search
+                            results = search.search_web(query)
                         
-                        # Summarize Results (New Step)
-                        yield json.dumps({"status": "thought", "agent": role, "message": "Reading and summarizing search results..."}) + "\n"
+                            # Summarize Results (New Step)
+                            yield json.dumps({"status": "thought", "agent": role, "message": "Reading and summarizing search results..."}) + "\n"
                         
-                        summary_prompt = f"Summarize these search results for a developer. Focus on version numbers, code snippets, and key facts. Include [Source: URL] citations.\n\nResults: {json.dumps(results)}"
+                            summary_prompt = f"Summarize these search results for a developer. Focus on version numbers, code snippets, and key facts. Include [Source: URL] citations.\n\nResults: {json.dumps(results)}"
                         
-                        summary_resp = client.chat.completions.create(
-                            model="kimi-k2-0905-preview",
-                            messages=[{"role": "user", "content": summary_prompt}],
-                            temperature=0.2
-                        )
-                        summary = summary_resp.choices[0].message.content
+                            summary_resp = model_router.complete(
+                                "summarize",
+                                [{"role": "user", "content": summary_prompt}],
+                                temperature=0.2
+                            )
+                            summary = summary_resp.choices[0].message.content
                         
-                        # Feed back to LLM
-                        messages.append({"role": "assistant", "content": f"SEARCH: {query}"})
-                        messages.append({"role": "system", "content": f"Search Results Summary:\n{summary}\n\nIMPORTANT: You MUST cite these sources in your documentation using [Source Name](url)."})
+                            # Feed back to LLM
+                            messages.append({"role": "assistant", "content": f"SEARCH: {query}"})
+                            messages.append({"role": "system", "content": f"Search Results Summary:\n{summary}\n\nIMPORTANT: You MUST cite these sources in your documentation using [Source Name](url)."})
                         
-                        yield json.dumps({"status": "thought", "agent": role, "message": "Learned from search. Generating content..."}) + "\n"
-                        continue # Loop again
+                            yield json.dumps({"status": "thought", "agent": role, "message": "Learned from search. Generating content..."}) + "\n"
+                            continue # Loop again
                     
-                    # If no search, we have the final content
-                    # Break and process as usual
-                    break
+                        # If no search, we have the final content
+                        # Break and process as usual
+                        break
                     
-                except Exception as e:
-                    yield json.dumps({"status": "error", "agent": role, "message": str(e)}) + "\n"
-                    break
+                    except Exception as e:
+                        content = None
+                        if llm_gateway.is_retryable(e) and id(agent) not in requeued:
+                            requeued.add(id(agent))
+                            agents.append(agent)
+                            yield json.dumps({"status": "waiting", "agent": role, "message": "Provider is busy, retrying this agent later..."}) + "\n"
+                        else:
+                            yield json.dumps({"status": "error", "agent": role, "message": str(e)}) + "\n"
+                        break
+
+                if content is None:
+                    yield timing_event(role, agent_span)
+                    continue
 
-            # Proceed with processing `content` (which should now be the JSON artifacts)
+                # Proceed with processing `content` (which should now be the JSON artifacts)
             
-            # Clean JSON
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "")
-            elif content.startswith("```"):
-                content = content.replace("```", "")
+                # Clean JSON
+                if content.startswith("```json"):
+                    content = content.replace("```json", "").replace("```", "")
+                elif content.startswith("```"):
+                    content = content.replace("```", "")
             
-            try:
-                data = json.loads(content)
-                thought = data.get("thought", "Working...")
-                files = data.get("files", {})
+                try:
+                    data = json.loads(content)
+                    thought = data.get("thought", "Working...")
+                    files = data.get("files", {})
                     
                     # Yield Thought
                     yield json.dumps({"status": "thought", "agent": role, "message": thought}) + "\n"
-                    mentor_module.mentor.log_event(f"Agent '{role}' thought: {thought}")
-                    
+                    mentor_module.mentor.log_event(f"Agent '{role}' thought: {thought}", project_name, user_id=user_id)
+                
                     # Write Files
                     for file_path, file_content in files.items():
                         # 1. Clean Content
                         cleaned_content = clean_file_content(file_content, file_path)
-                        
+                    
                         # 2. Validate Content
-                        is_valid, error_msg = validate_file_content(cleaned_content, file_path)
+                        with tracing.span("validation.file", path=file_path) as check:
+                            is_valid, error_msg = validate_file_content(cleaned_content, file_path)
+                            check.set(valid=is_valid)
+                        metrics.BUILD_FILES.labels(str(is_valid).lower()).inc()
                         if not is_valid:
                             yield json.dumps({"status": "warning", "agent": role, "message": f"Fixing {file_path}: {error_msg}"}) + "\n"
                             # We could try to auto-fix or just save it anyway with a .broken extension?
                             # For now, let's save it but user knows it's broken.
-                        
-                        full_path = os.path.join(base_dir, file_path)
-                        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-                        
-                        # Append mode for docs, Overwrite for code?
-                        mode = "w"
-                        if file_path.endswith(".md") and os.path.exists(full_path):
-                             mode = "a" # Append to docs like README
-                             cleaned_content = "\n\n" + cleaned_content
-                        
-                        with open(full_path, mode, encoding="utf-8") as f:
-                            f.write(cleaned_content)
-                        
+                    
+                        with tracing.span("fs.write", path=file_path, bytes=len(cleaned_content)):
+                            full_path = os.path.join(base_dir, file_path)
+                            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+                            # Append mode for docs, Overwrite for code?
+                            mode = "w"
+                            if file_path.endswith(".md") and os.path.exists(full_path):
+                                 mode = "a" # Append to docs like README
+                                 cleaned_content = "\n\n" + cleaned_content
+
+                            with open(full_path, mode, encoding="utf-8") as f:
+                                f.write(cleaned_content)
+                    
                         # Yield File Creation
                         yield json.dumps({"status": "file", "agent": role, "file": file_path}) + "\n"
-                        
+                    
                         # Upload to GitHub
                         if repo:
                             # Use relative path for GitHub
@@ -231,7 +295,7 @@ def build_project_stream(agents_data, github_token=None, image_data=None):
                             # Agents might return "src/main.py" or just "main.py". 
                             # If they return "src/main.py", we shouldn't double stack "src/src/main.py".
                             # Let's trust the agent's relative path but ensure it's clean.
-                            
+                        
                             # Actually, agents.json is at root. Code seems to be going into src.
                             # Let's keep structure simple: whatever the agent gave us.
                             upload_success = github_utils.upload_file_to_github(repo, file_path, cleaned_content, f"Agent {role} update: {file_path}")
@@ -242,12 +306,18 @@ def build_project_stream(agents_data, github_token=None, image_data=None):
                 except json.JSONDecodeError:
                      yield json.dumps({"status": "error", "agent": role, "message": "Failed to parse output"}) + "\n"
 
-            except Exception as e:
-                yield json.dumps({"status": "error", "agent": role, "message": str(e)}) + "\n"
+                except Exception as e:
+                    yield json.dumps({"status": "error", "agent": role, "message": str(e)}) + "\n"
+
+                yield timing_event(role, agent_span)
 
+        metrics.BUILDS_FINISHED.labels("complete").inc()
+        yield json.dumps(dict(spend.to_dict(), status="usage")) + "\n"
         yield json.dumps({"status": "complete", "directory": base_dir}) + "\n"
+        dep_cache.pool.prepare_async(os.path.dirname(base_dir))  # Ready by the first test run
 
     except Exception as e:
+        metrics.BUILDS_FINISHED.labels("fatal").inc()
         yield json.dumps({"status": "fatal", "message": str(e)}) + "\n"
 
 
@@ -324,14 +394,17 @@ def apply_agent_edit(project_name, file_path, content):
         cleaned_content = clean_file_content(content, file_path)
         
         # 4. Validate Content
-        is_valid, error_msg = validate_file_content(cleaned_content, file_path)
+        with tracing.span("validation.file", path=file_path) as check:
+            is_valid, error_msg = validate_file_content(cleaned_content, file_path)
+            check.set(valid=is_valid)
         if not is_valid:
             return False, f"Validation Failed: {error_msg}"
             
         # 5. Write File
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, "w", encoding="utf-8") as f:
-            f.write(cleaned_content)
+        with tracing.span("fs.write", path=file_path, bytes=len(cleaned_content)):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "w", encoding="utf-8") as f:
+                f.write(cleaned_content)
         
         msg = f"Successfully updated {file_path}"
         if backup_id:
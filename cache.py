@@ -0,0 +1,110 @@
+"""
+Reference Data Cache
+--------------------
+Small in-process read-through cache for rarely-changing reference data
+(the package catalog, voice lists, ...):
+
+    @cache.cached("packages", ttl=300)
+    def list_packages(): ...
+
+    list_packages()              # loads once, then served from memory
+    list_packages.invalidate()   # drop it (all argument variants)
+
+Concurrent misses for the same key are collapsed into one load. Entries can
+be dropped automatically when rows of a model change with
+`invalidate_on_commit(Model, list_packages)`; the TTL bounds how long other
+gunicorn workers keep serving the old value.
+"""
+
+import functools
+import threading
+import time
+
+from sqlalchemy import event
+
+from database import RoutingSession
+import metrics
+
+DEFAULT_TTL = 300
+_PENDING_KEY = "cache_invalidate"
+
+
+class TTLCache:
+    def __init__(self):
+        self._entries = {}     # key -> (expires_at, value)
+        self._loading = {}     # key -> lock held while one caller loads it
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get_or_load(self, key, loader, ttl=DEFAULT_TTL):
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and entry[0] > now:
+            self.stats["hits"] += 1
+            metrics.count_cache("reference", True)
+            return entry[1]
+
+        with self._lock:
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            # Someone else may have loaded it while we waited
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.stats["hits"] += 1
+                metrics.count_cache("reference", True)
+                return entry[1]
+            self.stats["misses"] += 1
+            metrics.count_cache("reference", False)
+            value = loader()
+            self._entries[key] = (time.monotonic() + ttl, value)
+            return value
+
+    def invalidate(self, name=None):
+        """Drop every key of cached function `name` (or everything)."""
+        with self._lock:
+            for key in list(self._entries):
+                if name is None or key[0] == name:
+                    del self._entries[key]
+            self.stats["invalidations"] += 1
+
+    def cached(self, name, ttl=DEFAULT_TTL):
+        """Decorator: cache the function's result per positional/keyword args."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = (name, args, tuple(sorted(kwargs.items())))
+                return self.get_or_load(key, lambda: fn(*args, **kwargs), ttl)
+
+            wrapper.invalidate = lambda: self.invalidate(name)
+            wrapper.cache_name = name
+            return wrapper
+        return decorator
+
+    def get_stats(self):
+        return dict(self.stats, entries=len(self._entries))
+
+
+def invalidate_on_commit(model, *cached_fns):
+    """Invalidate `cached_fns` once a transaction that changed `model` commits."""
+    def mark(mapper, connection, target):
+        session = RoutingSession.object_session(target)
+        if session is not None:
+            session.info.setdefault(_PENDING_KEY, set()).update(cached_fns)
+
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(model, event_name, mark)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _flush_invalidations(session):
+    for fn in session.info.pop(_PENDING_KEY, ()):
+        fn.invalidate()
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _discard_invalidations(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+# Global Instance
+cache = TTLCache()
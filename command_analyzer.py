@@ -0,0 +1,188 @@
+"""
+Command Security Analyzer
+-------------------------
+Single-pass replacement for the sanitize -> whitelist -> per-argument pattern
+loop -> injection-detector chain that every terminal command used to go
+through. All dangerous patterns live in one precompiled alternation, the
+command is tokenized once with shlex, and the caller gets a structured
+verdict with a risk score.
+"""
+
+import re
+import shlex
+import threading
+import time
+import urllib.parse
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# Define allowed commands and their arguments
+ALLOWED_COMMANDS = {
+    'npm': ['install', 'test', 'run', 'build', 'start'],
+    'python': ['-m', 'pip', 'install', '-m', 'http.server', '-m', 'pytest'],
+    'pip': ['install', 'list', 'show'],
+    'ls': ['-la', '-l', '-a'],
+    'cat': [],
+    'wc': ['-l', '-w', '-c'],
+    'mkdir': [],
+    'touch': [],
+    'rm': ['-rf', '-r', '-f'],
+    'cp': ['-r'],
+    'mv': [],
+    'git': ['status', 'add', 'commit', 'push', 'pull', 'clone', 'init']
+}
+
+# (rule name, pattern, risk weight). Order matters: longer tokens first so
+# '&&' is reported as chaining rather than two background operators.
+RULES = [
+    ("chain_and", r"&&", 25),
+    ("chain_or", r"\|\|", 25),
+    ("command_substitution", r"\$\(", 25),
+    ("variable_expansion", r"\$\{", 25),
+    ("code_eval", r"\b(?:eval|exec|system)\s*\(", 25),
+    ("hex_escape", r"\\x", 15),
+    ("backtick", r"`", 25),
+    ("semicolon", r";", 25),
+    ("pipe", r"\|", 25),
+    ("background", r"&", 15),
+    ("redirect", r"[<>]", 25),
+    ("newline", r"[\r\n]", 25),
+    ("dollar", r"\$", 10),
+    ("parenthesis", r"[()]", 10),
+    ("backslash", r"\\", 10),
+]
+RULE_WEIGHTS = {name: weight for name, _, weight in RULES}
+
+DANGEROUS_RE = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for name, pattern, _ in RULES),
+    re.IGNORECASE
+)
+
+BLOCK_SCORE = 50
+BURST_LIMIT = 20      # Commands per user per minute before it looks automated
+BURST_SCORE = 50
+LONG_COMMAND_ARGS = 10
+LONG_COMMAND_SCORE = 15
+
+
+@dataclass
+class CommandVerdict:
+    allowed: bool
+    stage: str = "ok"                       # sanitize, parse, whitelist, rate, ok
+    reason: str = ""
+    risk_score: int = 0
+    patterns_found: List[str] = field(default_factory=list)
+    command_parts: List[str] = field(default_factory=list)
+    sanitized: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "allowed": self.allowed,
+            "stage": self.stage,
+            "reason": self.reason,
+            "risk_score": self.risk_score,
+            "patterns_found": self.patterns_found,
+        }
+
+
+def scan(text: str) -> List[str]:
+    """Names of every dangerous rule matched anywhere in `text`, in one pass."""
+    found = []
+    for match in DANGEROUS_RE.finditer(text):
+        if match.lastgroup not in found:
+            found.append(match.lastgroup)
+    return found
+
+
+def tokenize(command: str) -> List[str]:
+    """shlex.split, skipped when there is nothing for it to do."""
+    # Escapes and newlines are already rejected by the scanner, so without
+    # quotes POSIX shlex splitting is plain whitespace splitting
+    if "'" not in command and '"' not in command:
+        return command.split()
+    return shlex.split(command)
+
+
+def validate_parts(command_parts: List[str], allowed_commands: Dict[str, List[str]] = ALLOWED_COMMANDS) -> bool:
+    """Validate command and arguments against whitelist"""
+    if not command_parts or command_parts[0] not in allowed_commands:
+        return False
+    allowed_args = allowed_commands[command_parts[0]]
+    # Skip file/directory names (they don't start with -)
+    return all(not arg.startswith('-') or arg in allowed_args for arg in command_parts[1:])
+
+
+class CommandAnalyzer:
+    def __init__(self, allowed_commands: Dict[str, List[str]] = ALLOWED_COMMANDS):
+        self.allowed_commands = allowed_commands
+        self.request_history = defaultdict(lambda: deque(maxlen=100))
+        self.blocked_commands = deque(maxlen=1000)
+        self._lock = threading.Lock()
+
+    def sanitize(self, user_input: str) -> Optional[str]:
+        """Stripped command, or None if it contains any dangerous pattern."""
+        if not user_input or not isinstance(user_input, str):
+            return None
+        user_input = user_input.replace('\x00', '')
+        if DANGEROUS_RE.search(user_input):
+            return None
+        # Check for URL-encoded dangerous characters
+        if '%' in user_input and DANGEROUS_RE.search(urllib.parse.unquote(user_input)):
+            return None
+        return user_input.strip()
+
+    def _burst_score(self, user_id: str, now: float) -> int:
+        with self._lock:
+            history = self.request_history[user_id]
+            while history and now - history[0] > 60:
+                history.popleft()
+            history.append(now)
+            return BURST_SCORE if len(history) > BURST_LIMIT + 1 else 0
+
+    def analyze(self, command: str, user_id: str = "anonymous", ip_address: str = "") -> CommandVerdict:
+        """Full verdict for one terminal command."""
+        if not command or not isinstance(command, str):
+            return CommandVerdict(False, "sanitize", "Invalid input")
+
+        command = command.replace('\x00', '')
+        patterns = scan(command)
+        if '%' in command:
+            patterns += [p for p in scan(urllib.parse.unquote(command)) if p not in patterns]
+        risk = sum(RULE_WEIGHTS[p] for p in patterns)
+        now = time.time()
+        risk += self._burst_score(user_id, now)
+
+        verdict = CommandVerdict(True, risk_score=risk, patterns_found=patterns)
+        if patterns:
+            verdict.allowed, verdict.stage = False, "sanitize"
+            verdict.reason = f"Dangerous pattern detected: {patterns[0]}"
+        else:
+            verdict.sanitized = command.strip()
+            try:
+                verdict.command_parts = tokenize(verdict.sanitized)
+            except ValueError as e:
+                verdict.allowed, verdict.stage, verdict.reason = False, "parse", f"Invalid command syntax: {e}"
+                return verdict
+
+            if len(verdict.command_parts) > LONG_COMMAND_ARGS:
+                verdict.risk_score += LONG_COMMAND_SCORE
+            if not validate_parts(verdict.command_parts, self.allowed_commands):
+                verdict.allowed, verdict.stage, verdict.reason = False, "whitelist", "Command not allowed"
+            elif verdict.risk_score >= BLOCK_SCORE:
+                verdict.allowed, verdict.stage, verdict.reason = False, "rate", "High risk score detected"
+
+        if not verdict.allowed and verdict.stage in ("sanitize", "rate"):
+            with self._lock:
+                self.blocked_commands.append({
+                    "user_id": user_id,
+                    "command": command,
+                    "ip_address": ip_address,
+                    "timestamp": now,
+                    "risk_score": verdict.risk_score
+                })
+        return verdict
+
+
+# Global Instance
+analyzer = CommandAnalyzer()
@@ -0,0 +1,238 @@
+"""
+Auto-Debug
+----------
+Turns structured test failures (see test_runner) into targeted fixes for
+/api/debug. Failures are grouped by the project file they most likely come
+from - the deepest traceback frame in a non-test source file, else the test
+file itself - and each group is repaired by its own concurrent "debug"
+model call that only sees the failing tests and the source chunks around
+the frames involved, instead of the whole raw test log.
+
+Fixes come back as find/replace edits so a chunk is enough to patch a file
+the model never saw in full. Groups may edit the same helper module, so each
+file's read-modify-write runs under a per-file lock.
+"""
+
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import model_router
+from builder import apply_agent_edit
+from test_runner import DependencyMap, is_test_file, parse_frames
+
+MAX_GROUPS = int(os.getenv("DEBUG_MAX_GROUPS", "4"))  # Files repaired per iteration
+FULL_FILE_LINES = 150      # Send small files whole
+CONTEXT_LINES = 20         # Lines around each frame for bigger files
+MAX_DETAILS_CHARS = 2500   # Traceback text kept per failure
+MAX_FAILURES_PER_GROUP = 5
+
+DEBUG_PROMPT = """
+You are an expert Debugging Agent fixing failing tests in project {project_name}.
+You get the failing tests and only the relevant chunks of the source files.
+The failures point at `{file}`. Fix the root cause there or in one of the modules
+shown with it (edit a test only if the test itself is wrong).
+
+Output MUST be a JSON object with:
+{{
+    "thought": "Analysis of the error...",
+    "file": "relative path of the file you edited",
+    "edits": [
+        {{"find": "exact text copied from a chunk (unique in the file)", "replace": "new text"}}
+    ]
+}}
+"""
+
+
+def _parse_json(content):
+    content = (content or "").strip()
+    if content.startswith("```"):
+        content = content.strip("`")
+        if content.startswith("json"):
+            content = content[4:]
+    return json.loads(content)
+
+
+def _in_project(src_dir, rel_path):
+    full = os.path.abspath(os.path.join(src_dir, rel_path))
+    return full.startswith(os.path.abspath(src_dir) + os.sep) and os.path.isfile(full)
+
+
+def root_file(failure, src_dir):
+    """Project file a failure should be fixed in."""
+    frames = [f for f in failure.get("frames") or [] if _in_project(src_dir, f["file"])]
+    for frame in reversed(frames):
+        if not is_test_file(frame["file"]):
+            return frame["file"]
+    if failure.get("file") and _in_project(src_dir, failure["file"]):
+        return failure["file"]
+    return frames[-1]["file"] if frames else None
+
+
+def failures_from_log(error_log):
+    """Single pseudo-failure for clients that still send the raw output."""
+    frames = parse_frames(error_log)
+    test_frames = [f for f in frames if is_test_file(f["file"])]
+    return [{
+        "id": "test output",
+        "file": test_frames[0]["file"] if test_frames else None,
+        "line": test_frames[0]["line"] if test_frames else None,
+        "message": "",
+        "details": error_log,
+        "frames": frames,
+    }]
+
+
+def group_failures(failures, src_dir):
+    """{root file: [failures]}, biggest groups first, capped at MAX_GROUPS."""
+    groups = {}
+    for failure in failures:
+        target = root_file(failure, src_dir)
+        if target:
+            groups.setdefault(target, []).append(failure)
+    ordered = sorted(groups.items(), key=lambda item: len(item[1]), reverse=True)
+    return dict(ordered[:MAX_GROUPS])
+
+
+def source_chunks(src_dir, rel_path, lines_of_interest):
+    """Text of the file around the given 1-based lines (whole file if small)."""
+    with open(os.path.join(src_dir, rel_path), "r", encoding="utf-8", errors="replace") as f:
+        lines = f.read().split("\n")
+
+    if len(lines) <= FULL_FILE_LINES or not lines_of_interest:
+        windows = [(1, len(lines))]
+    else:
+        windows = []
+        for line in sorted(set(lines_of_interest)):
+            start, end = max(1, line - CONTEXT_LINES), min(len(lines), line + CONTEXT_LINES)
+            if windows and start <= windows[-1][1] + 1:
+                windows[-1] = (windows[-1][0], max(end, windows[-1][1]))
+            else:
+                windows.append((start, end))
+
+    return "\n".join(
+        f"### {rel_path} (lines {start}-{end} of {len(lines)})\n" + "\n".join(lines[start - 1:end])
+        for start, end in windows
+    )
+
+
+def _group_context(src_dir, target, failures):
+    interesting = {}
+    for failure in failures:
+        for frame in failure.get("frames") or []:
+            if _in_project(src_dir, frame["file"]):
+                interesting.setdefault(frame["file"], []).append(frame["line"])
+        if failure.get("file") and _in_project(src_dir, failure["file"]) and failure.get("line"):
+            interesting.setdefault(failure["file"], []).append(failure["line"])
+    interesting.setdefault(target, [])
+
+    # Assertion failures stop in the test; show the small modules it imports
+    if is_test_file(target):
+        deps = DependencyMap(src_dir)
+        for dep in deps.direct_imports(os.path.join(src_dir, target)):
+            rel = os.path.relpath(dep, src_dir).replace(os.sep, "/")
+            with open(dep, "r", encoding="utf-8", errors="replace") as f:
+                if sum(1 for _ in f) <= FULL_FILE_LINES:
+                    interesting.setdefault(rel, [])
+
+    report = "\n\n".join(
+        f"FAILED {f.get('id')}: {f.get('message', '')}\n{(f.get('details') or '')[-MAX_DETAILS_CHARS:]}"
+        for f in failures[:MAX_FAILURES_PER_GROUP]
+    )
+    # Target file first, then the tests and helpers it was reached from
+    files = [target] + sorted(path for path in interesting if path != target)
+    chunks = "\n\n".join(source_chunks(src_dir, path, interesting[path]) for path in files)
+    return report, chunks
+
+
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+def _file_lock(src_dir, rel_path):
+    path = os.path.realpath(os.path.join(src_dir, rel_path))
+    with _file_locks_guard:
+        return _file_locks.setdefault(path, threading.Lock())
+
+
+def apply_edits(src_dir, rel_path, edits):
+    """New file content with every find/replace applied, or raise ValueError."""
+    with open(os.path.join(src_dir, rel_path), "r", encoding="utf-8") as f:
+        content = f.read()
+    for edit in edits:
+        find, replace = edit.get("find"), edit.get("replace")
+        if not find or replace is None:
+            raise ValueError("Edit is missing 'find' or 'replace'")
+        count = content.count(find)
+        if count != 1:
+            raise ValueError(f"Edit target found {count} times in {rel_path}")
+        content = content.replace(find, replace)
+    return content
+
+
+def _read(src_dir, rel_path):
+    try:
+        with open(os.path.join(src_dir, rel_path), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def fix_group(project_name, src_dir, target, failures):
+    seen = _read(src_dir, target)  # What the model's full-file answer would be based on
+    report, chunks = _group_context(src_dir, target, failures)
+    result = {"file": target, "tests": [f.get("id") for f in failures], "status": "failed"}
+    try:
+        response = model_router.complete(
+            "debug",
+            [
+                {"role": "system", "content": DEBUG_PROMPT.format(project_name=project_name, file=target)},
+                {"role": "user", "content": f"FAILING TESTS:\n{report}\n\nSOURCE:\n{chunks}"}
+            ],
+            response_format={"type": "json_object"}
+        )
+        fix_data = _parse_json(response.choices[0].message.content)
+        result["thought"] = fix_data.get("thought")
+
+        file_path = fix_data.get("file") or target
+        if file_path != target and not _in_project(src_dir, file_path):
+            result["message"] = f"Fix targets unknown file {file_path}"
+            return result
+        if not fix_data.get("edits") and not fix_data.get("content"):
+            result["message"] = "AI could not generate a fix action."
+            return result
+        if not fix_data.get("edits") and file_path != target:
+            # A whole-file rewrite of a shared module would drop other groups' edits
+            result["message"] = f"Full-file fix only accepted for {target}"
+            return result
+
+        # Re-read under the lock so concurrent groups' edits to a shared module stack
+        with _file_lock(src_dir, file_path):
+            if fix_data.get("edits"):
+                content = apply_edits(src_dir, file_path, fix_data["edits"])
+            elif _read(src_dir, target) != seen:
+                # Another group edited it meanwhile; writing this would undo that
+                result["message"] = f"{target} changed while fixing; full-file fix dropped"
+                return result
+            else:
+                content = fix_data["content"]  # Full-file answer is still accepted
+            success, msg = apply_agent_edit(project_name, file_path, content)
+        result.update(status="fixed" if success else "failed", message=msg, file=file_path)
+    except Exception as e:
+        result["message"] = str(e)
+    return result
+
+
+def debug(project_name, src_dir, failures):
+    """Repair every failure group concurrently. Returns one result per group."""
+    groups = group_failures(failures, src_dir)
+    if not groups:
+        return []
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, fix_group, project_name, src_dir, target, group)
+            for target, group in groups.items()
+        ]
+        return [future.result() for future in futures]
@@ -0,0 +1,389 @@
+"""
+Dependency Cache
+----------------
+Shared, per-host caches for project installs so `pip install` / `npm install`
+stop downloading and building everything from scratch for every project:
+
+- One pip wheel cache and one npm content cache, wired into the terminal and
+  /api/test/run environments through `install_env()`.
+- A pool of warm templates (`.venv` and `node_modules`) keyed by the hash of
+  the dependency manifest. `prepare()` clones a matching template into a new
+  project, so a second install of the same manifest is a no-op.
+- Optional offline index (`DEP_OFFLINE_INDEX`, a directory of wheels) so
+  tests can install without network access.
+
+Templates are shared by every project (and user) with the same manifest, so:
+
+- they are built only from the manifest, in a directory of their own, and
+  never from a project's tree a user may have changed;
+- clones are copies (a reflink where the filesystem supports it, otherwise a
+  plain copy), never hardlinks, so writing to a project's file can't change
+  the template or any other project;
+- a template is usable once its `.ready` file exists.
+
+`prepare()` can take minutes (venv creation, large copies); requests go
+through `prepare_async()` or run it in a background session (terminal).
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+try:
+    import fcntl  # POSIX only; reflinks are a Linux feature anyway
+except ImportError:
+    fcntl = None
+
+CACHE_ROOT = os.path.abspath(os.getenv("DEP_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "kimi_code")))
+PIP_CACHE_DIR = os.path.join(CACHE_ROOT, "pip")
+NPM_CACHE_DIR = os.path.join(CACHE_ROOT, "npm")
+TEMPLATE_DIR = os.path.join(CACHE_ROOT, "templates")
+OFFLINE_INDEX = os.getenv("DEP_OFFLINE_INDEX")  # Directory of wheels used instead of PyPI
+MAX_TEMPLATES = int(os.getenv("DEP_CACHE_MAX_TEMPLATES", "50"))  # Per kind, least recently used evicted
+WARM_TIMEOUT = int(os.getenv("DEP_CACHE_WARM_TIMEOUT", "900"))
+PREPARE_WORKERS = int(os.getenv("DEP_CACHE_PREPARE_WORKERS", "2"))
+
+FICLONE = 0x40049409  # linux/fs.h: share the source's extents, copy-on-write
+
+VENV_DIR = ".venv"
+READY_MARKER = ".ready"
+BIN_DIR = "Scripts" if os.name == "nt" else "bin"
+
+PYTHON_MANIFESTS = ["requirements.txt"]
+NODE_MANIFESTS = ["package-lock.json", "package.json"]  # Lockfile wins when present
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------
+# Manifests
+# ------------------------------------------------------------------
+def _search_dirs(project_root):
+    # Builds write sources under src/, but users may keep manifests at the root
+    return [project_root, os.path.join(project_root, "src")]
+
+
+def find_manifest(project_root, kind):
+    """Path of the python/node manifest for a project, or None."""
+    names = PYTHON_MANIFESTS if kind == "python" else NODE_MANIFESTS
+    for directory in _search_dirs(project_root):
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def manifest_hash(path, kind):
+    """Template key: manifest content plus what the installed tree depends on."""
+    digest = hashlib.sha256()
+    digest.update(f"{kind}|{sys.platform}|".encode())
+    if kind == "python":
+        digest.update(f"{sys.version_info.major}.{sys.version_info.minor}|".encode())
+        # Order and comments don't change what gets installed
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            lines = sorted(
+                line.split("#", 1)[0].strip().lower()
+                for line in f
+            )
+        digest.update("\n".join(line for line in lines if line).encode())
+    else:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:24]
+
+
+def _template_path(kind, key):
+    return os.path.join(TEMPLATE_DIR, "venv" if kind == "python" else "node_modules", key)
+
+
+def _is_ready(path):
+    return os.path.isfile(os.path.join(path, READY_MARKER))
+
+
+# ------------------------------------------------------------------
+# Copy-on-write cloning
+# ------------------------------------------------------------------
+def copy_file(source, target):
+    """Reflink `source` to `target` when the filesystem can (btrfs, xfs), else copy it."""
+    if fcntl is None:
+        shutil.copy2(source, target)
+        return
+    try:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _rewrite(path, old, new):
+    """Copy of a bin/ script with `old` prefix replaced, or None if not needed."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if old not in data:
+        return None
+    return data.replace(old, new)
+
+
+def clone_tree(src, dst, relocate=False):
+    """
+    Copy every file of `src` into `dst` (see `copy_file`); the clone shares
+    no inode with `src`. With `relocate`, scripts under bin/ that embed the
+    source path (venv shebangs, activate) are rewritten so the clone points
+    at itself.
+    """
+    tmp = f"{dst}.tmp-{uuid.uuid4().hex[:8]}"
+    old, new = os.fsencode(src), os.fsencode(dst)
+    try:
+        for root, dirs, files in os.walk(src):
+            rel = os.path.relpath(root, src)
+            target_root = os.path.join(tmp, rel) if rel != "." else tmp
+            os.makedirs(target_root, exist_ok=True)
+            in_bin = relocate and rel.split(os.sep)[0] == BIN_DIR
+
+            for name in dirs + files:
+                source = os.path.join(root, name)
+                target = os.path.join(target_root, name)
+                if os.path.islink(source):
+                    os.symlink(os.readlink(source), target)
+                    if name in dirs:
+                        dirs.remove(name)  # Don't descend into linked dirs
+                    continue
+                if name in dirs:
+                    continue
+                if name == READY_MARKER and root == src:
+                    continue
+
+                data = _rewrite(source, old, new) if in_bin else None
+                if data is not None:
+                    with open(target, "wb") as f:
+                        f.write(data)
+                    shutil.copymode(source, target)
+                    continue
+                copy_file(source, target)
+        os.replace(tmp, dst)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+# ------------------------------------------------------------------
+# Template pool
+# ------------------------------------------------------------------
+class TemplatePool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._building = set()        # template paths being warmed
+        self._project_locks = {}
+        self._preparing = {}          # project_root -> Future
+        self._executor = ThreadPoolExecutor(max_workers=PREPARE_WORKERS, thread_name_prefix="dep-prepare")
+        self.stats = {"hits": 0, "misses": 0, "warmed": 0, "errors": 0}
+
+    def _project_lock(self, project_root):
+        with self._lock:
+            return self._project_locks.setdefault(os.path.abspath(project_root), threading.Lock())
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _evict(self, kind):
+        base = os.path.dirname(_template_path(kind, "x"))
+        try:
+            entries = [os.path.join(base, d) for d in os.listdir(base) if _is_ready(os.path.join(base, d))]
+        except FileNotFoundError:
+            return
+        entries.sort(key=lambda p: os.path.getmtime(p), reverse=True)
+        for stale in entries[MAX_TEMPLATES:]:
+            shutil.rmtree(stale, ignore_errors=True)
+
+    def prepare_async(self, project_root):
+        """Run `prepare` in the background (once at a time per project); returns its Future."""
+        project_root = os.path.abspath(project_root)
+        with self._lock:
+            future = self._preparing.get(project_root)
+            if future is None or future.done():
+                future = self._executor.submit(self._prepare_logged, project_root)
+                self._preparing[project_root] = future
+            return future
+
+    def _prepare_logged(self, project_root):
+        try:
+            return self.prepare(project_root)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Dependency prepare failed for {project_root}: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._preparing.pop(project_root, None)
+
+    def prepare(self, project_root):
+        """
+        Make sure the project has its dependency trees, cloning a warm template
+        when one matches its manifest. Returns {"python": ..., "node": ...}
+        with "present", "cloned", "warming" or None (no manifest). Blocking:
+        requests use `prepare_async`.
+        """
+        result = {"python": None, "node": None}
+        with self._project_lock(project_root):
+            python_manifest = find_manifest(project_root, "python")
+            if python_manifest:
+                result["python"] = self._prepare_python(project_root, python_manifest)
+            node_manifest = find_manifest(project_root, "node")
+            if node_manifest:
+                result["node"] = self._prepare_node(node_manifest)
+        return result
+
+    def _prepare_python(self, project_root, manifest):
+        venv = os.path.join(project_root, VENV_DIR)
+        if os.path.exists(venv):
+            return "present"
+        template = _template_path("python", manifest_hash(manifest, "python"))
+        if _is_ready(template):
+            clone_tree(template, venv, relocate=True)
+            self._touch(template)
+            self.stats["hits"] += 1
+            metrics.count_cache("deps", True)
+            return "cloned"
+        self.stats["misses"] += 1
+        metrics.count_cache("deps", False)
+        self.warm(manifest, "python")
+        # Bare venv so installs land in the project rather than the server's python
+        subprocess.run([sys.executable, "-m", "venv", venv], check=False, capture_output=True, timeout=120)
+        return "warming"
+
+    def _prepare_node(self, manifest):
+        node_modules = os.path.join(os.path.dirname(manifest), "node_modules")
+        if os.path.exists(node_modules):
+            return "present"
+        template = _template_path("node", manifest_hash(manifest, "node"))
+        if _is_ready(template):
+            clone_tree(template, node_modules)
+            self._touch(template)
+            self.stats["hits"] += 1
+            metrics.count_cache("deps", True)
+            return "cloned"
+        self.stats["misses"] += 1
+        metrics.count_cache("deps", False)
+        self.warm(manifest, "node")
+        return "warming"
+
+    def warm(self, manifest, kind):
+        """Build the template for `manifest` in the background, from the manifest alone."""
+        template = _template_path(kind, manifest_hash(manifest, kind))
+        with self._lock:
+            if template in self._building or _is_ready(template):
+                return False
+            self._building.add(template)
+        os.makedirs(os.path.dirname(template), exist_ok=True)
+        if kind == "python":
+            requirements = os.path.join(os.path.dirname(template), f"{os.path.basename(template)}.txt")
+            shutil.copyfile(manifest, requirements)
+            target, args = self._build_venv, (template, requirements)
+        else:
+            # Snapshot the manifest files now; the project may change them later
+            build_dir = f"{template}.build-{uuid.uuid4().hex[:8]}"
+            os.makedirs(build_dir)
+            for name in NODE_MANIFESTS:
+                path = os.path.join(os.path.dirname(manifest), name)
+                if os.path.isfile(path):
+                    shutil.copyfile(path, os.path.join(build_dir, name))
+            target, args = self._build_node_modules, (template, build_dir)
+        threading.Thread(target=target, args=args, daemon=True).start()
+        return True
+
+    def _build_venv(self, template, requirements):
+        try:
+            # Built in place: a venv can't be renamed without breaking its scripts
+            shutil.rmtree(template, ignore_errors=True)
+            subprocess.run([sys.executable, "-m", "venv", template], check=True, capture_output=True, timeout=120)
+            python = os.path.join(template, BIN_DIR, "python")
+            subprocess.run(
+                [python, "-m", "pip", "install", "-r", requirements],
+                env=install_env(), check=True, capture_output=True, timeout=WARM_TIMEOUT
+            )
+            with open(os.path.join(template, READY_MARKER), "w") as f:
+                f.write(str(time.time()))
+            self.stats["warmed"] += 1
+            self._evict("python")
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Dependency template build failed for {requirements}: {e}")
+            shutil.rmtree(template, ignore_errors=True)
+        finally:
+            try:
+                os.remove(requirements)
+            except OSError:
+                pass
+            with self._lock:
+                self._building.discard(template)
+
+    def _build_node_modules(self, template, build_dir):
+        try:
+            command = ["npm", "ci"] if os.path.isfile(os.path.join(build_dir, "package-lock.json")) else ["npm", "install"]
+            subprocess.run(command, cwd=build_dir, env=install_env(), check=True, capture_output=True,
+                           timeout=WARM_TIMEOUT)
+            shutil.rmtree(template, ignore_errors=True)
+            node_modules = os.path.join(build_dir, "node_modules")
+            os.makedirs(node_modules, exist_ok=True)  # No dependencies: still a valid (empty) template
+            os.replace(node_modules, template)
+            with open(os.path.join(template, READY_MARKER), "w") as f:
+                f.write(str(time.time()))
+            self.stats["warmed"] += 1
+            self._evict("node")
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Dependency template build failed for {build_dir}: {e}")
+            shutil.rmtree(template, ignore_errors=True)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            with self._lock:
+                self._building.discard(template)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, building=len(self._building), preparing=len(self._preparing))
+
+
+def install_env(project_root=None, base=None):
+    """
+    Environment for install/test subprocesses: shared pip and npm caches,
+    the offline index when configured, and the project's venv first on PATH.
+    """
+    env = dict(base if base is not None else os.environ)
+    env["PIP_CACHE_DIR"] = PIP_CACHE_DIR
+    env["npm_config_cache"] = NPM_CACHE_DIR
+    env["npm_config_prefer_offline"] = "true"  # Use cached tarballs without revalidating
+    env.setdefault("PIP_DISABLE_PIP_VERSION_CHECK", "1")
+    if OFFLINE_INDEX:
+        env["PIP_NO_INDEX"] = "1"
+        env["PIP_FIND_LINKS"] = os.path.abspath(OFFLINE_INDEX)
+        env["npm_config_offline"] = "true"
+
+    if project_root:
+        venv = os.path.join(project_root, VENV_DIR)
+        if os.path.isdir(venv):
+            env["VIRTUAL_ENV"] = venv
+            env["PATH"] = os.pathsep.join([os.path.join(venv, BIN_DIR), env.get("PATH", "")])
+            env.pop("PYTHONHOME", None)
+    return env
+
+
+# Global Instance
+pool = TemplatePool()
@@ -0,0 +1,38 @@
+"""
+Gunicorn hooks
+--------------
+gunicorn reads ./gunicorn.conf.py on its own; command line flags (see the
+Dockerfile) still set workers and threads.
+
+With PROMETHEUS_MULTIPROC_DIR set, every worker writes its metrics to files
+in that directory (see metrics.py). Start from an empty directory so counters
+from a previous run are not served again, and mark exited workers dead so
+their live gauges (active sandboxes) stop counting.
+
+Terminal sessions and mentor tips are held in process memory, so the app must
+run as one worker (threads for concurrency); warn if it is started with more.
+"""
+
+import os
+import shutil
+
+
+def on_starting(server):
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def when_ready(server):
+    if server.cfg.workers > 1:
+        server.log.warning(
+            f"Running {server.cfg.workers} workers: terminal sessions and mentor tips are per process, "
+            "so streams and cancels will miss sessions started in another worker. Use -w 1."
+        )
@@ -0,0 +1,166 @@
+"""
+Idea Similarity Cache
+---------------------
+Near-duplicate lookup over past `Project.idea_prompt` values so /generate
+can hand back an existing agents.json instead of paying for a fresh
+generation ("todo app" vs "a simple todo list app").
+
+Ideas are normalized to a token set, signed with MinHash and bucketed with
+LSH banding; candidates from the buckets are confirmed with exact Jaccard.
+The index is built lazily from the DB and topped up incrementally (keyset
+on Project.id) so every gunicorn worker eventually sees every project.
+
+Every entry belongs to its project's `user_identifier` and lookups only see
+the caller's own ideas: another user's team (and their idea text) is never
+handed out.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+from models import Project
+import metrics
+
+SIMILARITY_THRESHOLD = float(os.getenv("IDEA_CACHE_THRESHOLD", "0.5"))
+MAX_ENTRIES = int(os.getenv("IDEA_CACHE_MAX_ENTRIES", "200000"))
+REFRESH_SECONDS = int(os.getenv("IDEA_CACHE_REFRESH_SECONDS", "60"))
+
+NUM_PERM = 64
+BANDS = 32  # 2 rows per band: high recall at Jaccard >= 0.5
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Words that carry no meaning for "is this the same product?"
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "for", "of", "in", "on", "with", "to", "that",
+    "my", "our", "me", "i", "we", "it", "its", "is", "be", "using", "use", "like",
+    "build", "make", "create", "write", "generate", "want", "need", "please",
+    "simple", "basic", "small", "quick", "new", "app", "application", "apps",
+    "website", "site", "web", "tool", "platform", "system", "software", "project",
+}
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Universal hash parameters (a*x + b mod p), fixed so signatures are stable
+_PERMUTATIONS = [
+    (
+        int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _PRIME | 1,
+        int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _PRIME,
+    )
+    for i in range(NUM_PERM)
+]
+
+
+def _stem(word):
+    for suffix in ("ing", "ers", "es", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def normalize(text):
+    """Lower-case, strip markup/punctuation, drop filler words, light stemming."""
+    words = _WORD_RE.findall(_TAG_RE.sub(" ", (text or "").lower()))
+    return frozenset(_stem(w) for w in words if w not in STOPWORDS)
+
+
+def signature(tokens):
+    hashes = [
+        int.from_bytes(hashlib.blake2b(t.encode(), digest_size=8).digest(), "big")
+        for t in tokens
+    ]
+    if not hashes:
+        return None
+    return tuple(
+        min(((a * h + b) % _PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class IdeaIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tokens = {}      # project_id -> token set
+        self._exact = {}       # (owner, token set) -> newest project_id
+        self._buckets = {}     # (owner, band, rows) -> set(project_id)
+        self._max_id = 0
+        self._loaded = False
+        self._last_refresh = 0.0
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _bands(self, owner, sig):
+        for band in range(BANDS):
+            yield (owner, band, sig[band * ROWS:(band + 1) * ROWS])
+
+    def add(self, project_id, idea, owner):
+        tokens = normalize(idea)
+        sig = signature(tokens)
+        if sig is None:
+            return
+        with self._lock:
+            self._tokens[project_id] = tokens
+            self._exact[(owner, tokens)] = max(project_id, self._exact.get((owner, tokens), 0))
+            for key in self._bands(owner, sig):
+                self._buckets.setdefault(key, set()).add(project_id)
+            self._max_id = max(self._max_id, project_id)
+
+    def refresh(self, force=False):
+        """Load projects newer than the newest one indexed (needs an app context)."""
+        now = time.time()
+        if not force and self._loaded and now - self._last_refresh < REFRESH_SECONDS:
+            return
+        with self._lock:
+            query = Project.query.with_entities(Project.id, Project.idea_prompt, Project.user_identifier)
+            if self._loaded:
+                rows = query.filter(Project.id > self._max_id).order_by(Project.id).all()
+            else:
+                # Cold start: newest MAX_ENTRIES ideas only
+                rows = query.order_by(Project.id.desc()).limit(MAX_ENTRIES).all()
+            for project_id, idea, owner in rows:
+                self.add(project_id, idea, owner)
+            self._loaded = True
+            self._last_refresh = now
+
+    def lookup(self, idea, owner, threshold=None):
+        """Return (project_id, similarity) of `owner`'s closest past idea, or None."""
+        threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+        tokens = normalize(idea)
+        sig = signature(tokens)
+        if sig is None:
+            return None
+
+        self.refresh()
+        with self._lock:
+            if (owner, tokens) in self._exact:
+                self.stats["hits"] += 1
+                metrics.count_cache("idea", True)
+                return self._exact[(owner, tokens)], 1.0
+
+            candidates = set()
+            for key in self._bands(owner, sig):
+                candidates |= self._buckets.get(key, set())
+
+            best = None
+            for project_id in candidates:
+                score = jaccard(tokens, self._tokens.get(project_id))
+                if score >= threshold and (best is None or (score, project_id) > (best[1], best[0])):
+                    best = (project_id, score)
+
+            self.stats["hits" if best else "misses"] += 1
+            metrics.count_cache("idea", best is not None)
+            return best
+
+
+# Global Instance
+index = IdeaIndex()
@@ -13,79 +13,201 @@ Idea: serverless observability platform
 → agents.json   (30 AI roles)
 """
 
+import contextvars
 import json
+import logging
 import os
 import sys
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
 import prompt
+import metrics
+import model_router  # Moonshot calls go through the shared llm_gateway pool
 
 # ------------------------------------------------------------------
-# 1. OpenAI-compatible Moon-shot client
+# 1. Sharded generation settings
 # ------------------------------------------------------------------
-client = OpenAI(
-    api_key=os.getenv("MOONSHOT_API_KEY"),
-    base_url="https://api.moonshot.ai/v1"
-)
+# Project section is generated first, then these department shards run
+# concurrently. Counts add up to the same 30 agents as the single-call mode.
+DEPARTMENT_SHARDS = [
+    {"name": "product", "count": 5, "departments": ["Product", "UX", "Research", "Strategy", "Executive"]},
+    {"name": "engineering", "count": 5, "departments": ["Engineering", "QA", "DevOps", "SRE", "Security"]},
+    {"name": "data", "count": 5, "departments": ["IT", "Data-Engineering", "Analytics", "Documentation", "Training"]},
+    {"name": "growth", "count": 5, "departments": ["Marketing", "Sales", "Growth", "Partnerships", "Community"]},
+    {"name": "customer", "count": 5, "departments": ["Customer-Success", "Support", "Solutions-Engineering", "Solutions-Architecture", "Professional-Services"]},
+    {"name": "corporate", "count": 5, "departments": ["Legal", "Compliance", "Finance", "HR", "Talent", "People-Ops"]},
+]
 
-def generate_agents(idea):
+SHARDED_GENERATION = os.getenv("KIMI_SHARDED_GENERATION", "1") == "1"
+MAX_SHARD_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_json(content):
+    content = (content or "").strip()
+    if content.startswith("```"):
+        content = content.strip("`")
+        if content.startswith("json"):
+            content = content[4:]
+    return json.loads(content)
+
+
+def _validate_project(data):
+    project = data.get("project") if isinstance(data, dict) else None
+    if not isinstance(project, dict) or not project.get("name"):
+        raise ValueError("Project section is missing a name")
+    return project
+
+
+def _validate_shard(data, shard):
+    agents = data.get("agents") if isinstance(data, dict) else None
+    if not isinstance(agents, list) or len(agents) != shard["count"]:
+        raise ValueError(f"Shard '{shard['name']}' returned {len(agents) if isinstance(agents, list) else 0} agents, expected {shard['count']}")
+    for agent in agents:
+        if not isinstance(agent, dict) or not all(agent.get(k) for k in ("role", "department", "goal")):
+            raise ValueError(f"Shard '{shard['name']}' returned an incomplete agent")
+        if not isinstance(agent.get("key_tasks"), list):
+            raise ValueError(f"Shard '{shard['name']}' agent '{agent['role']}' has no key_tasks list")
+    return agents
+
+
+def _generate_project(idea):
+    response = model_router.complete(
+        "generate_agents",
+        [
+            {"role": "system", "content": prompt.PROJECT_PROMPT},
+            {"role": "user", "content": idea}
+        ],
+        temperature=0.3,
+        max_tokens=1536,
+        response_format={"type": "json_object"}
+    )
+    return _validate_project(_parse_json(response.choices[0].message.content))
+
+
+def _generate_shard(idea, project, shard):
+    """Generate one department shard, retrying only this shard on bad output."""
+    request = (
+        f"Idea: {idea}\n\n"
+        f"Project: {json.dumps(project, ensure_ascii=False)}\n\n"
+        f"Departments: {', '.join(shard['departments'])}\n"
+        f"Number of agents: {shard['count']}"
+    )
+    last_error = None
+    for attempt in range(MAX_SHARD_ATTEMPTS):
+        if attempt:
+            metrics.SHARD_RETRIES.inc()
+        try:
+            response = model_router.complete(
+                "generate_agents",
+                [
+                    {"role": "system", "content": prompt.AGENT_SHARD_PROMPT},
+                    {"role": "user", "content": request}
+                ],
+                temperature=0.3,
+                max_tokens=2048,
+                response_format={"type": "json_object"}
+            )
+            return _validate_shard(_parse_json(response.choices[0].message.content), shard)
+        except (ValueError, json.JSONDecodeError) as e:
+            last_error = e
+    raise ValueError(f"Shard '{shard['name']}' failed after {MAX_SHARD_ATTEMPTS} attempts: {last_error}")
+
+
+def _generate_sharded(idea):
+    project = _generate_project(idea)
+
+    # Each worker runs in a copy of this context so the request's trace id and
+    # scheduler tenant follow the shard calls into the pool threads
+    with ThreadPoolExecutor(max_workers=len(DEPARTMENT_SHARDS)) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, _generate_shard, idea, project, shard)
+            for shard in DEPARTMENT_SHARDS
+        ]
+        agents = []
+        for future in futures:
+            agents.extend(future.result())
+
+    return {"project": project, "agents": agents}
+
+
+def _generate_single(idea):
+    response = model_router.complete(
+        "generate_agents",
+        [
+            {"role": "system", "content": prompt.SYSTEM_PROMPT},
+            {"role": "user", "content": idea}
+        ],
+        temperature=0.3,
+        max_tokens=8192,
+        top_p=1,
+        stream=False
+    )
+    return json.loads(response.choices[0].message.content)
+
+
+def unused_project_name(name):
+    """`name`, or "`name` 2", "`name` 3"... whichever has no projects/ folder yet."""
+    candidate, n = name, 1
+    while os.path.exists(os.path.join("projects", candidate.replace(" ", "_").replace("/", "-"))):
+        n += 1
+        candidate = f"{name} {n}"
+    return candidate
+
+
+def save_agents(idea, agents_data):
+    """
+    Writes agents.json into the project folder and returns agents_data with
+    `local_path` and `project_name` filled in.
+    """
+    project_name = "Untitled_Project"
+    if "project" in agents_data and "name" in agents_data["project"]:
+         project_name = agents_data["project"]["name"].replace(" ", "_").replace("/", "-")
+    else:
+         # Fallback: sanitize idea
+         project_name = idea.split()[0:3] 
+         project_name = "_".join(project_name).replace(" ", "_").replace("/", "-")
+
+    project_dir = os.path.join("projects", project_name)
+    os.makedirs(project_dir, exist_ok=True)
+
+    output_file = os.path.join(project_dir, "agents.json")
+    with open(output_file, "w", encoding="utf-8") as fh:
+        json.dump(agents_data, fh, indent=2, ensure_ascii=False)
+        
+    # Add local path to result so app can use it
+    agents_data["local_path"] = output_file
+    agents_data["project_name"] = project_name
+    
+    return agents_data
+
+
+def generate_agents(idea, sharded=None):
     """
     Generates a list of agents based on the provided idea using the Moonshot API.
+    In sharded mode (default) the project section is generated first and the
+    department shards run concurrently, so latency is that of the slowest shard.
     """
-    # ------------------------------------------------------------------
-    # 2. Fire the request (non-streaming so we can parse JSON)
-    # ------------------------------------------------------------------
+    if sharded is None:
+        sharded = SHARDED_GENERATION
+    mode = "sharded" if sharded else "single"
+
     try:
-        response = client.chat.completions.create(
-            model="kimi-k2-0905-preview",
-            messages=[
-                {"role": "system", "content": prompt.SYSTEM_PROMPT},
-                {"role": "user", "content": idea}
-            ],
-            temperature=0.3,
-            max_tokens=8192,
-            top_p=1,
-            stream=False
-        )
-        content = response.choices[0].message.content
-        
         # ------------------------------------------------------------------
-        # 3. Parse & validate JSON
+        # 2. Fire the request(s) (non-streaming so we can parse JSON)
         # ------------------------------------------------------------------
-        agents_data = json.loads(content)
-        
+        agents_data = _generate_sharded(idea) if sharded else _generate_single(idea)
 
-        # Depending on how the model returns it, it might be the full object or just the agents list
-        # The prompt asks for a JSON object with "project" and "agents" keys.
-        if "agents" in agents_data:
-             if len(agents_data["agents"]) > 30:
-                 pass
-        
         # ------------------------------------------------------------------
-        # 4. Save to Project Folder
+        # 3. Save to Project Folder
         # ------------------------------------------------------------------
-        project_name = "Untitled_Project"
-        if "project" in agents_data and "name" in agents_data["project"]:
-             project_name = agents_data["project"]["name"].replace(" ", "_").replace("/", "-")
-        else:
-             # Fallback: sanitize idea
-             project_name = idea.split()[0:3] 
-             project_name = "_".join(project_name).replace(" ", "_").replace("/", "-")
-
-        project_dir = os.path.join("projects", project_name)
-        os.makedirs(project_dir, exist_ok=True)
-
-        output_file = os.path.join(project_dir, "agents.json")
-        with open(output_file, "w", encoding="utf-8") as fh:
-            json.dump(agents_data, fh, indent=2, ensure_ascii=False)
-            
-        # Add local path to result so app can use it
-        agents_data["local_path"] = output_file
-        agents_data["project_name"] = project_name
-        
+        agents_data = save_agents(idea, agents_data)
+        metrics.GENERATIONS.labels(mode, "ok").inc()
         return agents_data
 
     except Exception as exc:
-        print(f"Error during generation: {exc}")
+        metrics.GENERATIONS.labels(mode, "error").inc()
+        logger.error(f"Error during generation: {exc}")
         raise exc
 
 # ------------------------------------------------------------------
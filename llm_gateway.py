@@ -0,0 +1,266 @@
+"""
+LLM Gateway
+-----------
+The one place that owns the Moonshot (OpenAI-compatible) clients. Every
+completion in the app goes through `chat_completion` (or the async
+`achat_completion`) so that connection pooling, timeouts, retries and the
+global concurrency cap are configured once.
+
+Each call carries a request-level trace id (X-Request-Id header) taken from
+the current context, see `bind_trace_id`, and is admitted by the rate-limit
+scheduler under the tenant bound with `bind_tenant`.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import os
+import random
+import threading
+import time
+import uuid
+import weakref
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError, RateLimitError
+
+import llm_scheduler
+import metrics
+import tracing
+
+# ------------------------------------------------------------------
+# 1. Configuration
+# ------------------------------------------------------------------
+BASE_URL = os.getenv("MOONSHOT_BASE_URL", "https://api.moonshot.ai/v1")
+DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "64"))
+POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "32"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+
+try:
+    import h2  # noqa: F401  (enables httpx HTTP/2 support)
+    HTTP2_ENABLED = True
+except ImportError:
+    HTTP2_ENABLED = False
+
+# ------------------------------------------------------------------
+# 2. Request-level trace id and scheduling tenant
+# ------------------------------------------------------------------
+_trace_id = contextvars.ContextVar("llm_trace_id", default=None)
+_tenant = contextvars.ContextVar("llm_tenant", default="anonymous")
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def bind_trace_id(trace_id=None):
+    """Attach a trace id to the current context (e.g. once per HTTP request)."""
+    trace_id = trace_id or new_trace_id()
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+def bind_tenant(tenant):
+    """Calls made in this context are queued fairly under `tenant` (user/project)."""
+    _tenant.set(tenant or "anonymous")
+    return _tenant.get()
+
+
+def current_tenant():
+    return _tenant.get()
+
+
+# ------------------------------------------------------------------
+# 3. Pooled clients
+# ------------------------------------------------------------------
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncOpenAI
+
+
+def _timeout():
+    return httpx.Timeout(DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY
+    )
+
+
+def get_client():
+    """Shared sync client (one keep-alive pool per process)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=os.getenv("MOONSHOT_API_KEY"),
+                    base_url=BASE_URL,
+                    max_retries=0,  # Retries are handled here, not inside the SDK
+                    timeout=_timeout(),
+                    http_client=httpx.Client(http2=HTTP2_ENABLED, limits=_limits(), timeout=_timeout())
+                )
+    return _client
+
+
+def get_async_client():
+    """Async client bound to the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=os.getenv("MOONSHOT_API_KEY"),
+            base_url=BASE_URL,
+            max_retries=0,
+            timeout=_timeout(),
+            http_client=httpx.AsyncClient(http2=HTTP2_ENABLED, limits=_limits(), timeout=_timeout())
+        )
+        _async_clients[loop] = client
+    return client
+
+
+# ------------------------------------------------------------------
+# 4. Concurrency cap & retry policy
+# ------------------------------------------------------------------
+_semaphore = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_async_semaphores = weakref.WeakKeyDictionary()  # event loop -> asyncio.Semaphore
+
+
+def _get_async_semaphore():
+    loop = asyncio.get_running_loop()
+    sem = _async_semaphores.get(loop)
+    if sem is None:
+        sem = asyncio.Semaphore(MAX_CONCURRENCY)
+        _async_semaphores[loop] = sem
+    return sem
+
+
+def is_retryable(exc):
+    """429s, 5xx, timeouts and dropped connections are worth retrying."""
+    if isinstance(exc, (RateLimitError, APIConnectionError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt, exc=None):
+    """Exponential backoff with full jitter, honouring Retry-After if sent."""
+    response = getattr(exc, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(BACKOFF_MAX, float(retry_after))
+            except ValueError:
+                pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _response_headers(exc):
+    response = getattr(exc, "response", None)
+    return response.headers if response is not None else None
+
+
+def _admit(messages, priority, max_tokens=None, tenant=None):
+    """Wait for rate-limit budget; returns the token reservation for `_settle`."""
+    reserved = llm_scheduler.estimate_tokens(messages, max_tokens)
+    return llm_scheduler.scheduler.acquire(tenant or current_tenant(), priority, reserved)
+
+
+def _settle(reserved, response=None, headers=None, exc=None):
+    """Report the outcome of an admitted call back to the scheduler."""
+    if exc is None:
+        usage = getattr(response, "usage", None)
+        llm_scheduler.scheduler.complete(reserved, getattr(usage, "total_tokens", None), headers)
+        return response
+    headers = _response_headers(exc)
+    if isinstance(exc, RateLimitError):
+        metrics.LLM_RATE_LIMITED.inc()
+        llm_scheduler.scheduler.throttled(headers)
+    else:
+        llm_scheduler.scheduler.complete(reserved, 0, headers)
+    return None
+
+
+def _prepare(kwargs, trace_id, timeout):
+    trace_id = trace_id or current_trace_id() or new_trace_id()
+    headers = dict(kwargs.pop("extra_headers", None) or {})
+    headers["X-Request-Id"] = trace_id
+    kwargs["extra_headers"] = headers
+    kwargs["timeout"] = timeout or DEFAULT_TIMEOUT
+    return kwargs
+
+
+def chat_completion(model, messages, timeout=None, trace_id=None, retries=None, slot=None, **kwargs):
+    """
+    Blocking chat completion with pooling, timeouts, retries and a global cap.
+    `retries` overrides LLM_MAX_RETRIES; `slot` is an extra semaphore (e.g. a
+    per-model limit) held like the global one, only while a request is in flight.
+    """
+    kwargs = _prepare(kwargs, trace_id, timeout)
+    client = get_client()
+    priority = kwargs.pop("priority", llm_scheduler.PRIORITY_BATCH)
+    retries = MAX_RETRIES if retries is None else retries
+
+    for attempt in range(retries + 1):
+        with tracing.span("scheduler.admit"):
+            reserved = _admit(messages, priority, kwargs.get("max_tokens"))
+        with _semaphore, (slot or contextlib.nullcontext()):
+            try:
+                with tracing.span("llm.request", model=model, attempt=attempt):
+                    raw = client.chat.completions.with_raw_response.create(model=model, messages=messages, **kwargs)
+                    response = raw.parse()
+            except Exception as exc:
+                _settle(reserved, exc=exc)
+                if attempt >= retries or not is_retryable(exc):
+                    raise
+                delay = backoff_delay(attempt, exc)
+            else:
+                # Outside the try: the reservation is settled once, as a success
+                return _settle(reserved, response, raw.headers)
+        # Sleep outside the semaphore so waiting retries don't hold a slot
+        with tracing.span("llm.backoff", attempt=attempt):
+            time.sleep(delay)
+
+
+async def achat_completion(model, messages, timeout=None, trace_id=None, **kwargs):
+    """Async counterpart of `chat_completion`."""
+    kwargs = _prepare(kwargs, trace_id, timeout)
+    client = get_async_client()
+    sem = _get_async_semaphore()
+    priority = kwargs.pop("priority", llm_scheduler.PRIORITY_BATCH)
+    tenant = current_tenant()
+
+    for attempt in range(MAX_RETRIES + 1):
+        # The scheduler blocks on a threading.Condition; keep it off the loop
+        with tracing.span("scheduler.admit"):
+            reserved = await asyncio.to_thread(_admit, messages, priority, kwargs.get("max_tokens"), tenant)
+        async with sem:
+            try:
+                with tracing.span("llm.request", model=model, attempt=attempt):
+                    raw = await client.chat.completions.with_raw_response.create(model=model, messages=messages, **kwargs)
+                    response = raw.parse()
+            except Exception as exc:
+                _settle(reserved, exc=exc)
+                if attempt >= MAX_RETRIES or not is_retryable(exc):
+                    raise
+                delay = backoff_delay(attempt, exc)
+            else:
+                # Outside the try: the reservation is settled once, as a success
+                return _settle(reserved, response, raw.headers)
+        with tracing.span("llm.backoff", attempt=attempt):
+            await asyncio.sleep(delay)
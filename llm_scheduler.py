@@ -0,0 +1,225 @@
+"""
+LLM Rate-Limit Scheduler
+------------------------
+Client-side admission control in front of the Moonshot API. Two token
+buckets (requests/min and tokens/min) are kept in sync with the provider's
+`x-ratelimit-*` response headers, and waiting calls are granted fairly:
+
+- Strict priority: interactive calls (/chat, debug, mentor) before batch
+  builds.
+- Round-robin across tenants (user/project) within a priority class, so one
+  30-agent build can't starve everyone else.
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+DEFAULT_RPM = int(os.getenv("LLM_RPM_LIMIT", "200"))
+DEFAULT_TPM = int(os.getenv("LLM_TPM_LIMIT", "2000000"))
+DEFAULT_MAX_TOKENS = 1024  # Assumed completion size when max_tokens isn't given
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset(value):
+    """Parse reset values like '1s', '6m0s', '20ms' or plain seconds."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+        return seconds if math.isfinite(seconds) and seconds >= 0 else None
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """Cheap upper-bound estimate (~4 chars per token) used for admission."""
+    chars = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            chars += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    return chars // 4 + (max_tokens or DEFAULT_MAX_TOKENS)
+
+
+class TokenBucket:
+    """Continuously refilling bucket; capacity is the per-minute limit."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        rate = self.capacity / 60.0
+        self.available = min(self.capacity, self.available + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` is available (0 if it already is)."""
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / (self.capacity / 60.0)
+
+    def sync(self, limit=None, remaining=None, now=None):
+        """Adopt the provider's view of the budget."""
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.available = min(self.capacity, float(remaining))
+        self.updated = now or time.monotonic()
+
+
+class RateLimitScheduler:
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._cond = threading.Condition()
+        self._queues = {PRIORITY_INTERACTIVE: OrderedDict(), PRIORITY_BATCH: OrderedDict()}
+        self._paused_until = 0.0
+        self.stats = {"granted": 0, "throttled": 0, "wait_total": 0.0}
+
+    def _head(self):
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            if queue:
+                tenant, tickets = next(iter(queue.items()))
+                return priority, tenant, tickets[0]
+        return None
+
+    def _pop_head(self, priority, tenant):
+        queue = self._queues[priority]
+        tickets = queue[tenant]
+        tickets.popleft()
+        if tickets:
+            queue.move_to_end(tenant)  # Round-robin to the next tenant
+        else:
+            del queue[tenant]
+
+    def _remove(self, priority, tenant, ticket):
+        tickets = self._queues[priority].get(tenant)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._queues[priority][tenant]
+
+    def acquire(self, tenant="anonymous", priority=PRIORITY_BATCH, tokens=DEFAULT_MAX_TOKENS, timeout=None):
+        """
+        Block until this call may be sent. Returns the number of tokens reserved,
+        which should be handed back to `complete` once the real usage is known.
+        """
+        ticket = object()
+        start = time.monotonic()
+        deadline = start + timeout if timeout else None
+
+        with self._cond:
+            self._queues[priority].setdefault(tenant, deque()).append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+
+                    head = self._head()
+                    if head and head[2] is ticket:
+                        wait = max(
+                            self._paused_until - now,
+                            self.requests.wait_time(1),
+                            self.tokens.wait_time(tokens)
+                        )
+                        if wait <= 0:
+                            self._pop_head(priority, tenant)
+                            self.requests.available -= 1
+                            self.tokens.available -= min(tokens, self.tokens.capacity)
+                            self.stats["granted"] += 1
+                            self.stats["wait_total"] += now - start
+                            self._cond.notify_all()
+                            return tokens
+                    else:
+                        wait = None  # Not our turn; woken when the head changes
+
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            raise TimeoutError("Timed out waiting for LLM rate-limit budget")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            except BaseException:
+                self._remove(priority, tenant, ticket)
+                self._cond.notify_all()
+                raise
+
+    def complete(self, reserved_tokens, used_tokens=None, headers=None):
+        """Reconcile the reservation with actual usage and provider headers."""
+        with self._cond:
+            now = time.monotonic()
+            if used_tokens is not None:
+                self.tokens.available = min(self.tokens.capacity, self.tokens.available + reserved_tokens - used_tokens)
+            if headers:
+                self._sync_headers(headers, now)
+            self._cond.notify_all()
+
+    def throttled(self, headers=None, retry_after=None):
+        """Provider answered 429: pause all admissions for the advised time."""
+        with self._cond:
+            now = time.monotonic()
+            self.stats["throttled"] += 1
+            if headers:
+                self._sync_headers(headers, now)
+            if retry_after is None and headers:
+                retry_after = parse_reset(headers.get("retry-after") or headers.get("x-ratelimit-reset-requests"))
+            pause = retry_after if retry_after is not None else 1.0
+            self._paused_until = max(self._paused_until, now + pause)
+            self._cond.notify_all()
+
+    def _sync_headers(self, headers, now):
+        def get(name):
+            # Advisory only: a malformed header is skipped, never raised on a paid call
+            try:
+                return int(float(headers.get(name)))
+            except (TypeError, ValueError, OverflowError):
+                return None
+
+        self.requests.sync(
+            limit=get("x-ratelimit-limit-requests"),
+            remaining=get("x-ratelimit-remaining-requests"),
+            now=now
+        )
+        self.tokens.sync(
+            limit=get("x-ratelimit-limit-tokens"),
+            remaining=get("x-ratelimit-remaining-tokens"),
+            now=now
+        )
+
+    def get_stats(self):
+        with self._cond:
+            waiting = sum(len(t) for q in self._queues.values() for t in q.values())
+            return {
+                "rpm_capacity": self.requests.capacity,
+                "rpm_available": round(self.requests.available, 2),
+                "tpm_capacity": self.tokens.capacity,
+                "tpm_available": round(self.tokens.available, 2),
+                "waiting": waiting,
+                "granted": self.stats["granted"],
+                "throttled": self.stats["throttled"],
+                "avg_wait_ms": round(1000 * self.stats["wait_total"] / self.stats["granted"], 1) if self.stats["granted"] else 0.0,
+            }
+
+
+# Global Instance
+scheduler = RateLimitScheduler()
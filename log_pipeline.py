@@ -0,0 +1,201 @@
+"""
+Log Pipeline
+------------
+Non-blocking, structured logging for the app:
+
+- Request threads only put records on a queue (`QueueHandler`); one
+  `QueueListener` thread formats and writes them, so disk and console I/O
+  never add latency to terminal, build or test requests.
+- The file (LOG_FILE, default security.{pid}.log) gets one JSON object per
+  line with `request_id` and `job_id` (terminal session, build...) attached,
+  rotated by size (LOG_MAX_BYTES / LOG_BACKUP_COUNT) or, when LOG_ROTATE_WHEN
+  is set ("midnight", "H", ...), by time. The console stays human-readable.
+  Rotation isn't safe with several processes on one file, so `{pid}` in
+  LOG_FILE gives each process (gunicorn worker, CLI command) its own; with
+  LOG_FILE=- the JSON lines go to stdout instead, for the container's log
+  collector.
+- Noisy events can be sampled: records logged with
+  `extra={"sample": "github.file"}` are kept at the rate configured in
+  LOG_SAMPLE ("github.file=0.1,terminal.command=1"). Warnings and errors are
+  never dropped.
+- Every record passes redaction.LogFilter before it is written.
+
+    log_pipeline.configure()               # once, at startup
+    log_pipeline.bind_request(trace_id)    # per request (same id as LLM calls)
+    log_pipeline.bind_job(session_id)      # tag records from this context
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+
+import redaction
+
+LOG_FILE = os.getenv("LOG_FILE", "security.{pid}.log")  # "-" = JSON lines on stdout
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN")  # Time-based rotation instead of size
+DEFAULT_SAMPLE = "github.file=0.1"
+
+_request_id = contextvars.ContextVar("log_request_id", default=None)
+_job_id = contextvars.ContextVar("log_job_id", default=None)
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sample"}
+
+_listener = None
+
+
+def parse_sample_rates(spec):
+    rates = {}
+    for item in (spec or "").split(","):
+        key, _, rate = item.partition("=")
+        if key.strip() and rate.strip():
+            rates[key.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(os.getenv("LOG_SAMPLE", DEFAULT_SAMPLE))
+
+
+# ------------------------------------------------------------------
+# Context
+# ------------------------------------------------------------------
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+def bind_request(request_id=None):
+    """Tag records logged from this context with `request_id` (generated if None); clears the job."""
+    request_id = request_id or new_request_id()
+    _request_id.set(request_id)
+    _job_id.set(None)
+    return request_id
+
+
+def new_job_id(kind):
+    return f"{kind}-{uuid.uuid4().hex[:12]}"
+
+
+def bind_job(job_id):
+    """Tag records from this context with a job (terminal session, build, test run)."""
+    _job_id.set(job_id)
+
+
+def current_ids():
+    return _request_id.get(), _job_id.get()
+
+
+class ContextFilter(logging.Filter):
+    """Stamps ids on the record in the calling thread, before it is queued."""
+
+    def filter(self, record):
+        record.request_id, record.job_id = current_ids()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = SAMPLE_RATES if rates is None else rates
+        self.dropped = 0
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None or record.levelno >= logging.WARNING:
+            return True
+        if random.random() < self.rates.get(key, 1.0):
+            return True
+        self.dropped += 1
+        return False
+
+
+# ------------------------------------------------------------------
+# Formatting
+# ------------------------------------------------------------------
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "job_id": getattr(record, "job_id", None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        return f"{line} [req={request_id}]" if request_id else line
+
+
+# ------------------------------------------------------------------
+# Setup
+# ------------------------------------------------------------------
+def _file_handler():
+    if LOG_FILE == "-":
+        return logging.StreamHandler(sys.stdout)
+    # Resolved when configure() runs, i.e. in the worker after gunicorn forks
+    path = LOG_FILE.replace("{pid}", str(os.getpid()))
+    if ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(path, when=ROTATE_WHEN, backupCount=BACKUP_COUNT)
+    return logging.handlers.RotatingFileHandler(path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
+
+
+def configure():
+    """Route the root logger through the queue (idempotent)."""
+    global _listener
+    if _listener is None:
+        file_handler = _file_handler()
+        file_handler.setFormatter(JsonFormatter())
+        handlers = [file_handler]
+        if LOG_FILE != "-":  # Otherwise stdout already carries every record
+            console = logging.StreamHandler()
+            console.setFormatter(TextFormatter())
+            handlers.append(console)
+        for handler in handlers:
+            handler.addFilter(redaction.LogFilter())  # In the listener thread, off the request path
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter())  # Drop first, then tag
+        queue_handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """Flush queued records (atexit, tests)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,6 +1,8 @@
 import os
 import json
 
+import redaction
+
 MEMORY_FILE = "project_memory.json"
 
 def get_memory(project_name):
@@ -28,8 +30,8 @@ def save_memory(project_name, role, content):
     project_mem = all_memory.get(project_name, {})
     agent_mem = project_mem.get(role, [])
     
-    # Simple list of messages/context
-    agent_mem.append(content)
+    # Simple list of messages/context (never persist credentials)
+    agent_mem.append(redaction.redact(content))
     
     project_mem[role] = agent_mem
     all_memory[project_name] = project_mem
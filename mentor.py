@@ -1,85 +1,340 @@
+"""
+Mentor
+------
+Watches what a developer does (builds, saves, test runs, sandbox...) and
+occasionally offers a one-sentence tip.
+
+State is kept per (user, project) in `MentorSession`s, where the user is
+the caller's identity (GitHub user, else "anonymous_<ip>", see caller_id in
+app.py) so signed-out users never share events or tips; at most
+MENTOR_MAX_SESSIONS of them (least recently active dropped first), each with
+its own event history and cooldown, so one busy user never starves another.
+
+`log_event()` only enqueues; a background consumer drains the queue, waits
+for a session's burst of activity to settle (MENTOR_DEBOUNCE seconds of
+quiet) and runs a small local rule engine over it:
+
+- repeated error: the same error signature keeps coming back
+- edit/test loop: save, tests fail, save, tests fail... without a pass
+- milestone: a build completes, or tests pass again after failures
+
+Only when a rule fires is the LLM asked for a tip, with the finding as its
+focus, on a small thread pool (MENTOR_TIP_WORKERS) so a slow completion never
+holds up the consumer or other sessions. Tips are pushed to that user's
+browser over SSE (/api/mentor/stream).
+
+Tips live in this process's memory, like terminal sessions: the app runs as
+one gunicorn worker (see the Dockerfile).
+"""
+
+import logging
+import os
+import queue
+import re
+import threading
 import time
-from collections import deque
-from builder import client  # Reuse the configured OpenAI/Moonshot client
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
-class MentorAgent:
-    def __init__(self):
+import metrics
+import model_router  # Routes through the shared llm_gateway client
+import redaction
+import usage
+
+DEBOUNCE = float(os.getenv("MENTOR_DEBOUNCE", "5"))
+COOLDOWN = int(os.getenv("MENTOR_COOLDOWN", "45"))  # Seconds between tips, per session
+MAX_SESSIONS = int(os.getenv("MENTOR_MAX_SESSIONS", "1000"))
+TIP_WORKERS = int(os.getenv("MENTOR_TIP_WORKERS", "4"))
+REPEAT_THRESHOLD = 3  # Same error signature this many times -> "stuck"
+LOOP_THRESHOLD = 3    # Save -> failing tests cycles -> "edit/test loop"
+MAX_TIPS = 500  # Published tips kept for SSE replay
+
+logger = logging.getLogger(__name__)
+
+# Event kinds the rules understand; anything else is "note"
+ERROR, SAVE, TEST_FAILED, TESTS_FAILED, TESTS_PASSED, BUILD_COMPLETE, NOTE = (
+    "error", "save", "test_failed", "tests_failed", "tests_passed", "build_complete", "note")
+KINDS = frozenset((ERROR, SAVE, TEST_FAILED, TESTS_FAILED, TESTS_PASSED, BUILD_COMPLETE, NOTE))
+
+_NUMBER_RE = re.compile(r"\b(0x[0-9a-f]+|\d+)\b", re.I)
+_PATH_RE = re.compile(r"(?:[\w.-]+[\\/])+([\w.-]+)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def error_signature(text):
+    """Error text without the parts that vary between repeats (line numbers, addresses, dirs)."""
+    text = _PATH_RE.sub(r"\1", text or "")
+    text = _NUMBER_RE.sub("N", text)
+    return _SPACE_RE.sub(" ", text).strip().lower()[:160]
+
+
+class MentorSession:
+    def __init__(self, user_id, project_name):
+        self.user_id = user_id
+        self.project_name = project_name
         self.recent_events = deque(maxlen=20) # Keep last 20 events
         self.last_tip_time = 0
-        self.tip_cooldown = 45 # Seconds between tips
-        
+        self.last_event_at = 0
+        self.errors = Counter()  # signature -> occurrences since the last tip about it
+        self.loop_cycles = 0     # save -> failing tests, without a pass in between
+        self.saved_since_failure = False
+        self.had_failures = False
+        self.milestone = None
+
+    def record(self, ts, kind, text, subject=None):
+        stamp = time.strftime("%H:%M:%S", time.localtime(ts))
+        self.recent_events.append(f"[{stamp}] {text}")
+        self.last_event_at = ts
+
+        if kind in (ERROR, TEST_FAILED):
+            self.errors[error_signature(f"{subject or ''} {text}" if kind == ERROR else text)] += 1
+            if len(self.errors) > 50:
+                self.errors = Counter(dict(self.errors.most_common(20)))
+        elif kind == SAVE:
+            self.saved_since_failure = True
+        elif kind == TESTS_FAILED:
+            if self.saved_since_failure:
+                self.loop_cycles += 1
+            self.saved_since_failure = False
+            self.had_failures = True
+        elif kind == TESTS_PASSED:
+            if self.had_failures:
+                self.milestone = "Their failing tests pass again."
+            self.loop_cycles = 0
+            self.had_failures = False
+            self.errors.clear()
+        elif kind == BUILD_COMPLETE:
+            self.milestone = "Their build just completed."
+
+
+# ------------------------------------------------------------------
+# Rules
+# ------------------------------------------------------------------
+def rule_repeated_error(s):
+    if not s.errors:
+        return None
+    signature, count = s.errors.most_common(1)[0]
+    if count < REPEAT_THRESHOLD:
+        return None
+    del s.errors[signature]
+    return f"The same error has come back {count} times: {signature}"
+
+
+def rule_edit_test_loop(s):
+    if s.loop_cycles < LOOP_THRESHOLD:
+        return None
+    cycles, s.loop_cycles = s.loop_cycles, 0
+    return f"They have edited and re-run failing tests {cycles} times without a pass."
+
+
+def rule_milestone(s):
+    finding, s.milestone = s.milestone, None
+    return finding
+
+
+RULES = [rule_repeated_error, rule_edit_test_loop, rule_milestone]
+
+
+class MentorAgent:
+    def __init__(self):
+        self.tip_cooldown = COOLDOWN
+        self.sessions = OrderedDict()  # (user, project) -> MentorSession, least recent first
+        self._queue = queue.Queue()
+        self._pending = {}  # (user, project) -> time of its last unprocessed event
+        self._tips = deque(maxlen=MAX_TIPS)  # (seq, (user, project), tip)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._consumer = None
+        self._start_lock = threading.Lock()
+        self._tip_pool = ThreadPoolExecutor(max_workers=TIP_WORKERS, thread_name_prefix="mentor-tip")
+        self._generating = set()  # (user, project) with a tip request in flight
+        self.stats = {"events": 0, "evaluations": 0, "rules_fired": 0, "llm_calls": 0, "tips": 0}
+
     def sanitize_event(self, text):
-        import re
-        # Redact OpenAI/Sk keys
-        text = re.sub(r'sk-[a-zA-Z0-9]{20,}', 'sk-[REDACTED]', text)
-        # Redact generic bearer tokens
-        text = re.sub(r'Bearer [a-zA-Z0-9\-\._~]+', 'Bearer [REDACTED]', text)
-        return text
-    
-    def log_event(self, event):
-        """Log an event (e.g., 'Build started', 'User edited main.py')"""
-        timestamp = time.strftime("%H:%M:%S")
-        safe_event = self.sanitize_event(str(event))
-        self.recent_events.append(f"[{timestamp}] {safe_event}")
-        
-    def generate_tip(self, project_name):
+        return redaction.redact(text)
+
+    def log_event(self, event, project_name=None, user_id=None, kind=NOTE, subject=None):
+        """
+        Log an event (e.g., 'Build started', 'User edited main.py'). Never blocks.
+        `kind` is one of the event kinds above (anything else counts as NOTE);
+        `subject` the file or test it is about.
         """
-        Decide if a tip is needed based on recent events.
+        if not project_name or not user_id:
+            return  # Nothing to attach it to
+        if kind not in KINDS:
+            kind = NOTE  # Client-supplied; also keeps the metric's label set bounded
+        self._ensure_consumer()
+        key = (user_id, project_name)
+        self._queue.put((time.time(), key, kind, self.sanitize_event(str(event)), subject))
+
+    def session_for(self, key):
+        s = self.sessions.get(key)
+        if s is None:
+            s = self.sessions[key] = MentorSession(*key)
+            while len(self.sessions) > MAX_SESSIONS:
+                old_key, _ = self.sessions.popitem(last=False)
+                self._pending.pop(old_key, None)
+        self.sessions.move_to_end(key)
+        return s
+
+    # ------------------------------------------------------------------
+    # Consumer
+    # ------------------------------------------------------------------
+    def _ensure_consumer(self):
+        if self._consumer is not None:
+            return
+        with self._start_lock:
+            if self._consumer is None:
+                self._consumer = threading.Thread(target=self._run, name="mentor", daemon=True)
+                self._consumer.start()
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._pending:
+                timeout = max(0.0, min(self._pending.values()) + DEBOUNCE - time.time())
+            try:
+                ts, key, kind, text, subject = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                pass
+            else:
+                self.stats["events"] += 1
+                metrics.MENTOR_EVENTS.labels(kind).inc()
+                self.session_for(key).record(ts, kind, text, subject)
+                self._pending[key] = ts
+
+            now = time.time()
+            for key, last in list(self._pending.items()):
+                if now - last >= DEBOUNCE:
+                    del self._pending[key]
+                    try:
+                        self._evaluate(self.sessions[key])
+                    except Exception as e:
+                        logger.warning(f"Mentor Error: {e}")
+
+    def triage(self, s):
+        """Run the rules; the first finding (or None) decides whether to ask the LLM."""
+        for rule in RULES:
+            finding = rule(s)
+            if finding:
+                self.stats["rules_fired"] += 1
+                metrics.MENTOR_RULES.labels(rule.__name__[len("rule_"):]).inc()
+                return finding
+        return None
+
+    def _evaluate(self, s):
+        # Rules consume their findings, so only run them once a tip can be
+        # requested; until then the session is left as is and looked at again
+        # when the cooldown ends (or the tip in flight is done)
+        key = (s.user_id, s.project_name)
+        ready_at = s.last_tip_time + self.tip_cooldown
+        if key in self._generating or time.time() < ready_at:
+            self._pending[key] = max(time.time(), ready_at - DEBOUNCE)
+            return
+        self.stats["evaluations"] += 1
+        finding = self.triage(s)
+        if not finding:
+            return
+        self._generating.add(key)
+        self._tip_pool.submit(self._tip, s, list(s.recent_events), finding)
+
+    def _tip(self, s, events, finding):
+        key = (s.user_id, s.project_name)
+        try:
+            # Tips are spend of the user being mentored
+            usage.bind(s.user_id, s.project_name)
+            tip = self.generate_tip(s.project_name, events, finding)
+            if tip:
+                s.last_tip_time = time.time()
+                self.publish(key, tip)
+        finally:
+            self._generating.discard(key)
+
+    # ------------------------------------------------------------------
+    # Tips
+    # ------------------------------------------------------------------
+    def generate_tip(self, project_name, events, finding):
+        """
+        Ask the LLM for a tip about `finding`, with the recent events as context.
         Returns: tip_string or None
         """
-        now = time.time()
-        if now - self.last_tip_time < self.tip_cooldown:
-            return None
-            
-        if not self.recent_events:
-            return None
-            
         # Context for LLM
-        events_str = "\n".join(list(self.recent_events))
-        
+        events_str = "\n".join(events)
+
         prompt = f"""
         You are a helpful Senior Software Engineer Mentor watching a developer work on project '{project_name}'.
-        
+
         Recent Activity Log:
         {events_str}
-        
+
+        What stands out:
+        {finding}
+
         Task:
-        - Analyze the user's recent actions.
-        - If they are doing well, offer brief encouragement.
-        - If they seem stuck (repeated errors), offer a specific specific tip.
-        - If nothing notable is happening, return "NO_TIP".
+        - If they seem stuck (repeated errors, edit/test loop), offer one specific tip.
+        - If they reached a milestone, offer brief encouragement or a sensible next step.
+        - If nothing useful can be said, return "NO_TIP".
         - KEEP IT SHORT. One sentence only. Casual and friendly.
-        
+
         Response:
         """
-        
+
         try:
-            response = client.chat.completions.create(
-                model="kimi-k2-0905-preview",
-                messages=[
+            self.stats["llm_calls"] += 1
+            response = model_router.complete(
+                "mentor",
+                [
                     {"role": "system", "content": "You are a helpful coding mentor. Output only the tip text or NO_TIP."},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.7,
                 max_tokens=60
             )
-            
+
             tip = response.choices[0].message.content.strip()
-            
+
             if "NO_TIP" in tip or len(tip) < 5:
-                # Random chance to say something generic if idle? No, let's stay quiet to avoid annoyance.
+                # Stay quiet rather than annoy
                 return None
-            
-            self.last_tip_time = now
-            # Clear events so we don't comment on them again? 
-            # Or keep them for context but maybe clear half?
-            # Let's keep them, the time window filters relevance.
-            
             return tip
-            
+
         except Exception as e:
-            print(f"Mentor Error: {e}")
+            logger.warning(f"Mentor Error: {e}")
             return None
 
+    def publish(self, key, tip):
+        with self._cond:
+            self._seq += 1
+            self._tips.append((self._seq, key, tip))
+            self.stats["tips"] += 1
+            metrics.MENTOR_TIPS.inc()
+            self._cond.notify_all()
+
+    def wait_tips(self, user_id, project_name, after=0, timeout=15):
+        """Tips for (user, project) with seq > `after`, blocking up to `timeout` seconds."""
+        key = (user_id, project_name)
+
+        def available():
+            return [t for t in self._tips if t[0] > after and t[1] == key]
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after and bool(available()), timeout=timeout)
+            return [(seq, tip) for seq, _, tip in available()]
+
+    def latest_seq(self):
+        with self._cond:
+            return self._seq
+
+    def latest_tip(self, user_id, project_name):
+        key = (user_id, project_name)
+        with self._cond:
+            for seq, tip_key, tip in reversed(self._tips):
+                if tip_key == key:
+                    return seq, tip
+        return 0, None
+
+    def get_stats(self):
+        return dict(self.stats, sessions=len(self.sessions), queued=self._queue.qsize())
+
 # Global Instance
 mentor = MentorAgent()
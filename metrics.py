@@ -0,0 +1,89 @@
+"""
+Metrics
+-------
+Prometheus counters and histograms for capacity planning and alerting,
+served by /metrics in the text exposition format.
+
+Under gunicorn every worker is its own process, so when
+PROMETHEUS_MULTIPROC_DIR is set (the Docker image does) prometheus_client
+keeps each metric in a shared mmap'd file and /metrics aggregates all
+workers, whichever one serves the scrape. gunicorn.conf.py clears the
+directory at startup and marks exited workers dead so their live gauges
+drop out.
+
+Span durations from tracing.py (LLM, search, disk, validation, GitHub and
+HTTP requests) are exported as one histogram labelled by span name; the
+counters below cover what spans do not: outcomes, tokens, cache hit rates,
+rate limiting, sandboxes and terminal commands.
+"""
+
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Builds and agent calls take seconds to minutes, not milliseconds
+SLOW_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 240, 480, float("inf"))
+SPAN_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf"))
+
+# ------------------------------------------------------------------
+# 1. HTTP and spans
+# ------------------------------------------------------------------
+HTTP_REQUESTS = Counter("kimi_http_requests_total", "HTTP responses by route and status (429 = rate limited)",
+                        ["method", "route", "status"])
+SPAN_DURATION = Histogram("kimi_span_duration_seconds", "Traced operation latency (see tracing.py)",
+                          ["span", "status"], buckets=SPAN_BUCKETS)
+
+# ------------------------------------------------------------------
+# 2. Builds and agent generation
+# ------------------------------------------------------------------
+BUILDS_STARTED = Counter("kimi_builds_started_total", "Builds started")
+BUILDS_FINISHED = Counter("kimi_builds_finished_total", "Builds finished, by outcome (complete, fatal)",
+                          ["outcome"])
+AGENT_DURATION = Histogram("kimi_build_agent_duration_seconds", "Time one agent takes during a build",
+                           buckets=SLOW_BUCKETS)
+AGENT_COMPONENT = Histogram("kimi_build_agent_component_seconds",
+                            "Per-agent time by component (llm, search, fs, github...)",
+                            ["component"], buckets=SLOW_BUCKETS)
+BUILD_FILES = Counter("kimi_build_files_total", "Files written by builds, by validation result", ["valid"])
+GENERATIONS = Counter("kimi_agent_generations_total", "Agent roster generations", ["mode", "outcome"])
+SHARD_RETRIES = Counter("kimi_agent_generation_shard_retries_total", "Department shard attempts that had to be retried")
+
+# ------------------------------------------------------------------
+# 3. LLM and search
+# ------------------------------------------------------------------
+LLM_REQUESTS = Counter("kimi_llm_requests_total", "LLM completions by call site, model and outcome",
+                       ["call_site", "model", "outcome"])
+LLM_TOKENS = Counter("kimi_llm_tokens_total", "LLM tokens by call site, model and direction (in, out)",
+                     ["call_site", "model", "direction"])
+LLM_RATE_LIMITED = Counter("kimi_llm_rate_limited_total", "429 responses from the LLM provider (including retried ones)")
+SEARCH_REQUESTS = Counter("kimi_search_requests_total", "Web searches by backend and outcome", ["backend", "outcome"])
+
+# ------------------------------------------------------------------
+# 4. Caches, mentor, sandboxes and terminal
+# ------------------------------------------------------------------
+CACHE_REQUESTS = Counter("kimi_cache_requests_total", "Cache lookups by cache and result (hit, miss)",
+                         ["cache", "result"])
+MENTOR_EVENTS = Counter("kimi_mentor_events_total", "Mentor events processed, by kind", ["kind"])
+MENTOR_RULES = Counter("kimi_mentor_rules_fired_total", "Mentor triage rules that fired", ["rule"])
+MENTOR_TIPS = Counter("kimi_mentor_tips_total", "Mentor tips pushed to users")
+SANDBOXES_ACTIVE = Gauge("kimi_sandboxes_active", "Live sandbox servers", multiprocess_mode="livesum")
+SANDBOX_STARTS = Counter("kimi_sandbox_starts_total", "Live sandbox servers started")
+TERMINAL_COMMANDS = Counter("kimi_terminal_commands_total",
+                            "Terminal commands by result (started, or the stage that rejected them)", ["result"])
+
+
+def count_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def render():
+    """(body, content type) for /metrics; aggregates all workers in multiprocess mode."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,253 @@
+"""
+Schema Migrations
+-----------------
+Small in-repo, Alembic-style migrations: numbered steps applied in order
+and recorded in `schema_migrations`, so existing Postgres/SQLite databases
+pick up columns and indexes that `db.create_all()` never adds to tables
+that already exist.
+
+Every step must be idempotent: a fresh database already has the current
+schema from create_all() and only gets the steps recorded.
+
+Steps read and write through Core tables declared here with the columns
+they had at that version, never through the ORM models: a model carries
+every later column, which an older database doesn't have yet.
+
+    $ flask --app app db-upgrade
+    $ flask --app app db-version
+"""
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import JSON, Integer, String, column, inspect, select, table, text
+
+from models import db, Project
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def _columns(table):
+    return {c["name"] for c in inspect(db.engine).get_columns(table)}
+
+
+def _indexes(table):
+    inspector = inspect(db.engine)
+    names = {ix["name"] for ix in inspector.get_indexes(table)}
+    names |= {uq["name"] for uq in inspector.get_unique_constraints(table)}
+    return names
+
+
+def _create_missing_indexes(model):
+    existing = _indexes(model.__tablename__)
+    for index in model.__table__.indexes:
+        if index.name not in existing:
+            index.create(db.engine)
+
+
+# ------------------------------------------------------------------
+# Tables as the steps see them
+# ------------------------------------------------------------------
+projects_v1 = table(
+    "projects",
+    column("id", Integer),
+    column("agents_data", JSON),
+    column("agent_count", Integer),
+)
+
+project_agents_v3 = table(
+    "project_agents",
+    column("project_id", Integer),
+    column("position", Integer),
+    column("role", String),
+    column("data", JSON),
+)
+
+
+# ------------------------------------------------------------------
+# Steps
+# ------------------------------------------------------------------
+@migration(1, "project agent_count listing column")
+def add_agent_count(batch_size=500):
+    if "agent_count" not in _columns("projects"):
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE projects ADD COLUMN agent_count INTEGER"))
+
+    p = projects_v1.c
+    last_id = 0
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                select(p.id, p.agents_data)
+                .where(p.agent_count.is_(None), p.id > last_id)
+                .order_by(p.id).limit(batch_size)
+            ).all()
+            for project_id, agents_data in rows:
+                conn.execute(
+                    projects_v1.update().where(p.id == project_id)
+                    .values(agent_count=len((agents_data or {}).get("agents") or []))
+                )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+
+@migration(2, "lookup indexes and unique (user_identifier, project_name)")
+def add_lookup_indexes():
+    from models import User, Transaction
+
+    if "uq_projects_user_project" not in _indexes("projects"):
+        # The newest row of each duplicate (user, name) group keeps its name;
+        # older ones are renamed rather than deleted, and reported
+        with db.engine.begin() as conn:
+            duplicates = conn.execute(text("""
+                SELECT id, user_identifier, project_name FROM projects
+                WHERE user_identifier IS NOT NULL AND id NOT IN (
+                    SELECT max_id FROM (
+                        SELECT MAX(id) AS max_id FROM projects
+                        WHERE user_identifier IS NOT NULL
+                        GROUP BY user_identifier, project_name
+                    ) AS newest
+                )
+                ORDER BY id
+            """)).all()
+            for project_id, user_identifier, project_name in duplicates:
+                suffix = f" (duplicate {project_id})"
+                renamed = project_name[:255 - len(suffix)] + suffix
+                conn.execute(text("UPDATE projects SET project_name = :name WHERE id = :id"),
+                             {"name": renamed, "id": project_id})
+                logger.warning(f"Project {project_id} of {user_identifier} duplicates {project_name!r}; "
+                               f"renamed to {renamed!r}")
+            conn.execute(text(
+                "CREATE UNIQUE INDEX uq_projects_user_project ON projects (user_identifier, project_name)"
+            ))
+
+    for model in (Project, User, Transaction):
+        _create_missing_indexes(model)
+
+
+@migration(3, "move agents out of projects.agents_data into project_agents")
+def split_agents(batch_size=200):
+    # project_agents itself comes from create_all(); this moves existing teams
+    # the same way Project.set_agents stores them
+    p, a = projects_v1.c, project_agents_v3.c
+    last_id = 0
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                select(p.id, p.agents_data).where(p.id > last_id).order_by(p.id).limit(batch_size)
+            ).all()
+            for project_id, agents_data in rows:
+                if "agents" not in (agents_data or {}):
+                    continue
+                header = dict(agents_data)
+                agents = header.pop("agents") or []
+                conn.execute(project_agents_v3.delete().where(a.project_id == project_id))
+                if agents:
+                    conn.execute(project_agents_v3.insert(), [
+                        {"project_id": project_id, "position": position, "role": str((data or {}).get("role") or "")[:255], "data": data}
+                        for position, data in enumerate(agents)
+                    ])
+                conn.execute(
+                    projects_v1.update().where(p.id == project_id)
+                    .values(agents_data=header, agent_count=len(agents))
+                )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+
+DEFAULT_PACKAGES = [
+    {"id": 1, "name": "Starter", "price": 0.0, "limit_builds": 1, "limit_voice_chars": 0},
+    {"id": 2, "name": "Pro", "price": 29.0, "limit_builds": 50, "limit_voice_chars": 50000},
+    {"id": 3, "name": "Enterprise", "price": 199.0, "limit_builds": 9999, "limit_voice_chars": 999999},
+]
+
+
+@migration(4, "seed the default package catalog")
+def seed_packages():
+    # Used to happen lazily inside GET /api/packages
+    with db.engine.begin() as conn:
+        existing = {pid for (pid,) in conn.execute(text("SELECT id FROM packages"))}
+        for package in DEFAULT_PACKAGES:
+            if package["id"] not in existing:
+                conn.execute(text(
+                    "INSERT INTO packages (id, name, price, limit_builds, limit_voice_chars, features_json) "
+                    "VALUES (:id, :name, :price, :limit_builds, :limit_voice_chars, '[]')"
+                ), package)
+
+
+# Monthly LLM spend caps per package (USD); see usage.py
+TIER_LLM_BUDGETS = {1: 0.50, 2: 25.0, 3: 500.0}
+
+
+@migration(5, "package LLM budgets (llm_usage tables come from create_all)")
+def add_llm_budgets():
+    missing = "llm_budget_usd" not in _columns("packages")
+    with db.engine.begin() as conn:
+        if missing:
+            conn.execute(text("ALTER TABLE packages ADD COLUMN llm_budget_usd FLOAT"))
+        for package_id, budget in TIER_LLM_BUDGETS.items():
+            conn.execute(
+                text("UPDATE packages SET llm_budget_usd = :budget WHERE id = :id AND llm_budget_usd IS NULL"),
+                {"budget": budget, "id": package_id}
+            )
+
+
+# ------------------------------------------------------------------
+# Runner
+# ------------------------------------------------------------------
+def _ensure_table():
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, applied_at TIMESTAMP NOT NULL)"
+        ))
+
+
+def current_version():
+    _ensure_table()
+    with db.engine.connect() as conn:
+        return conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar() or 0
+
+
+def upgrade(target=None, log=print):
+    """Apply pending steps up to `target` (default: latest). Needs an app context."""
+    version = current_version()
+    applied = []
+    for number, name, fn in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        log(f"Applying migration {number}: {name}")
+        fn()
+        with db.engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": number, "n": name, "t": datetime.utcnow()}
+            )
+        applied.append(number)
+    return applied
+
+
+def register_commands(app):
+    @app.cli.command("db-upgrade")
+    def db_upgrade_command():
+        """Create missing tables and apply pending schema migrations."""
+        db.create_all()
+        applied = upgrade()
+        print(f"Schema at version {current_version()} ({len(applied)} migration(s) applied)")
+
+    @app.cli.command("db-version")
+    def db_version_command():
+        """Print the applied schema version."""
+        print(current_version())
@@ -0,0 +1,218 @@
+"""
+Model Router
+------------
+Maps every LLM call site (mentor, summarize, generate_agents, artifacts,
+debug, chat) to an ordered fallback chain of models, so short tasks go to a
+fast small model and only the heavy generation work pays for the big one.
+
+Chains can be overridden per call site with an environment variable, e.g.
+$ export KIMI_MODEL_MENTOR="moonshot-v1-8k,kimi-k2-0905-preview"
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict
+
+import llm_gateway
+import llm_scheduler
+import metrics
+import tracing
+import usage
+
+DEFAULT_MODEL = "kimi-k2-0905-preview"
+
+# ------------------------------------------------------------------
+# 1. Call site -> fallback chain (first entry is preferred)
+# ------------------------------------------------------------------
+ROUTES = {
+    "mentor": ["moonshot-v1-8k", "kimi-k2-turbo-preview", DEFAULT_MODEL],
+    "summarize": ["moonshot-v1-32k", "kimi-k2-turbo-preview", DEFAULT_MODEL],
+    "generate_agents": [DEFAULT_MODEL, "kimi-k2-turbo-preview"],
+    "artifacts": [DEFAULT_MODEL, "kimi-k2-turbo-preview"],
+    "debug": [DEFAULT_MODEL, "kimi-k2-turbo-preview"],
+    "chat": ["kimi-k2-turbo-preview", DEFAULT_MODEL],
+}
+
+# ------------------------------------------------------------------
+# 2. Per-model concurrency limits and pricing (USD per 1M tokens)
+# ------------------------------------------------------------------
+MODEL_CONCURRENCY = {
+    "moonshot-v1-8k": 32,
+    "moonshot-v1-32k": 16,
+    "kimi-k2-turbo-preview": 16,
+    DEFAULT_MODEL: 8,
+}
+DEFAULT_CONCURRENCY = 8
+
+MODEL_PRICING = {
+    "moonshot-v1-8k": {"input": 0.20, "output": 2.00},
+    "moonshot-v1-32k": {"input": 1.00, "output": 3.00},
+    "kimi-k2-turbo-preview": {"input": 1.15, "output": 8.00},
+    DEFAULT_MODEL: {"input": 0.60, "output": 2.50},
+}
+
+# ------------------------------------------------------------------
+# 3. Per-call-site request timeouts (seconds) and scheduling priority
+# ------------------------------------------------------------------
+CALL_SITE_TIMEOUTS = {
+    "mentor": 15,
+    "summarize": 45,
+    "chat": 90,
+    "debug": 120,
+    "artifacts": 180,
+    "generate_agents": 240,
+}
+
+# Interactive call sites jump the scheduler queue ahead of batch builds
+CALL_SITE_PRIORITY = {
+    "chat": llm_scheduler.PRIORITY_INTERACTIVE,
+    "debug": llm_scheduler.PRIORITY_INTERACTIVE,
+    "mentor": llm_scheduler.PRIORITY_INTERACTIVE,
+}
+
+
+def estimate_cost(call_site, prompt_tokens, completion_tokens):
+    """USD cost of a call on the call site's preferred model (0 if it has no price)."""
+    price = MODEL_PRICING.get(get_chain(call_site)[0])
+    if not price:
+        return 0.0
+    return (prompt_tokens * price["input"] + completion_tokens * price["output"]) / 1_000_000
+
+
+def get_chain(call_site):
+    """Return the ordered list of models to try for a call site."""
+    override = os.getenv(f"KIMI_MODEL_{call_site.upper()}")
+    if override:
+        return [m.strip() for m in override.split(",") if m.strip()]
+    return list(ROUTES.get(call_site, [DEFAULT_MODEL]))
+
+
+def should_fall_back(exc):
+    """Provider-side failures (429, 5xx, timeouts, connection errors) may succeed on another model."""
+    return llm_gateway.is_retryable(exc) or isinstance(exc, TimeoutError)
+
+
+class ModelRouter:
+    def __init__(self):
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self.stats = defaultdict(lambda: {
+            "calls": 0,
+            "errors": 0,
+            "fallbacks": 0,
+            "latency_total": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost_usd": 0.0,
+        })
+
+    def _semaphore(self, model):
+        with self._lock:
+            if model not in self._semaphores:
+                limit = int(os.getenv(
+                    f"KIMI_CONCURRENCY_{model.upper().replace('-', '_')}",
+                    MODEL_CONCURRENCY.get(model, DEFAULT_CONCURRENCY)
+                ))
+                self._semaphores[model] = threading.BoundedSemaphore(limit)
+            return self._semaphores[model]
+
+    def _record(self, call_site, model, latency, usage=None, error=False):
+        cost = 0.0
+        prompt_tokens = completion_tokens = 0
+        if usage is not None:
+            prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+            price = MODEL_PRICING.get(model)
+            if price:
+                cost = (prompt_tokens * price["input"] + completion_tokens * price["output"]) / 1_000_000
+
+        metrics.LLM_REQUESTS.labels(call_site, model, "error" if error else "ok").inc()
+        if prompt_tokens or completion_tokens:
+            metrics.LLM_TOKENS.labels(call_site, model, "in").inc(prompt_tokens)
+            metrics.LLM_TOKENS.labels(call_site, model, "out").inc(completion_tokens)
+
+        with self._lock:
+            entry = self.stats[(call_site, model)]
+            entry["calls"] += 1
+            entry["latency_total"] += latency
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost_usd"] += cost
+            if error:
+                entry["errors"] += 1
+        return cost
+
+    def complete(self, call_site, messages, **kwargs):
+        """
+        Run a chat completion for `call_site`, walking the fallback chain
+        until one model succeeds. Only provider-side failures (429, 5xx,
+        timeouts, dropped connections) fall back, at once; the last model
+        retries with backoff. Other errors are raised at once. Raises the
+        last error if all models fail.
+        """
+        chain = get_chain(call_site)
+        kwargs.setdefault("timeout", CALL_SITE_TIMEOUTS.get(call_site))
+        kwargs.setdefault("priority", CALL_SITE_PRIORITY.get(call_site, llm_scheduler.PRIORITY_BATCH))
+        last_error = None
+
+        with tracing.span("llm.complete", call_site=call_site) as span:
+            for index, model in enumerate(chain):
+                if index > 0:
+                    with self._lock:
+                        self.stats[(call_site, model)]["fallbacks"] += 1
+
+                # The model's slot is held per attempt, not through the gateway's
+                # backoff sleeps; only the last model in the chain retries, the
+                # others hand a provider-side failure straight to the next one
+                start = time.perf_counter()
+                try:
+                    response = llm_gateway.chat_completion(
+                        model, messages, slot=self._semaphore(model),
+                        retries=None if index == len(chain) - 1 else 0, **kwargs
+                    )
+                except Exception as e:
+                    self._record(call_site, model, time.perf_counter() - start, error=True)
+                    if not should_fall_back(e):
+                        raise  # Bad request, auth, context length: every model would refuse it
+                    last_error = e
+                    continue
+
+                latency = time.perf_counter() - start
+                token_usage = getattr(response, "usage", None)
+                prompt_tokens = getattr(token_usage, "prompt_tokens", 0) or 0
+                completion_tokens = getattr(token_usage, "completion_tokens", 0) or 0
+                cost = self._record(call_site, model, latency, token_usage)
+                # Persisted per user/project/build in batches (see usage.py)
+                usage.recorder.record(call_site, model, prompt_tokens, completion_tokens, cost, latency)
+                span.set(model=model, fallbacks=index, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+                return response
+
+            raise last_error or RuntimeError(f"No models configured for '{call_site}'")
+
+    def get_stats(self):
+        """Snapshot of latency/cost telemetry keyed by call site and model."""
+        with self._lock:
+            snapshot = []
+            for (call_site, model), entry in self.stats.items():
+                calls = entry["calls"]
+                snapshot.append({
+                    "call_site": call_site,
+                    "model": model,
+                    "calls": calls,
+                    "errors": entry["errors"],
+                    "fallbacks": entry["fallbacks"],
+                    "avg_latency_ms": round(1000 * entry["latency_total"] / calls, 1) if calls else 0.0,
+                    "prompt_tokens": entry["prompt_tokens"],
+                    "completion_tokens": entry["completion_tokens"],
+                    "cost_usd": round(entry["cost_usd"], 6),
+                })
+            return snapshot
+
+
+# Global Instance
+router = ModelRouter()
+
+
+def complete(call_site, messages, **kwargs):
+    return router.complete(call_site, messages, **kwargs)
@@ -2,23 +2,97 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import json
 
-db = SQLAlchemy()
+from database import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class Project(db.Model):
     __tablename__ = 'projects'
+    __table_args__ = (
+        db.UniqueConstraint('user_identifier', 'project_name', name='uq_projects_user_project'),
+        db.Index('ix_projects_project_name', 'project_name'),
+        db.Index('ix_projects_user_id', 'user_identifier', 'id'),  # Dashboard keyset pages
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_identifier = db.Column(db.String(255), nullable=True) # GitHub username or session ID
     project_name = db.Column(db.String(255), nullable=False)
     idea_prompt = db.Column(db.Text, nullable=False)
-    agents_data = db.Column(db.JSON, nullable=False) # Stores the full JSON result
+    agents_data = db.Column(db.JSON, nullable=False) # Project header; the agents live in project_agents
+    agent_count = db.Column(db.Integer, nullable=True) # Kept in sync with the agents so listings can skip them
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    agents = db.relationship(
+        'ProjectAgent', order_by='ProjectAgent.position',
+        cascade='all, delete-orphan', lazy='select'
+    )
+
+    # Columns the dashboard needs; agents_data is left unloaded
+    LISTING_COLUMNS = ("id", "user_identifier", "project_name", "idea_prompt", "agent_count", "created_at")
+
+    def set_agents(self, agents_data):
+        """
+        Store a full agents document: the header stays on the row, each agent
+        gets its own project_agents row. Unchanged agents are not rewritten.
+        """
+        agents_data = dict(agents_data or {})
+        agents = agents_data.pop("agents", None) or []
+        self.agents_data = agents_data
+        self.agent_count = len(agents)
+
+        existing = {agent.position: agent for agent in self.agents}
+        for position, data in enumerate(agents):
+            row = existing.pop(position, None)
+            if row is None:
+                self.agents.append(ProjectAgent(position=position, role=_role(data), data=data))
+            elif row.data != data:
+                row.role, row.data = _role(data), data
+        for row in existing.values():
+            self.agents.remove(row)
+
+    def document(self):
+        """The full agents document (header + agents list) as clients expect it."""
+        doc = dict(self.agents_data or {})
+        if "agents" not in doc:  # Rows not yet split by migration 3 still carry it inline
+            doc["agents"] = [agent.data for agent in self.agents]
+        return doc
+
     def __repr__(self):
         return f"<Project {self.project_name}>"
 
+
+def _role(agent):
+    return str((agent or {}).get("role") or "")[:255]
+
+
+class ProjectAgent(db.Model):
+    """One agent of a project, so persona edits touch a single small row."""
+    __tablename__ = 'project_agents'
+    __table_args__ = (
+        db.Index('ix_project_agents_role', 'project_id', 'role'),
+    )
+
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='CASCADE'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True) # Order within the team; roles may repeat
+    role = db.Column(db.String(255), nullable=False, default="")
+    data = db.Column(db.JSON, nullable=False)
+
+    def merge(self, patch):
+        """Apply a JSON merge patch (RFC 7386): null removes a key."""
+        data = dict(self.data or {})
+        for key, value in patch.items():
+            if value is None:
+                data.pop(key, None)
+            else:
+                data[key] = value
+        self.data = data
+        self.role = _role(data)
+
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_trial_start_date', 'trial_start_date'),
+    )
     
     username = db.Column(db.String(255), primary_key=True) # GitHub User or 'anonymous_ip'
     trial_start_date = db.Column(db.DateTime, default=datetime.utcnow)
@@ -32,6 +106,8 @@ class User(db.Model):
     credits_left = db.Column(db.Integer, default=1) # Free tier starts with 1
     voice_chars_left = db.Column(db.Integer, default=0)
 
+    package = db.relationship('Package', lazy='select')
+
     def days_left_in_trial(self):
         # Deprecated logic if using 'package_id', but useful for "Free Trial of Pro"
         delta = datetime.utcnow() - self.trial_start_date
@@ -44,10 +120,14 @@ class Package(db.Model):
     price = db.Column(db.Float, default=0.0)
     limit_builds = db.Column(db.Integer, default=1)
     limit_voice_chars = db.Column(db.Integer, default=0)
+    llm_budget_usd = db.Column(db.Float, nullable=True) # Monthly LLM spend cap (see usage.py); None = uncapped
     features_json = db.Column(db.Text, default="[]") # JSON list of feature strings
 
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        db.Index('ix_transactions_user_timestamp', 'user_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(255), db.ForeignKey('users.username'))
     package_id = db.Column(db.Integer, db.ForeignKey('packages.id'))
@@ -57,3 +137,52 @@ class Transaction(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     payment_provider_id = db.Column(db.String(255)) # PayPal Transaction ID
 
+    package = db.relationship('Package', lazy='select')
+
+
+class LLMUsage(db.Model):
+    """One completion: who it was for, which call site and model, tokens, cost and latency (see usage.py)."""
+    __tablename__ = 'llm_usage'
+    __table_args__ = (
+        db.Index('ix_llm_usage_user_created', 'user_identifier', 'created_at'),
+        db.Index('ix_llm_usage_trace', 'trace_id'),  # Per-build totals
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user_identifier = db.Column(db.String(255), nullable=True) # None for background work (mentor without a user)
+    project_name = db.Column(db.String(255), nullable=True)
+    trace_id = db.Column(db.String(64), nullable=True) # Request trace id; one per build
+    call_site = db.Column(db.String(50), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cost_usd = db.Column(db.Float, nullable=False, default=0.0)
+    latency_ms = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LLMUsageDaily(db.Model):
+    """
+    Per day, user, call site and model totals of llm_usage, upserted with each
+    batch so budgets and tier rollups never scan the raw rows.
+    """
+    __tablename__ = 'llm_usage_daily'
+    day = db.Column(db.String(10), primary_key=True) # YYYY-MM-DD (UTC)
+    user_identifier = db.Column(db.String(255), primary_key=True) # "" for background work
+    call_site = db.Column(db.String(50), primary_key=True)
+    model = db.Column(db.String(100), primary_key=True)
+    calls = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cost_usd = db.Column(db.Float, nullable=False, default=0.0)
+    latency_ms = db.Column(db.Integer, nullable=False, default=0) # Sum; divide by calls
+
+
+class StatsCounter(db.Model):
+    """
+    Aggregates maintained on write (see stats.py) so /admin never has to
+    COUNT whole tables. Keys are totals ("users") or per day ("builds:2024-01-31").
+    """
+    __tablename__ = 'stats_counters'
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
@@ -76,3 +76,70 @@ The JSON must have this exact structure:
 - Ensure the code/content is high quality.
 """
 
+
+AGENT_EDIT_PROMPT = """
+You can change the project's files. To edit one, reply with a JSON object
+(alone, or after your explanation) with the FULL new content of the file:
+{"action": "edit", "file": "relative/path/to/file.ext", "content": "Full new content of the file..."}
+
+- Use a path from the Current Project Files list, or a new path to create a file.
+- Do NOT wrap the content in markdown code blocks.
+- Only edit when the user asks for a change; otherwise just answer.
+"""
+
+
+# ------------------------------------------------------------------
+# Sharded generation (project section first, then departments in parallel)
+# ------------------------------------------------------------------
+PROJECT_PROMPT = """
+You are an enterprise AI architect and full-stack software generator.
+The user will supply a short product/feature idea.
+
+Reply with **ONLY** a JSON object (no markdown, no commentary) containing:
+{
+  "project": {
+    "name": "string",                # project name based on idea
+    "description": "string",         # 1-sentence overview
+    "tech_stack": ["string"],        # frameworks, languages, libraries
+    "deployment_targets": ["string"],# e.g. Vercel, Supabase, Docker, Kubernetes
+    "ci_cd": ["string"],             # GitHub Actions, Azure DevOps, etc.
+    "security": ["string"],          # auth, encryption, compliance
+    "scaffolding": ["string"],       # Visual Studio solution/projects setup
+    "documentation": ["string"],     # README, API docs, architecture diagrams
+  }
+}
+
+Requirements:
+- Ensure the **project section** includes:
+  - Visual Studio solution scaffolding (projects, folders, namespaces).
+  - Enterprise coding standards (linting, testing, logging, monitoring).
+  - Database integration (Supabase/Postgres).
+  - Frontend deployment (Vercel).
+  - CI/CD pipelines with automated testing & deployment.
+  - Security & compliance (OAuth2, JWT, GDPR, SOC2).
+  - Documentation & onboarding guides.
+  - Scalability & observability (metrics, dashboards, alerts).
+"""
+
+AGENT_SHARD_PROMPT = """
+You are an enterprise AI architect staffing one part of a software company.
+The user will supply the product idea, the already-agreed project section,
+the departments you must cover and the exact number of agents to create.
+
+Reply with **ONLY** a JSON object (no markdown, no commentary) containing:
+{
+  "agents": [
+    {
+      "role": "string",              # human-readable job title
+      "department": "string",        # one of the requested departments
+      "goal": "string",              # 1-sentence mission for this agent
+      "key_tasks": ["string"]        # 2-4 core responsibilities
+    }
+  ]
+}
+
+Requirements:
+- Return exactly the requested number of agents.
+- Cover every requested department (one agent may span two closely related ones).
+- Roles must be specific to the project (its tech stack and domain).
+"""
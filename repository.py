@@ -0,0 +1,159 @@
+"""
+Data Access Layer
+-----------------
+The queries routes need, in one place, written against the indexes declared
+in models.py (see migrations.py for existing databases):
+
+- projects by user + name   -> uq_projects_user_project (owner only)
+- dashboard pages           -> ix_projects_user_id (keyset on id)
+- billing history           -> ix_transactions_user_timestamp, packages joined
+- single agent edits        -> project_agents primary key (project_id, position)
+- package catalog           -> in-process cache, dropped when a Package changes
+"""
+
+import json
+import os
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, load_only
+
+from cache import cache, invalidate_on_commit
+from models import db, Project, ProjectAgent, User, Package, Transaction
+
+PACKAGES_TTL = int(os.getenv("PACKAGES_CACHE_TTL", "300"))
+
+
+# ------------------------------------------------------------------
+# Projects
+# ------------------------------------------------------------------
+def get_project(project_name, user_identifier):
+    """
+    `user_identifier`'s project by name, or None. Never another user's:
+    names are only unique per user, and callers read and write what they get.
+    """
+    if not project_name or not user_identifier:
+        return None
+    return Project.query.filter_by(user_identifier=user_identifier, project_name=project_name).first()
+
+
+def get_project_by_id(project_id):
+    return db.session.get(Project, project_id)
+
+
+def list_projects(user_identifier=None, cursor=None, limit=24):
+    """
+    One page of projects, newest first, without the agents_data blob.
+    Returns (projects, next_cursor).
+    """
+    query = Project.query.options(load_only(*[getattr(Project, c) for c in Project.LISTING_COLUMNS]))
+    if user_identifier:
+        query = query.filter(Project.user_identifier == user_identifier)
+    if cursor:
+        query = query.filter(Project.id < cursor)
+    projects = query.order_by(Project.id.desc()).limit(limit + 1).all()
+
+    if len(projects) > limit:
+        projects = projects[:limit]
+        return projects, projects[-1].id
+    return projects, None
+
+
+def upsert_project(user_identifier, project_name, idea_prompt, agents_data):
+    """
+    Create the project, or refresh it when this user already has one with the
+    same name (it lives in the same projects/<name> folder anyway).
+    """
+    for attempt in range(2):
+        project = Project.query.filter_by(user_identifier=user_identifier, project_name=project_name).first()
+        if project is None:
+            project = Project(user_identifier=user_identifier, project_name=project_name)
+            db.session.add(project)
+        project.idea_prompt = idea_prompt
+        project.set_agents(agents_data)
+        try:
+            db.session.commit()
+            return project
+        except IntegrityError:
+            # A concurrent request inserted the same (user, name) first
+            # (uq_projects_user_project): update its row instead
+            db.session.rollback()
+            if attempt:
+                raise
+
+
+def get_agent(project, position):
+    return db.session.get(ProjectAgent, (project.id, position))
+
+
+def update_agent(project, position, patch):
+    """
+    Merge-patch one agent in place; only its project_agents row is written.
+    None if there is no agent at `position`.
+    """
+    if "agents" in (project.agents_data or {}):
+        project.set_agents(project.agents_data)  # Not split by migration 3 yet
+        db.session.flush()
+    agent = get_agent(project, position)
+    if agent is None:
+        return None
+    agent.merge(patch)
+    db.session.commit()
+    return agent
+
+
+# ------------------------------------------------------------------
+# Users & billing
+# ------------------------------------------------------------------
+def get_user(username):
+    return db.session.get(User, username)
+
+
+def get_or_create_user(username, **defaults):
+    user = db.session.get(User, username)
+    if user is None:
+        user = User(username=username, **defaults)
+        db.session.add(user)
+        db.session.commit()
+    return user
+
+
+def recent_users(limit=10):
+    return User.query.order_by(User.trial_start_date.desc()).limit(limit).all()
+
+
+def get_package(package_id):
+    return db.session.get(Package, package_id)
+
+
+@cache.cached("packages", ttl=PACKAGES_TTL)
+def list_packages():
+    """The package catalog as plain dicts, features_json decoded once."""
+    packages = []
+    for p in Package.query.order_by(Package.id).all():
+        try:
+            features = json.loads(p.features_json or "[]")
+        except ValueError:
+            features = []
+        packages.append({
+            "id": p.id,
+            "name": p.name,
+            "price": p.price,
+            "limit_builds": p.limit_builds,
+            "limit_voice_chars": p.limit_voice_chars,
+            "llm_budget_usd": p.llm_budget_usd,
+            "features": features,
+        })
+    return packages
+
+
+invalidate_on_commit(Package, list_packages)
+
+
+def user_transactions(username):
+    """Billing history with each transaction's package loaded in the same query."""
+    return (
+        Transaction.query.options(joinedload(Transaction.package))
+        .filter(Transaction.user_id == username)
+        .order_by(Transaction.timestamp.desc())
+        .all()
+    )
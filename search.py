@@ -5,6 +5,13 @@ import json
 
 import os
 
+import metrics
+import tracing
+
+# Serper-compatible endpoint (benchmarks/stub_search.py for offline runs)
+SERPER_URL = os.getenv("SERPER_URL", "https://google.serper.dev/search")
+
+@tracing.traced("search.web")
 def search_web(query, max_results=5):
     """
     Search web using Serper Device (if key present) or valid scraper fallback.
@@ -13,13 +20,15 @@ def search_web(query, max_results=5):
         # 1. Try Serper API (High Quality JSON)
         api_key = os.environ.get("SERPER_API_KEY")
         if api_key:
-            url = "https://google.serper.dev/search"
+            url = SERPER_URL
             payload = json.dumps({"q": query, "num": max_results})
             headers = {
                 'X-API-KEY': api_key,
                 'Content-Type': 'application/json'
             }
+            tracing.current_span().set(backend="serper")
             response = requests.post(url, headers=headers, data=payload, timeout=10)
+            metrics.SEARCH_REQUESTS.labels("serper", "ok" if response.ok else f"http_{response.status_code}").inc()
             if response.ok:
                 data = response.json()
                 organic = data.get("organic", [])
@@ -37,10 +46,12 @@ def search_web(query, max_results=5):
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
         }
         # DDG Lite is easier to parse
+        tracing.current_span().set(backend="duckduckgo")
         url = f"https://lite.duckduckgo.com/lite/?q={urllib.parse.quote(query)}"
         
         resp = requests.get(url, headers=headers, timeout=10)
         resp.raise_for_status()
+        metrics.SEARCH_REQUESTS.labels("duckduckgo", "ok").inc()
         html = resp.text
         
         results = []
@@ -71,4 +82,6 @@ def search_web(query, max_results=5):
         return results
 
     except Exception as e:
+        span = tracing.current_span().fail(str(e))
+        metrics.SEARCH_REQUESTS.labels(span.attributes.get("backend", "unknown"), "error").inc()
         return [{"error": f"Search failed: {str(e)}"}]
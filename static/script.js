@@ -14,6 +14,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const githubTokenInput = document.getElementById('githubToken');
     const tokenStatus = document.getElementById('tokenStatus');
     const githubStatus = document.getElementById('githubStatus');
+    const reuseToggle = document.getElementById('reuseToggle');
 
     // Settings Modal
     if (settingsBtn) {
@@ -101,7 +102,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const response = await fetch('/generate', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ idea })
+                body: JSON.stringify({ idea, reuse: reuseToggle ? reuseToggle.checked : true })
             });
 
             if (!response.ok) {
@@ -140,6 +141,10 @@ document.addEventListener('DOMContentLoaded', () => {
         // Render Project Info
         // Check if project info exists in the response
         if (data.project) {
+            const reused = data.cache && data.cache.hit
+                ? `<p class="cache-note">♻️ Reused your team from a similar idea (${Math.round(data.cache.similarity * 100)}% match). Untick "Reuse similar teams" to generate a fresh one.</p>`
+                : '';
+
             const techs = data.project.tech_stack
                 ? data.project.tech_stack.map(t => `<span class="tag">${t}</span>`).join('')
                 : '';
@@ -148,11 +153,13 @@ document.addEventListener('DOMContentLoaded', () => {
                 <h3 class="project-title">${data.project.name || 'Unnamed Project'}</h3>
                 <p class="pro-desc">${data.project.description || ''}</p>
                 <div class="tech-tags">${techs}</div>
+                ${reused}
             `;
         } else {
             // Fallback if structured differently or just list of agents
             projectInfo.innerHTML = `<h3 class="project-title">${data.idea || 'Generated Team'}</h3>`;
         }
+        document.dispatchEvent(new Event('projectchange'));
 
         // Render Agents
         const agents = data.agents || [];
@@ -230,7 +237,10 @@ document.addEventListener('DOMContentLoaded', () => {
                         body: JSON.stringify({ agents_data: data })
                     });
 
-                    if (!res.ok) throw new Error('Build failed');
+                    if (!res.ok) {
+                        const err = await res.json().catch(() => ({}));
+                        throw new Error(err.error || 'Build failed');
+                    }
 
                     // STREAMING READER
                     const reader = res.body.getReader();
@@ -283,6 +293,17 @@ document.addEventListener('DOMContentLoaded', () => {
                                     tag.innerText = `📄 ${msg.file}`;
                                     fileTree.appendChild(tag);
                                 }
+                                else if (msg.status === 'timing') {
+                                    const parts = Object.entries(msg.breakdown || {})
+                                        .map(([part, ms]) => `${part} ${(ms / 1000).toFixed(1)}s`);
+                                    terminalContent.textContent += `> [${msg.agent}]: done in ${(msg.total_ms / 1000).toFixed(1)}s (${parts.join(', ')})\n`;
+                                }
+                                else if (msg.status === 'budget') {
+                                    terminalContent.textContent += `> [Budget]: ${msg.message}\n`;
+                                }
+                                else if (msg.status === 'usage') {
+                                    terminalContent.textContent += `> [Usage]: ${msg.calls} LLM calls, ${msg.prompt_tokens + msg.completion_tokens} tokens, $${msg.cost_usd.toFixed(4)}\n`;
+                                }
                                 else if (msg.status === 'complete') {
                                     terminalContent.textContent += `\n> Build Complete! Output: ${msg.directory}\n`;
                                     if (window.speakCheck) window.speakCheck("Build complete.", true);
@@ -358,12 +379,31 @@ document.addEventListener('DOMContentLoaded', () => {
             term.write(`Project: ${data.project_name || 'Untitled'}\r\n$ `);
         }
 
+        // Currently streaming session (one at a time per terminal)
+        let activeSession = null;
+
+        input.addEventListener('keydown', async (e) => {
+            // Ctrl+C cancels the running command
+            if (e.ctrlKey && e.key === 'c' && activeSession) {
+                e.preventDefault();
+                await fetch('/api/terminal/cancel', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ session_id: activeSession })
+                });
+            }
+        });
+
         input.addEventListener('keypress', async (e) => {
             if (e.key === 'Enter') {
                 const cmd = input.value.trim();
                 input.value = '';
 
                 if (!cmd) return;
+                if (activeSession) {
+                    term.write('A command is still running (Ctrl+C to cancel)\r\n');
+                    return;
+                }
 
                 term.write(cmd + '\r\n'); // Echo command
 
@@ -379,8 +419,38 @@ document.addEventListener('DOMContentLoaded', () => {
                         })
                     });
                     const result = await res.json();
-                    term.write(result.output.replace(/\n/g, '\r\n') + '\r\n$ ');
+                    if (!result.session_id) {
+                        term.write(result.output.replace(/\n/g, '\r\n') + '\r\n$ ');
+                        return;
+                    }
+
+                    // Stream output as it is produced
+                    activeSession = result.session_id;
+                    const source = new EventSource(result.stream_url);
+                    source.onmessage = (evt) => {
+                        const line = JSON.parse(evt.data);
+                        term.write(line.text.replace(/\n/g, '\r\n'));
+                    };
+                    source.addEventListener('truncated', () => {
+                        term.write('[... earlier output truncated ...]\r\n');
+                    });
+                    source.addEventListener('exit', (evt) => {
+                        const info = JSON.parse(evt.data);
+                        source.close();
+                        activeSession = null;
+                        if (info.status !== 'exited') term.write(`[${info.status}]\r\n`);
+                        else if (info.exit_code !== 0) term.write(`[exit code ${info.exit_code}]\r\n`);
+                        term.write('$ ');
+                    });
+                    source.onerror = () => {
+                        // EventSource retries on its own; give up once the server says it's gone
+                        if (source.readyState === EventSource.CLOSED) {
+                            activeSession = null;
+                            term.write('\r\n[connection lost]\r\n$ ');
+                        }
+                    };
                 } catch (err) {
+                    activeSession = null;
                     term.write(`Error: ${err.message}\r\n$ `);
                 }
             }
@@ -744,10 +814,52 @@ document.addEventListener('DOMContentLoaded', () => {
                     const res = await fetch('/api/test/run', {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ project_name: projName })
+                        body: JSON.stringify({
+                            project_name: projName,
+                            full: document.getElementById('fullRunToggle')?.checked || false
+                        })
                     });
-                    const data = await res.json();
-                    outputPre.textContent = data.output;
+                    if (!res.ok) throw new Error('Test run failed');
+
+                    // NDJSON: deps, start, one line per test, shard, done
+                    const reader = res.body.getReader();
+                    const decoder = new TextDecoder();
+                    const icons = { passed: '✅', failed: '❌', error: '💥', skipped: '⏭️' };
+                    let buffer = '';
+                    let data = { output: '', exit_code: -1 };
+                    let notes = '';
+                    const failures = [];
+
+                    while (true) {
+                        const { done, value } = await reader.read();
+                        if (done) break;
+
+                        buffer += decoder.decode(value, { stream: true });
+                        const lines = buffer.split('\n');
+                        buffer = lines.pop(); // Keep partial line
+
+                        for (const line of lines) {
+                            if (!line.trim()) continue;
+                            const msg = JSON.parse(line);
+                            if (msg.status === 'deps') {
+                                notes += `⏳ ${msg.message}\n`;
+                                outputPre.textContent = notes;
+                            } else if (msg.status === 'start') {
+                                outputPre.textContent = notes + `Running ${msg.selected} test file(s) on ${msg.workers} worker(s), ${msg.cached} unchanged (cached)\n`;
+                            } else if (msg.status === 'test') {
+                                outputPre.textContent += `${icons[msg.outcome] || '•'} ${msg.id}${msg.cached ? ' (cached)' : ''}\n`;
+                                if (msg.outcome === 'failed' || msg.outcome === 'error') {
+                                    outputPre.textContent += `   ${msg.message}\n`;
+                                    failures.push(msg);
+                                }
+                            } else if (msg.status === 'done') {
+                                data = msg;
+                                outputPre.textContent += `\n${msg.passed} passed, ${msg.failed} failed, ${msg.error} errors, ${msg.skipped} skipped in ${msg.elapsed}s\n`;
+                                if (msg.exit_code !== 0 && msg.output) outputPre.textContent += `\n${msg.output}`;
+                            }
+                            outputPre.scrollTop = outputPre.scrollHeight;
+                        }
+                    }
 
                     if (data.exit_code !== 0) {
                         // Show Auto-Fix
@@ -765,11 +877,12 @@ document.addEventListener('DOMContentLoaded', () => {
                                     headers: { 'Content-Type': 'application/json' },
                                     body: JSON.stringify({
                                         project_name: projName,
+                                        failures: failures,
                                         error_log: data.output
                                     })
                                 });
                                 const fixData = await fixRes.json();
-                                if (fixData.status === "fixed") {
+                                if (fixData.status === "fixed" || fixData.status === "partial") {
                                     alert("Fixed! " + fixData.message + "\nAI Thought: " + fixData.thought);
                                     // Re-run
                                     document.getElementById('runTestsBtn').click();
@@ -883,27 +996,67 @@ document.addEventListener('DOMContentLoaded', () => {
         if (elevenKeyInput.value) fetchVoices();
     });
 
+    function renderVoices(voices) {
+        voiceSelect.innerHTML = ''; // clear defaults
+        voices.forEach(v => {
+            const opt = document.createElement('option');
+            opt.value = v.voice_id;
+            opt.textContent = v.name;
+            voiceSelect.appendChild(opt);
+        });
+        // Restore selection
+        if (localStorage.getItem('voiceId')) voiceSelect.value = localStorage.getItem('voiceId');
+    }
+
     async function fetchVoices() {
+        // Show the last list right away; the server answers 304 when unchanged
+        const cached = localStorage.getItem('voiceCatalog');
+        if (cached) {
+            try { renderVoices(JSON.parse(cached)); } catch (e) { localStorage.removeItem('voiceCatalog'); }
+        }
         try {
             const key = elevenKeyInput.value;
             const res = await fetch('/api/voices', {
                 headers: { 'X-ElevenLabs-Key': key }
             });
             const data = await res.json();
-            if (data.voices) {
-                voiceSelect.innerHTML = ''; // clear defaults
-                data.voices.forEach(v => {
-                    const opt = document.createElement('option');
-                    opt.value = v.voice_id;
-                    opt.textContent = v.name;
-                    voiceSelect.appendChild(opt);
-                });
-                // Restore selection
-                if (localStorage.getItem('voiceId')) voiceSelect.value = localStorage.getItem('voiceId');
+            if (data.voices && data.voices.length) {
+                const serialized = JSON.stringify(data.voices);
+                if (serialized !== cached) {
+                    localStorage.setItem('voiceCatalog', serialized);
+                    renderVoices(data.voices);
+                }
             }
         } catch (e) { console.error("Error fetching voices", e); }
     }
 
+    // Audio arrives sentence by sentence; start playing with the first one
+    // instead of waiting for the whole clip (falls back to a blob).
+    async function playAudioStream(res) {
+        if (!window.MediaSource || !MediaSource.isTypeSupported('audio/mpeg') || !res.body) {
+            const blob = await res.blob();
+            new Audio(URL.createObjectURL(blob)).play();
+            return;
+        }
+        const mediaSource = new MediaSource();
+        const audio = new Audio(URL.createObjectURL(mediaSource));
+        mediaSource.addEventListener('sourceopen', async () => {
+            const buffer = mediaSource.addSourceBuffer('audio/mpeg');
+            const reader = res.body.getReader();
+            let started = false;
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                await new Promise(resolve => {
+                    buffer.addEventListener('updateend', resolve, { once: true });
+                    buffer.appendBuffer(value);
+                });
+                if (!started) { started = true; audio.play(); }
+            }
+            if (mediaSource.readyState === 'open') mediaSource.endOfStream();
+        }, { once: true });
+    }
+
     // Global Speak Function (Replace Browser TTS)
     // We override the one inside initChat or define a global one.
     // Ideally we define this on window or pass it down.
@@ -940,10 +1093,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 });
 
                 if (res.ok) {
-                    const blob = await res.blob();
-                    const url = URL.createObjectURL(blob);
-                    const audio = new Audio(url);
-                    audio.play();
+                    await playAudioStream(res);
                     return;
                 }
             } catch (e) { console.error("TTS API Failed", e); }
@@ -956,41 +1106,38 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
-    // --- Mentor Polling Loop ---
-    setInterval(async () => {
-        // Only if narrator/auto-guidance is on? Or maybe separate "Mentor" toggle?
-        // User asked for "Mentor" mode. Let's assume it shares the 'Narrator Mode' toggle or is always active if narrator on.
-        const narratorOn = document.getElementById('narratorToggle').checked;
-        if (!narratorOn) return;
+    // --- Mentor Tips (pushed over SSE) ---
+    let mentorSource = null;
+    let mentorProject = null;
 
-        // Get Project Name from page state (might be in data obj if defined nearby, or grab from DOM)
-        // We need a stable way to get current project.
-        // Let's assume 'projectName' var from initChat scope is hard to reach here.
-        // But we have 'projectInfo.innerHTML' or URL param.
+    function connectMentor() {
+        // Mentor shares the 'Narrator Mode' toggle
+        const narratorOn = document.getElementById('narratorToggle').checked;
         const urlParams = new URLSearchParams(window.location.search);
         const urlProject = urlParams.get('project');
         // Fallback to title
         const domProject = document.querySelector('.project-title') ? document.querySelector('.project-title').textContent : null;
         const activeProject = urlProject || domProject || "Untitled";
+        const wanted = narratorOn && activeProject !== "Untitled" ? activeProject : null;
 
-        if (!activeProject || activeProject === "Untitled") return;
-
-        try {
-            const res = await fetch(`/api/mentor/tip?project_name=${encodeURIComponent(activeProject)}`);
-            const data = await res.json();
+        if (wanted === mentorProject) return;
+        if (mentorSource) mentorSource.close();
+        mentorSource = null;
+        mentorProject = wanted;
+        if (!wanted) return;
 
+        mentorSource = new EventSource(`/api/mentor/stream?project_name=${encodeURIComponent(wanted)}`);
+        mentorSource.onmessage = (e) => {
+            const data = JSON.parse(e.data);
             if (data.tip) {
-                // Play it!
                 console.log("Mentor Tip:", data.tip);
-                // Slight delay or visual cue?
-                // Just speak it.
                 if (window.speakCheck) window.speakCheck(data.tip);
-
-                // Optional: Show a toast "Mentor Tip: ..."
             }
-        } catch (e) {
-            console.error("Mentor Poll Error", e);
-        }
-    }, 45000); // Poll every 45s
+        };
+    }
+
+    narratorToggle.addEventListener('change', connectMentor);
+    document.addEventListener('projectchange', connectMentor);
+    connectMentor();
 
 });
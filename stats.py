@@ -0,0 +1,174 @@
+"""
+Stats Counters
+--------------
+Admin aggregates (users, active subscriptions, projects, builds/projects per
+day) kept in the `stats_counters` table and updated in the same transaction
+as the write that changes them, so /admin reads every number it shows with
+a single indexed lookup instead of COUNTing whole tables per page view.
+
+Writes are hooked with SQLAlchemy mapper events on User and Project; builds
+are recorded explicitly by /build. `rebuild()` recomputes the totals from
+the base tables (first deploy, or after manual data fixes).
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Project, User, StatsCounter
+
+TOTAL_KEYS = ("users", "active_subs", "projects")
+FREE_PACKAGE_ID = 1
+
+_table = StatsCounter.__table__
+
+
+def day_key(name, day):
+    return f"{name}:{day.strftime('%Y-%m-%d')}"
+
+
+def is_active_sub(package_id, status):
+    return package_id not in (None, FREE_PACKAGE_ID) and status == "active"
+
+
+def increment(connection, deltas):
+    """Atomically add `deltas` ({key: n}) to the counters on `connection`."""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    rows = [{"key": k, "value": v} for k, v in deltas.items()]
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(_table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[_table.c.key],
+            set_={"value": _table.c.value + stmt.excluded.value}
+        )
+        connection.execute(stmt)
+        return
+    for key, value in deltas.items():
+        result = connection.execute(
+            _table.update().where(_table.c.key == key).values(value=_table.c.value + value)
+        )
+        if result.rowcount == 0:
+            connection.execute(_table.insert().values(key=key, value=value))
+
+
+def _old_value(state, attr, current):
+    history = state.attrs[attr].history
+    return history.deleted[0] if history.deleted else current
+
+
+# ------------------------------------------------------------------
+# Write hooks
+# ------------------------------------------------------------------
+@event.listens_for(User, "after_insert")
+def _user_inserted(mapper, connection, target):
+    increment(connection, {
+        "users": 1,
+        "active_subs": int(is_active_sub(target.package_id, target.subscription_status)),
+    })
+
+
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, target):
+    state = inspect(target)
+    was = is_active_sub(
+        _old_value(state, "package_id", target.package_id),
+        _old_value(state, "subscription_status", target.subscription_status)
+    )
+    now = is_active_sub(target.package_id, target.subscription_status)
+    if was != now:
+        increment(connection, {"active_subs": 1 if now else -1})
+
+
+@event.listens_for(User, "after_delete")
+def _user_deleted(mapper, connection, target):
+    increment(connection, {
+        "users": -1,
+        "active_subs": -int(is_active_sub(target.package_id, target.subscription_status)),
+    })
+
+
+@event.listens_for(Project, "after_insert")
+def _project_inserted(mapper, connection, target):
+    increment(connection, {
+        "projects": 1,
+        day_key("projects", target.created_at or datetime.utcnow()): 1,
+    })
+
+
+@event.listens_for(Project, "after_delete")
+def _project_deleted(mapper, connection, target):
+    increment(connection, {"projects": -1})
+
+
+def record_build():
+    with db.engine.begin() as connection:
+        increment(connection, {day_key("builds", datetime.utcnow()): 1})
+
+
+# ------------------------------------------------------------------
+# Reads / maintenance
+# ------------------------------------------------------------------
+def snapshot(days=14):
+    """Totals plus per-day series for the last `days` days, in one query."""
+    today = datetime.utcnow()
+    dates = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    keys = list(TOTAL_KEYS)
+    for name in ("builds", "projects"):
+        keys += [day_key(name, d) for d in dates]
+
+    values = dict(
+        db.session.query(StatsCounter.key, StatsCounter.value)
+        .filter(StatsCounter.key.in_(keys))
+        .all()
+    )
+    labels = [d.strftime("%Y-%m-%d") for d in dates]
+    return {
+        "total_users": values.get("users", 0),
+        "active_subs": values.get("active_subs", 0),
+        "projects_count": values.get("projects", 0),
+        "days": labels,
+        "builds_per_day": [values.get(f"builds:{label}", 0) for label in labels],
+        "projects_per_day": [values.get(f"projects:{label}", 0) for label in labels],
+    }
+
+
+def rebuild():
+    """Recompute totals and projects-per-day from the base tables."""
+    users = db.session.query(func.count(User.username)).scalar() or 0
+    active = (
+        db.session.query(func.count(User.username))
+        .filter(User.package_id != FREE_PACKAGE_ID, User.subscription_status == "active")
+        .scalar() or 0
+    )
+    projects = db.session.query(func.count(Project.id)).scalar() or 0
+    per_day = (
+        db.session.query(func.date(Project.created_at), func.count(Project.id))
+        .group_by(func.date(Project.created_at))
+        .all()
+    )
+
+    # Builds have no base table; their counters are kept as they are
+    db.session.query(StatsCounter).filter(
+        StatsCounter.key.in_(TOTAL_KEYS) | StatsCounter.key.like("projects:%")
+    ).delete(synchronize_session=False)
+    db.session.add_all([
+        StatsCounter(key="users", value=users),
+        StatsCounter(key="active_subs", value=active),
+        StatsCounter(key="projects", value=projects),
+    ])
+    for day, count in per_day:
+        if day is not None:
+            label = day if isinstance(day, str) else day.strftime("%Y-%m-%d")
+            db.session.add(StatsCounter(key=f"projects:{label}", value=count))
+    db.session.commit()
+
+
+def ensure_initialized():
+    """Backfill the counters once, the first time the table is empty."""
+    if db.session.get(StatsCounter, "users") is None:
+        rebuild()
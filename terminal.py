@@ -0,0 +1,240 @@
+"""
+Terminal Sessions
+-----------------
+Runs already-validated terminal commands as background processes so a long
+`npm install` no longer holds a request worker until it finishes. Output is
+collected line by line into a bounded ring buffer that clients tail over
+SSE (see /api/terminal/stream in app.py) and sessions can be cancelled.
+
+Sessions live in this process's memory: the app runs as a single gunicorn
+worker (see the Dockerfile) so the stream and cancel requests reach the
+process that started the command.
+
+Commands must be validated by the caller (CommandSanitizer /
+validate_command_parts) before they get here; this module never uses a shell.
+"""
+
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+
+MAX_SESSIONS_PER_USER = int(os.getenv("TERMINAL_MAX_SESSIONS_PER_USER", "2"))
+MAX_RUNTIME = int(os.getenv("TERMINAL_MAX_RUNTIME", "900"))  # Seconds before a session is killed
+RING_BUFFER_LINES = int(os.getenv("TERMINAL_RING_BUFFER_LINES", "2000"))
+RETENTION = 300  # Seconds a finished session stays readable
+
+logger = logging.getLogger(__name__)
+
+
+class TerminalLimitError(Exception):
+    pass
+
+
+class TerminalSession:
+    def __init__(self, user_id, project_name, command_parts, on_exit=None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.project_name = project_name
+        self.command_parts = command_parts
+        self.on_exit = on_exit  # Called with the session once it has finished
+        self.proc = None
+        self.status = "starting"  # running, exited, cancelled, timeout, failed
+        self.exit_code = None
+        self.started_at = time.time()
+        self.ended_at = None
+        self._lines = deque(maxlen=RING_BUFFER_LINES)  # (seq, stream, text)
+        self._seq = 0
+        self._open_streams = 0
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status not in ("starting", "running")
+
+    def _append(self, stream, text):
+        with self._cond:
+            self._seq += 1
+            self._lines.append((self._seq, stream, text))
+            self._cond.notify_all()
+
+    def _pump(self, pipe, stream):
+        try:
+            for line in iter(pipe.readline, ""):
+                self._append(stream, line)
+        finally:
+            pipe.close()
+            with self._cond:
+                self._open_streams -= 1
+                self._cond.notify_all()
+
+    def _wait(self):
+        try:
+            exit_code = self.proc.wait(timeout=MAX_RUNTIME)
+        except subprocess.TimeoutExpired:
+            self._kill()
+            exit_code = self.proc.wait()
+            self._append("system", f"Killed after {MAX_RUNTIME} seconds\n")
+            self.status = "timeout"
+
+        # Let the readers drain what's left in the pipes before reporting exit
+        with self._cond:
+            self._cond.wait_for(lambda: self._open_streams == 0, timeout=5)
+            self.exit_code = exit_code
+            if self.status == "running":
+                self.status = "exited"
+            self.ended_at = time.time()
+            self._cond.notify_all()
+
+        if self.on_exit:
+            try:
+                self.on_exit(self)
+            except Exception as e:
+                logger.warning(f"Terminal exit hook failed for {self.id}: {e}")
+
+    def _kill(self):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        try:
+            if os.name != "nt":
+                os.killpg(self.proc.pid, signal.SIGTERM)
+            else:
+                self.proc.terminate()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def start(self, cwd, env=None, setup=None):
+        """
+        Launch the command. With `setup`, a callable returning the env that may
+        take a while (dependency preparation), both run on a background thread
+        and a launch failure is reported in the output instead of raised.
+        """
+        if setup is None:
+            self._spawn(cwd, env)
+        else:
+            threading.Thread(target=self._setup_and_spawn, args=(cwd, setup), daemon=True).start()
+
+    def _setup_and_spawn(self, cwd, setup):
+        try:
+            env = setup()
+        except Exception as e:
+            logger.warning(f"Terminal setup failed for {self.id}: {e}")
+            env = None
+        if self.status == "cancelled":
+            with self._cond:
+                self.ended_at = time.time()
+                self._cond.notify_all()
+            return
+        try:
+            self._spawn(cwd, env)
+        except Exception:
+            return  # Already in the session's output
+        if self.status == "cancelled":  # Cancelled while launching
+            self._kill()
+
+    def _spawn(self, cwd, env):
+        try:
+            self.proc = subprocess.Popen(
+                self.command_parts,
+                shell=False,  # CRITICAL: Never use shell=True
+                cwd=cwd,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+                start_new_session=(os.name != "nt")  # Own process group so cancel kills children too
+            )
+        except Exception as e:
+            self.status = "failed"
+            self.ended_at = time.time()
+            self._append("system", f"Execution Error: {e}\n")
+            raise
+
+        with self._cond:
+            if self.status == "starting":
+                self.status = "running"
+        self._open_streams = 2
+        threading.Thread(target=self._pump, args=(self.proc.stdout, "stdout"), daemon=True).start()
+        threading.Thread(target=self._pump, args=(self.proc.stderr, "stderr"), daemon=True).start()
+        threading.Thread(target=self._wait, daemon=True).start()
+
+    def cancel(self):
+        if self.done:
+            return False
+        self.status = "cancelled"
+        self._kill()
+        self._append("system", "^C\n")
+        return True
+
+    def read(self, after=0, timeout=15):
+        """
+        Return (lines, truncated, finished) for lines with seq > `after`, blocking up
+        to `timeout` seconds for new output. `truncated` means the ring buffer
+        already dropped some of the requested lines.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after or self.ended_at is not None, timeout=timeout)
+            lines = [entry for entry in self._lines if entry[0] > after]
+            truncated = bool(self._lines) and self._lines[0][0] > after + 1
+            return lines, truncated, self.ended_at is not None
+
+    def to_dict(self):
+        return {
+            "session_id": self.id,
+            "command": " ".join(self.command_parts),
+            "status": self.status,
+            "exit_code": self.exit_code,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+        }
+
+
+class TerminalManager:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _cleanup(self):
+        now = time.time()
+        for session_id, session in list(self._sessions.items()):
+            if session.done and session.ended_at and now - session.ended_at > RETENTION:
+                del self._sessions[session_id]
+
+    def start(self, user_id, project_name, command_parts, cwd, env=None, on_exit=None, setup=None):
+        with self._lock:
+            self._cleanup()
+            active = [s for s in self._sessions.values() if s.user_id == user_id and s.ended_at is None]
+            if len(active) >= MAX_SESSIONS_PER_USER:
+                raise TerminalLimitError(
+                    f"You already have {len(active)} running command(s); wait or cancel one first"
+                )
+            session = TerminalSession(user_id, project_name, command_parts, on_exit=on_exit)
+            self._sessions[session.id] = session
+
+        try:
+            session.start(cwd, env=env, setup=setup)
+        except Exception:
+            with self._lock:
+                self._sessions.pop(session.id, None)
+            raise
+        return session
+
+    def get(self, session_id, user_id):
+        """Sessions are only visible to the user that started them."""
+        session = self._sessions.get(session_id)
+        if session is None or session.user_id != user_id:
+            return None
+        return session
+
+    def active_count(self):
+        return sum(1 for s in list(self._sessions.values()) if s.ended_at is None)
+
+
+# Global Instance
+manager = TerminalManager()
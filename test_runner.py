@@ -0,0 +1,504 @@
+"""
+Test Runner
+-----------
+Incremental, parallel test execution for /api/test/run.
+
+- Python projects: every test file's import closure is computed from the
+  project sources (ast, no execution). A test file whose closure, and every
+  non-python input (data files, fixtures, configs, requirements), hashes the
+  same as last time reuses its cached per-test results; only affected files
+  are run, sharded across parallel pytest workers balanced by past durations.
+- Other projects (package.json): `npm test` runs once, cached by the hash of
+  the project sources.
+
+Only passing results are cached, so a failure always reruns. `full=True`
+ignores the cache.
+
+`run(project_root)` is a generator of NDJSON-ready events in the same
+{"status": ...} shape as the /build stream:
+
+    deps   -> dependencies are still being prepared (see dep_cache)
+    start  -> selected/cached counts and worker count
+    test   -> one per test case as soon as it finishes (id, file, line, outcome,
+              duration, cached, and for failures message, details and
+              traceback frames)
+    shard  -> a worker finished (exit code, output tail)
+    done   -> totals, exit_code and the combined output
+"""
+
+import ast
+import hashlib
+import json
+import os
+import queue
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dep_cache
+
+MAX_WORKERS = int(os.getenv("TEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+SHARD_TIMEOUT = int(os.getenv("TEST_SHARD_TIMEOUT", "120"))
+OUTPUT_TAIL = 4000  # Characters of worker output kept per shard
+CACHE_FILE = os.path.join(".test_cache", "results.json")
+RUNNER_VERSION = "4"  # Bump to invalidate every cached result
+CONFIG_FILES = ("requirements.txt", "pyproject.toml", "setup.cfg", "setup.py", "pytest.ini", "tox.ini")
+
+SKIP_DIRS = {"node_modules", ".venv", "venv", "__pycache__", ".git", ".test_cache", "backups", ".pytest_cache"}
+
+
+def _event(status, **fields):
+    return json.dumps(dict(status=status, **fields)) + "\n"
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _walk_files(root, suffix=None):
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS and not d.startswith(".")]
+        for name in files:
+            if suffix is None or name.endswith(suffix):
+                yield os.path.join(dirpath, name)
+
+
+def _inputs_key(project_root, src_dir):
+    """
+    Hash of what a test can read besides python imports: every non-.py file
+    under `src_dir` and the configs at the project root. Any change reruns
+    every test file, since which ones read it can't be told statically.
+    """
+    digest = hashlib.sha256()
+    paths = [p for p in _walk_files(src_dir) if not p.endswith((".py", ".pyc"))]
+    paths += [os.path.join(project_root, name) for name in CONFIG_FILES
+              if os.path.isfile(os.path.join(project_root, name))]
+    for path in sorted(set(paths)):
+        digest.update(os.path.relpath(path, project_root).encode())
+        digest.update(_hash_file(path).encode())
+    return digest.hexdigest()
+
+
+def _passed(tests):
+    return bool(tests) and all(t["outcome"] in ("passed", "skipped") for t in tests)
+
+
+def is_test_file(path):
+    name = os.path.basename(path)
+    return name.endswith(".py") and (name.startswith("test_") or name.endswith("_test.py"))
+
+
+# ------------------------------------------------------------------
+# Import dependency map
+# ------------------------------------------------------------------
+class DependencyMap:
+    """Which project files each python file imports, directly or transitively."""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = sorted(_walk_files(root, ".py"))
+        self.modules = {}  # dotted module name -> path
+        for path in self.files:
+            rel = os.path.relpath(path, root)[:-3].replace(os.sep, ".")
+            if rel.endswith(".__init__"):
+                rel = rel[:-len(".__init__")]
+            self.modules[rel] = path
+            # Flat layouts import siblings by bare name from any test directory
+            self.modules.setdefault(rel.rsplit(".", 1)[-1], path)
+        self._imports = {}
+
+    def _resolve(self, name):
+        # "pkg.mod.func" -> longest prefix that is a project module
+        parts = name.split(".")
+        for end in range(len(parts), 0, -1):
+            path = self.modules.get(".".join(parts[:end]))
+            if path:
+                return path
+        return None
+
+    def direct_imports(self, path):
+        if path in self._imports:
+            return self._imports[path]
+        found = set()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                tree = ast.parse(f.read(), filename=path)
+        except (SyntaxError, UnicodeDecodeError, OSError):
+            tree = None  # Can't tell what it imports; it is still part of its own closure
+
+        package = os.path.relpath(os.path.dirname(path), self.root).replace(os.sep, ".")
+        for node in ast.walk(tree) if tree else []:
+            names = []
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ""
+                if node.level:
+                    parent = package.split(".") if package != "." else []
+                    parent = parent[:len(parent) - (node.level - 1)] if node.level > 1 else parent
+                    base = ".".join(p for p in parent + ([base] if base else []) if p)
+                names = [f"{base}.{alias.name}" if base else alias.name for alias in node.names]
+            for name in names:
+                target = self._resolve(name)
+                if target and target != path:
+                    found.add(target)
+
+        # conftest.py files up to the root apply to every test below them
+        directory = os.path.dirname(path)
+        while directory.startswith(self.root):
+            conftest = os.path.join(directory, "conftest.py")
+            if conftest != path and os.path.isfile(conftest):
+                found.add(conftest)
+            if directory == self.root:
+                break
+            directory = os.path.dirname(directory)
+
+        self._imports[path] = found
+        return found
+
+    def closure(self, path):
+        seen, stack = {path}, [path]
+        while stack:
+            for dep in self.direct_imports(stack.pop()):
+                if dep not in seen:
+                    seen.add(dep)
+                    stack.append(dep)
+        return seen
+
+
+# ------------------------------------------------------------------
+# Result cache
+# ------------------------------------------------------------------
+class ResultCache:
+    """Per-project JSON file: test file -> {key, duration, tests}."""
+
+    def __init__(self, project_root):
+        self.path = os.path.join(project_root, CACHE_FILE)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        if self.data.get("version") != RUNNER_VERSION:
+            self.data = {"version": RUNNER_VERSION, "files": {}}
+
+    def get(self, rel_path, key):
+        entry = self.data["files"].get(rel_path)
+        return entry if entry and entry.get("key") == key else None
+
+    def duration(self, rel_path):
+        return self.data["files"].get(rel_path, {}).get("duration", 1.0)
+
+    def put(self, rel_path, key, duration, tests):
+        with self._lock:
+            self.data["files"][rel_path] = {"key": key, "duration": duration, "tests": tests}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with self._lock, open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+
+# ------------------------------------------------------------------
+# Per-test reports
+# ------------------------------------------------------------------
+# Loaded into every pytest worker with -p. Appends one JSON line per finished
+# test to $KIMI_TEST_EVENTS, which the runner tails while the shard is running.
+PLUGIN_NAME = "kimi_test_events"
+PLUGIN_SOURCE = '''
+import json
+import os
+
+_out = open(os.environ["KIMI_TEST_EVENTS"], "a", buffering=1, encoding="utf-8")
+
+
+def pytest_runtest_logreport(report):
+    # One line per test: its call, or the setup/teardown that went wrong
+    if report.when == "setup" and report.passed:
+        return
+    if report.when == "teardown" and not report.failed:
+        return
+    if report.failed:
+        outcome = "failed" if report.when == "call" else "error"
+    else:
+        outcome = report.outcome
+    longrepr = report.longrepr
+    if isinstance(longrepr, tuple):  # (file, line, reason) for skips
+        message = str(longrepr[-1])
+    else:
+        crash = getattr(longrepr, "reprcrash", None)
+        message = crash.message if crash is not None else ""
+    path, line, _ = report.location
+    _out.write(json.dumps({
+        "id": report.nodeid,
+        "file": path.replace("\\\\", "/"),
+        "line": line + 1 if line is not None else None,
+        "name": report.nodeid.split("::")[-1],
+        "outcome": outcome,
+        "duration": report.duration,
+        "message": message,
+        "details": report.longreprtext if report.failed else "",
+    }) + "\\n")
+'''
+
+# "pkg/calc.py:12: in add" / "tests/test_calc.py:3: AssertionError"
+_FRAME_RE = re.compile(r"^(?P<file>[^\s:][^:\n]*\.py):(?P<line>\d+):\s*(?P<text>.*)$", re.MULTILINE)
+
+
+def parse_frames(details):
+    """Traceback frames (file, line, text) from pytest's long failure output."""
+    frames = []
+    for match in _FRAME_RE.finditer(details or ""):
+        frame = {
+            "file": match.group("file").replace("\\", "/"),
+            "line": int(match.group("line")),
+            "text": match.group("text").strip(),
+        }
+        if frame not in frames:
+            frames.append(frame)
+    return frames
+
+
+def parse_report_line(line):
+    """Test case dict from one line the plugin wrote, or None if incomplete."""
+    try:
+        test = json.loads(line)
+    except ValueError:
+        return None
+    test["frames"] = parse_frames(test["details"]) if test["outcome"] in ("failed", "error") else []
+    return test
+
+
+# ------------------------------------------------------------------
+# Runners
+# ------------------------------------------------------------------
+def _shard(files, cache, workers):
+    """Greedy longest-first assignment by last known duration."""
+    shards = [[] for _ in range(max(1, min(workers, len(files))))]
+    loads = [0.0] * len(shards)
+    for rel in sorted(files, key=cache.duration, reverse=True):
+        i = loads.index(min(loads))
+        shards[i].append(rel)
+        loads[i] += cache.duration(rel)
+    return [s for s in shards if s]
+
+
+def _run_shard(files, cwd, env, report_dir, index, emit):
+    """Run one pytest worker, calling emit(test) as each test finishes."""
+    report = os.path.join(report_dir, f"shard-{index}.jsonl")
+    log = os.path.join(report_dir, f"shard-{index}.log")
+    open(report, "w").close()
+    env = dict(env, KIMI_TEST_EVENTS=report,
+               PYTHONPATH=os.pathsep.join(p for p in (report_dir, env.get("PYTHONPATH")) if p))
+    cmd = ["python", "-m", "pytest", "-q", "-p", "no:cacheprovider", "-p", PLUGIN_NAME, "--rootdir=.", *files]
+    start = time.time()
+    tests, pending, exit_code = [], "", None
+    # Output goes to a file, not a pipe, so a chatty shard can't block on it
+    with open(log, "w+", encoding="utf-8", errors="replace") as out, \
+            open(report, "r", encoding="utf-8") as events:
+        proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=out, stderr=subprocess.STDOUT, text=True)
+        while True:
+            exit_code = proc.poll()
+            pending += events.read()
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                test = parse_report_line(line)
+                if test:
+                    tests.append(test)
+                    emit(test)
+            if exit_code is not None:
+                break
+            if time.time() - start > SHARD_TIMEOUT:
+                proc.kill()
+                proc.wait()
+                exit_code = -1
+                break
+            time.sleep(0.05)
+        out.seek(0)
+        output = out.read()
+    if exit_code == -1:
+        output += f"\nShard timed out after {SHARD_TIMEOUT} seconds"
+    return {
+        "index": index,
+        "files": files,
+        "exit_code": exit_code,
+        "output": output,
+        "elapsed": time.time() - start,
+        "tests": tests,
+    }
+
+
+def run_python(project_root, src_dir, workers=MAX_WORKERS, full=False):
+    start = time.time()
+    deps = DependencyMap(src_dir)
+    cache = ResultCache(project_root)
+    hashes = {}
+    inputs = _inputs_key(project_root, src_dir)
+
+    def closure_key(path):
+        parts = [RUNNER_VERSION, inputs]
+        for dep in sorted(deps.closure(path)):
+            if dep not in hashes:
+                hashes[dep] = _hash_file(dep)
+            parts.append(f"{os.path.relpath(dep, src_dir)}:{hashes[dep]}")
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    test_files = [p for p in deps.files if is_test_file(p)]
+    keys, cached, selected = {}, [], []
+    for path in test_files:
+        rel = os.path.relpath(path, src_dir).replace(os.sep, "/")
+        keys[rel] = closure_key(path)
+        entry = None if full else cache.get(rel, keys[rel])
+        (cached if entry else selected).append((rel, entry))
+
+    yield _event("start", framework="pytest", total_files=len(test_files),
+                 selected=len(selected), cached=len(cached), workers=min(workers, len(selected)))
+
+    totals = {"passed": 0, "failed": 0, "error": 0, "skipped": 0}
+    outputs = []
+
+    for rel, entry in cached:
+        for test in entry["tests"]:
+            totals[test["outcome"]] += 1
+            yield _event("test", cached=True, **test)
+
+    exit_codes = []
+    if selected:
+        env = dep_cache.install_env(project_root)
+        shards = _shard([rel for rel, _ in selected], cache, workers)
+        # Workers push ("test", dict) as tests finish and ("shard", result) at exit
+        updates = queue.Queue()
+
+        def work(files, index):
+            try:
+                result = _run_shard(files, src_dir, env, report_dir, index,
+                                    lambda test: updates.put(("test", test)))
+            except Exception as e:
+                result = {"index": index, "files": files, "exit_code": -1,
+                          "output": f"Shard failed to start: {e}", "elapsed": 0.0, "tests": []}
+            updates.put(("shard", result))
+
+        with tempfile.TemporaryDirectory(prefix="kimi-tests-") as report_dir, \
+                ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            with open(os.path.join(report_dir, f"{PLUGIN_NAME}.py"), "w", encoding="utf-8") as f:
+                f.write(PLUGIN_SOURCE)
+            for i, files in enumerate(shards):
+                pool.submit(work, files, i)
+            remaining = len(shards)
+            while remaining:
+                kind, item = updates.get()
+                if kind == "test":
+                    totals[item["outcome"]] += 1
+                    yield _event("test", cached=False, **item)
+                    continue
+                remaining -= 1
+                result = item
+                by_file = {}
+                for test in result["tests"]:
+                    by_file.setdefault(test["file"], []).append(test)
+
+                # Only cache files whose tests all passed; failures, and a
+                # crashed or timed-out shard (or a missing pytest), rerun next time
+                if result["exit_code"] in (0, 1):
+                    share = result["elapsed"] / max(1, len(result["files"]))
+                    for rel in result["files"]:
+                        if _passed(by_file.get(rel)):
+                            cache.put(rel, keys[rel], share, by_file[rel])
+                exit_codes.append(result["exit_code"])
+                outputs.append(result["output"])
+                yield _event("shard", index=result["index"], files=result["files"],
+                             exit_code=result["exit_code"], elapsed=round(result["elapsed"], 2),
+                             output=result["output"][-OUTPUT_TAIL:])
+        cache.save()
+
+    failed = totals["failed"] + totals["error"]
+    # A shard can fail without reporting a test (collection error, no pytest)
+    broken = [code for code in exit_codes if code not in (0, 5)]  # 5 = no tests collected
+    exit_code = 1 if failed else (broken[0] if broken else 0)
+    yield _event("done", exit_code=exit_code, elapsed=round(time.time() - start, 2),
+                 output="\n".join(outputs), **totals)
+
+
+def run_npm(project_root, full=False):
+    start = time.time()
+    cache = ResultCache(project_root)
+    digest = hashlib.sha256(RUNNER_VERSION.encode())
+    for path in sorted(_walk_files(project_root)):
+        digest.update(os.path.relpath(path, project_root).encode())
+        digest.update(_hash_file(path).encode())
+    key = digest.hexdigest()
+
+    entry = None if full else cache.get("npm test", key)
+    yield _event("start", framework="npm", total_files=1, selected=0 if entry else 1,
+                 cached=1 if entry else 0, workers=0 if entry else 1)
+    if entry:
+        test = entry["tests"][0]
+    else:
+        try:
+            proc = subprocess.run(
+                ["npm", "test"], cwd=project_root, env=dep_cache.install_env(project_root),
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=SHARD_TIMEOUT
+            )
+            exit_code, output = proc.returncode, proc.stdout
+        except subprocess.TimeoutExpired:
+            exit_code, output = -1, f"npm test timed out after {SHARD_TIMEOUT} seconds"
+        test = {
+            "id": "npm test", "file": "package.json", "line": None, "name": "npm test",
+            "outcome": "passed" if exit_code == 0 else "failed",
+            "duration": round(time.time() - start, 2),
+            "message": "" if exit_code == 0 else f"npm test exited with {exit_code}",
+            "details": output, "frames": [], "exit_code": exit_code,
+        }
+        if exit_code == 0:
+            cache.put("npm test", key, test["duration"], [test])
+            cache.save()
+
+    yield _event("test", cached=bool(entry), **test)
+    yield _event("done", exit_code=test["exit_code"], elapsed=round(time.time() - start, 2),
+                 output=test["details"], passed=int(test["outcome"] == "passed"),
+                 failed=int(test["outcome"] != "passed"), error=0, skipped=0)
+
+
+def detect(project_root):
+    """'npm', 'pytest' or None, with the directory tests run from."""
+    src_dir = os.path.join(project_root, "src")
+    if os.path.exists(os.path.join(project_root, "package.json")):
+        return "npm", project_root
+    if os.path.isdir(src_dir) and (
+        os.path.exists(os.path.join(src_dir, "requirements.txt"))
+        or next(_walk_files(src_dir, ".py"), None)
+    ):
+        return "pytest", src_dir
+    return None, None
+
+
+def run(project_root, full=False, workers=MAX_WORKERS):
+    """Event stream for one test run (see module docstring)."""
+    framework, cwd = detect(project_root)
+    if framework is None:
+        yield _event("done", exit_code=1, passed=0, failed=0, error=0, skipped=0, elapsed=0,
+                     output="No testing framework detected (package.json or pytest).")
+        return
+    try:
+        # Clone warm dependency trees in the background; this run uses what is
+        # installed now and a later one gets the rest. Shared caches (and the
+        # offline index if configured) come from install_env.
+        if not dep_cache.pool.prepare_async(project_root).done():
+            yield _event("deps", message="Preparing dependencies in the background")
+        if framework == "npm":
+            yield from run_npm(project_root, full=full)
+        else:
+            yield from run_python(project_root, cwd, workers=workers, full=full)
+    except Exception as e:
+        yield _event("done", exit_code=-1, passed=0, failed=0, error=0, skipped=0, elapsed=0,
+                     output=f"Execution Failed: {str(e)}")
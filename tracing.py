@@ -0,0 +1,345 @@
+"""
+Tracing
+-------
+Lightweight request tracing, so a slow build can be pinned on the model, the
+search backend, summarization, disk writes or GitHub instead of guessed at.
+
+    with tracing.span("search.web", query=query):
+        ...
+
+    @tracing.traced("github.upload")
+    def upload_file_to_github(...): ...
+
+Spans nest through a context variable: every HTTP request gets a root span
+(`start_trace`, same trace id as its LLM calls and log records) and anything
+opened while serving it becomes a child. Each span keeps a breakdown of where
+its time went by component, the first part of the span name ("llm",
+"scheduler", "search", "fs", "validation", "github", "build"...), counting
+only exclusive time so nested spans are not counted twice. The build stream
+reports that breakdown per agent.
+
+Finished spans go to the in-memory `collector` (per-name counts and
+p50/p95/p99 over the last TRACE_WINDOW durations, plus the most recent
+request traces, shown on /admin) and, if TRACE_FILE is set, are appended
+there by a background thread as OTLP/JSON lines, one ExportTraceServiceRequest
+per line, which the OpenTelemetry Collector's `otlpjsonfile` receiver can
+ingest. Ids follow W3C trace context (32/16 hex digits).
+
+Stats are per process: with several gunicorn workers each one reports its own.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+import metrics
+import redaction
+
+TRACE_FILE = os.getenv("TRACE_FILE")  # Unset: in-memory collector only
+WINDOW = int(os.getenv("TRACE_WINDOW", "1000"))  # Durations kept per span name for percentiles
+RECENT_TRACES = int(os.getenv("TRACE_RECENT", "50"))
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "kimi_code")
+
+logger = logging.getLogger(__name__)
+
+_TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_COMPONENT_RE = re.compile(r"[. ]")
+_current = contextvars.ContextVar("trace_span", default=None)
+_merge_lock = threading.Lock()  # Children may finish in worker threads
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def new_span_id():
+    return uuid.uuid4().hex[:16]
+
+
+def component(name):
+    """"llm.complete" -> "llm", "http GET /build" -> "http"."""
+    return _COMPONENT_RE.split(name, 1)[0]
+
+
+class Span:
+    def __init__(self, name, trace_id, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._start = time.perf_counter()
+        self._children = 0.0  # Seconds spent in direct children
+        self.breakdown = {}   # component -> exclusive seconds in this subtree
+        self.status = "ok"
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def fail(self, message):
+        """Mark the span failed when the error is handled rather than raised."""
+        self.status, self.error = "error", message
+        return self
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def timing(self):
+        """(total seconds, {component: seconds}) so far; usable before the span ends."""
+        elapsed = self.elapsed
+        with _merge_lock:
+            breakdown = dict(self.breakdown)
+            own = max(0.0, elapsed - self._children)
+        breakdown[component(self.name)] = breakdown.get(component(self.name), 0.0) + own
+        return elapsed, breakdown
+
+    def end(self, error=None):
+        if self.end_ns is not None:
+            return
+        if error is not None:
+            self.status = "cancelled" if isinstance(error, GeneratorExit) else "error"
+            self.error = f"{type(error).__name__}: {error}"
+        self.duration, self.breakdown = self.timing()
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+        if self.parent is not None:
+            with _merge_lock:
+                self.parent._children += self.duration
+                for key, seconds in self.breakdown.items():
+                    self.parent.breakdown[key] = self.parent.breakdown.get(key, 0.0) + seconds
+        collector.record(self)
+
+
+def timing_ms(span):
+    """The current breakdown of `span` in milliseconds, largest first (NDJSON timing events)."""
+    total, breakdown = span.timing()
+    return round(total * 1000, 1), {
+        key: round(seconds * 1000, 1)
+        for key, seconds in sorted(breakdown.items(), key=lambda item: -item[1])
+    }
+
+
+# ------------------------------------------------------------------
+# Context
+# ------------------------------------------------------------------
+def current_span():
+    return _current.get()
+
+
+def start_trace(trace_id=None, name="request", **attributes):
+    """Open the root span for this context (e.g. an HTTP request); end it with `end_trace`."""
+    if not trace_id or not _TRACE_ID_RE.match(trace_id):
+        attributes.setdefault("request_id", trace_id)
+        trace_id = new_trace_id()
+    root = Span(name, trace_id, None, attributes)
+    _current.set(root)
+    return root
+
+
+def end_trace(root, error=None):
+    if root is not None:
+        root.end(error)
+    _current.set(None)
+
+
+def end_after(chunks, root):
+    """Keep `root` current while a streamed response is sent and end it after the last chunk."""
+    error = None
+    try:
+        _current.set(root)
+        yield from chunks
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        end_trace(root, error)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Time a block as a child of the current span (or a new trace if there is none)."""
+    parent = _current.get()
+    child = Span(name, parent.trace_id if parent else new_trace_id(), parent, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.end(e)
+        raise
+    else:
+        child.end()
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            _current.set(parent)  # A streamed generator resumed in another context
+
+
+def traced(name):
+    """Decorator form of `span`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ------------------------------------------------------------------
+# Export
+# ------------------------------------------------------------------
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": redaction.redact(str(value))}
+
+
+def to_otlp(s):
+    """A finished span as an OTLP/JSON span object."""
+    entry = {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": 2 if s.parent is None else 1,  # SERVER for request roots, else INTERNAL
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items() if v is not None],
+        "status": {"code": 2, "message": redaction.redact(s.error)} if s.status == "error" else {"code": 1},
+    }
+    if s.parent is not None:
+        entry["parentSpanId"] = s.parent.span_id
+    return entry
+
+
+class FileExporter:
+    """Appends spans to a JSONL file from a background thread, off the request path."""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def export(self, s):
+        self._queue.put(s)
+
+    def _batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < 512:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        resource = {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]}
+        while True:
+            batch = self._batch()
+            done = None in batch
+            spans = [to_otlp(s) for s in batch if s is not None]
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for entry in spans:
+                        f.write(json.dumps({"resourceSpans": [{
+                            "resource": resource,
+                            "scopeSpans": [{"scope": {"name": "kimi_code.tracing"}, "spans": [entry]}],
+                        }]}) + "\n")
+            except OSError as e:
+                logger.warning(f"Trace export failed: {e}")
+            if done:
+                return
+
+    def shutdown(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=2)
+
+
+# ------------------------------------------------------------------
+# Collector
+# ------------------------------------------------------------------
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Collector:
+    def __init__(self, window=WINDOW, export_path=TRACE_FILE):
+        self._lock = threading.Lock()
+        self.spans = defaultdict(lambda: {"count": 0, "errors": 0, "total": 0.0, "durations": deque(maxlen=window)})
+        self.traces = deque(maxlen=RECENT_TRACES)
+        self.exporter = FileExporter(export_path) if export_path else None
+
+    def record(self, s):
+        with self._lock:
+            entry = self.spans[s.name]
+            entry["count"] += 1
+            entry["total"] += s.duration
+            entry["durations"].append(s.duration)
+            if s.status == "error":
+                entry["errors"] += 1
+            if s.parent is None:
+                self.traces.append({
+                    "trace_id": s.trace_id,
+                    "name": s.name,
+                    "started": time.strftime("%H:%M:%S", time.localtime(s.start_ns / 1e9)),
+                    "duration_ms": round(s.duration * 1000, 1),
+                    "status": s.status,
+                    "breakdown": {k: round(v * 1000, 1) for k, v in sorted(s.breakdown.items(), key=lambda i: -i[1])},
+                })
+        metrics.SPAN_DURATION.labels(s.name, s.status).observe(s.duration)
+        if self.exporter is not None:
+            self.exporter.export(s)
+
+    def get_stats(self):
+        """Per span name latency (ms) ordered by total time, and the latest request traces."""
+        with self._lock:
+            rows = []
+            for name, entry in self.spans.items():
+                durations = sorted(entry["durations"])
+                rows.append({
+                    "name": name,
+                    "count": entry["count"],
+                    "errors": entry["errors"],
+                    "total_s": round(entry["total"], 2),
+                    "avg_ms": round(1000 * entry["total"] / entry["count"], 1),
+                    "p50_ms": round(1000 * percentile(durations, 50), 1),
+                    "p95_ms": round(1000 * percentile(durations, 95), 1),
+                    "p99_ms": round(1000 * percentile(durations, 99), 1),
+                    "max_ms": round(1000 * durations[-1], 1),
+                })
+            traces = list(reversed(self.traces))
+        rows.sort(key=lambda row: -row["total_s"])
+        return {"spans": rows, "traces": traces}
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.traces.clear()
+
+
+# Global Instance
+collector = Collector()
@@ -0,0 +1,388 @@
+"""
+TTS Audio Cache
+---------------
+Narration audio for /api/tts without paying ElevenLabs for the same words
+twice:
+
+- Content-addressed disk cache: one .mp3 per sha256 of (voice_id, model,
+  voice settings, text), evicted least-recently-used once the directory
+  grows past TTS_CACHE_MAX_BYTES. Canned status lines ("Build complete.")
+  are synthesized once per voice, for every user.
+- Sentence chunking: text is split into sentences that are cached and
+  synthesized independently. Chunks are fetched in parallel and streamed in
+  order, so the first sentence plays while later ones are still being
+  synthesized (MP3 frames concatenate into one playable stream).
+- Upstream calls run TTS_MAX_PARALLEL at a time per API key (ElevenLabs
+  limits concurrency per account), so one user's long narration doesn't
+  queue everyone else's. Concurrent misses for the same chunk share one
+  call only when they use the same key.
+- One pooled `requests.Session` for every call instead of a new connection
+  per request. ELEVENLABS_BASE_URL points it at a local stub
+  (benchmarks/stub_elevenlabs.py) for tests.
+
+Each gunicorn worker keeps its own LRU index of the shared directory; a file
+another worker already evicted is simply synthesized again.
+
+The voice list behind /api/voices is cached per API key by `VoiceCatalog`:
+fresh for VOICES_TTL seconds, then served stale while one background request
+revalidates it against the upstream ETag.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io").rstrip("/")
+CACHE_DIR = os.path.abspath(os.getenv("TTS_CACHE_DIR", ".tts_cache"))
+MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+MAX_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "250"))
+MAX_PARALLEL = int(os.getenv("TTS_MAX_PARALLEL", "3"))
+REQUEST_TIMEOUT = 30
+VOICES_TTL = int(os.getenv("VOICES_CACHE_TTL", "600"))
+VOICES_MAX_STALE = int(os.getenv("VOICES_MAX_STALE", "86400"))  # After this, wait for a refresh
+VOICES_MAX_KEYS = 256
+SYNTH_MAX_KEYS = 64  # Per-key executors kept, least recently used shut down
+
+DEFAULT_VOICE_ID = "21m00Tcm4TlvDq8ikWAM"  # Rachel
+DEFAULT_MODEL_ID = os.getenv("TTS_MODEL_ID", "eleven_monolingual_v1")
+DEFAULT_SETTINGS = {"stability": 0.5, "similarity_boost": 0.5}
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+class TTSError(Exception):
+    """Upstream synthesis failed; carries the upstream status code."""
+
+    def __init__(self, message, status_code=502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def key_id(api_key):
+    """Stable id for an API key that is safe to keep in memory and logs."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+# ------------------------------------------------------------------
+# Chunking
+# ------------------------------------------------------------------
+def _split_long(sentence, limit):
+    # Prefer clause boundaries, fall back to word boundaries
+    pieces, current = [], ""
+    for part in re.split(r"(?<=,)\s+|\s+", sentence):
+        if current and len(current) + 1 + len(part) > limit:
+            pieces.append(current)
+            current = part
+        else:
+            current = f"{current} {part}" if current else part
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_sentences(text, limit=MAX_CHUNK_CHARS):
+    """Whitespace-normalized sentences, none longer than `limit` characters."""
+    text = _SPACE_RE.sub(" ", text or "").strip()
+    chunks = []
+    for sentence in _SENTENCE_RE.split(text):
+        if not sentence:
+            continue
+        if len(sentence) > limit:
+            chunks.extend(_split_long(sentence, limit))
+        else:
+            chunks.append(sentence)
+    return chunks
+
+
+def cache_key(voice_id, model_id, settings, text):
+    payload = json.dumps([voice_id, model_id, settings, text], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ------------------------------------------------------------------
+# Disk cache
+# ------------------------------------------------------------------
+class AudioCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._index = None  # key -> size, least recently used first
+        self._total = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.mp3")
+
+    def _load_index(self):
+        # Called with the lock held; rebuilds LRU order from mtimes on disk
+        if self._index is not None:
+            return
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".mp3"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name[:-4], st.st_size))
+        entries.sort()
+        self._index = OrderedDict((key, size) for _, key, size in entries)
+        self._total = sum(self._index.values())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+        except OSError:
+            self.stats["misses"] += 1
+            metrics.count_cache("tts_audio", False)
+            return None
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                self._index[key] = len(audio)
+                self._total += len(audio)
+            self._index.move_to_end(key)
+            self.stats["hits"] += 1
+        metrics.count_cache("tts_audio", True)
+        try:
+            os.utime(path)  # Keeps the order across restarts
+        except OSError:
+            pass
+        return audio
+
+    def put(self, key, audio):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(audio)
+        os.replace(tmp, path)  # Readers never see a partial file
+
+        with self._lock:
+            self._load_index()
+            self._total += len(audio) - self._index.pop(key, 0)
+            self._index[key] = len(audio)
+            while self._total > self.max_bytes and len(self._index) > 1:
+                old_key, size = self._index.popitem(last=False)
+                self._total -= size
+                self.stats["evictions"] += 1
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def get_stats(self):
+        with self._lock:
+            self._load_index()
+            return dict(self.stats, entries=len(self._index), bytes=self._total)
+
+
+# ------------------------------------------------------------------
+# Synthesis
+# ------------------------------------------------------------------
+def _make_session():
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(MAX_PARALLEL * 4, 10))
+    http.mount("https://", adapter)
+    http.mount("http://", adapter)
+    return http
+
+
+class TTSService:
+    def __init__(self, audio_cache=None):
+        self.cache = audio_cache or AudioCache()
+        self.http = _make_session()
+        self._executors = OrderedDict()  # key_id -> ThreadPoolExecutor
+        self._inflight = {}  # (key_id, key) -> Future, so concurrent misses share one upstream call
+        self._lock = threading.Lock()
+
+    def _executor(self, owner):
+        """The executor for one API key (caller holds the lock)."""
+        executor = self._executors.get(owner)
+        if executor is None:
+            executor = self._executors[owner] = ThreadPoolExecutor(
+                max_workers=MAX_PARALLEL, thread_name_prefix=f"tts-{owner[:8]}"
+            )
+        self._executors.move_to_end(owner)
+        while len(self._executors) > SYNTH_MAX_KEYS:
+            _, idle = self._executors.popitem(last=False)
+            idle.shutdown(wait=False)  # Queued calls still finish
+        return executor
+
+    def _synthesize(self, text, voice_id, model_id, settings, api_key):
+        response = self.http.post(
+            f"{ELEVENLABS_BASE_URL}/v1/text-to-speech/{voice_id}",
+            json={"text": text, "model_id": model_id, "voice_settings": settings},
+            headers={"Accept": "audio/mpeg", "xi-api-key": api_key},
+            timeout=REQUEST_TIMEOUT,
+        )
+        if not response.ok:
+            raise TTSError(response.text, response.status_code)
+        return response.content
+
+    def _fetch(self, key, text, voice_id, model_id, settings, api_key):
+        audio = self.cache.get(key)
+        if audio is not None:
+            future = Future()
+            future.set_result(audio)
+            return future, False
+
+        # Keyed by API key too: a call made with someone else's key must not
+        # hand its errors (bad key, quota) to this caller
+        owner = key_id(api_key)
+        inflight = (owner, key)
+        with self._lock:
+            future = self._inflight.get(inflight)
+            if future is not None:
+                return future, False
+            future = self._executor(owner).submit(self._synthesize, text, voice_id, model_id, settings, api_key)
+            self._inflight[inflight] = future
+
+        def done(f):
+            if f.exception() is None:
+                self.cache.put(key, f.result())
+            with self._lock:
+                self._inflight.pop(inflight, None)
+        future.add_done_callback(done)
+        return future, True
+
+    def synthesize(self, text, api_key, voice_id=None, model_id=None, settings=None):
+        """
+        Start synthesis of every chunk of `text`. Returns (chunks, billed_chars)
+        where `chunks` yields the MP3 bytes of each sentence in order and
+        `billed_chars` counts only the characters sent to ElevenLabs.
+        """
+        voice_id = voice_id or DEFAULT_VOICE_ID
+        model_id = model_id or DEFAULT_MODEL_ID
+        settings = settings or DEFAULT_SETTINGS
+
+        futures, billed = [], 0
+        for sentence in split_sentences(text):
+            key = cache_key(voice_id, model_id, settings, sentence)
+            future, synthesized = self._fetch(key, sentence, voice_id, model_id, settings, api_key)
+            futures.append(future)
+            if synthesized:
+                billed += len(sentence)
+
+        def chunks():
+            for future in futures:
+                yield future.result()
+        return chunks(), billed
+
+    def get_stats(self):
+        return self.cache.get_stats()
+
+
+def first_chunk(chunks):
+    """
+    Wait for the first chunk so upstream errors (TTSError) surface before the
+    response starts, then stream everything in order.
+    """
+    first = next(chunks, None)
+
+    def stream():
+        if first is not None:
+            yield first
+        yield from chunks
+    return stream()
+
+
+# ------------------------------------------------------------------
+# Voice catalog
+# ------------------------------------------------------------------
+def slim_voices(payload):
+    """The fields the settings modal uses, not the full upstream voice objects."""
+    return [
+        {"voice_id": v.get("voice_id"), "name": v.get("name"), "preview_url": v.get("preview_url")}
+        for v in (payload or {}).get("voices", [])
+    ]
+
+
+class VoiceCatalog:
+    def __init__(self, http):
+        self.http = http
+        self._entries = OrderedDict()  # key_id(api key) -> {"voices", "etag", "fetched_at"}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.stats = {"fresh": 0, "stale": 0, "fetches": 0, "not_modified": 0}
+
+    def _fetch(self, owner, api_key, etag=None):
+        headers = {"xi-api-key": api_key}
+        if etag:
+            headers["If-None-Match"] = etag
+        response = self.http.get(f"{ELEVENLABS_BASE_URL}/v1/voices", headers=headers, timeout=10)
+        with self._lock:
+            entry = self._entries.get(owner)
+            if response.status_code == 304 and entry:
+                self.stats["not_modified"] += 1
+                entry["fetched_at"] = time.monotonic()
+                return entry
+            if not response.ok:
+                raise TTSError(response.text, response.status_code)
+            self.stats["fetches"] += 1
+            voices = slim_voices(response.json())
+            entry = {
+                "voices": voices,
+                "etag": response.headers.get("ETag"),
+                "version": hashlib.sha256(json.dumps(voices, sort_keys=True).encode()).hexdigest()[:16],
+                "fetched_at": time.monotonic(),
+            }
+            self._entries[owner] = entry
+            self._entries.move_to_end(owner)
+            while len(self._entries) > VOICES_MAX_KEYS:
+                self._entries.popitem(last=False)
+            return entry
+
+    def _refresh(self, owner, api_key, etag):
+        try:
+            self._fetch(owner, api_key, etag)
+        except Exception:
+            pass  # Keep serving the stale list; the next request tries again
+        finally:
+            with self._lock:
+                self._refreshing.discard(owner)
+
+    def get(self, api_key):
+        """
+        {"voices": [...], "version": ...} for `api_key`. Returns immediately
+        when anything usable is cached; raises TTSError if upstream fails
+        with nothing to fall back on.
+        """
+        owner = key_id(api_key)
+        with self._lock:
+            entry = self._entries.get(owner)
+            age = time.monotonic() - entry["fetched_at"] if entry else None
+            if entry and age < VOICES_TTL:
+                self.stats["fresh"] += 1
+                return entry
+            if entry and age < VOICES_MAX_STALE:
+                self.stats["stale"] += 1
+                if owner not in self._refreshing:
+                    self._refreshing.add(owner)
+                    threading.Thread(
+                        target=self._refresh, args=(owner, api_key, entry["etag"]), daemon=True
+                    ).start()
+                return entry
+        return self._fetch(owner, api_key, entry["etag"] if entry else None)
+
+
+# Global Instance
+tts = TTSService()
+voices = VoiceCatalog(tts.http)
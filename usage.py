@@ -0,0 +1,386 @@
+"""
+LLM Usage Accounting
+--------------------
+Records the token usage of every completion (model_router.complete, the one
+caller of llm_gateway, which knows the call site, model and price) against
+the user and project bound to the current context:
+
+    usage.bind(user_id)                  # once per request (app.py)
+    usage.bind_project(project_name)     # builds
+
+Rows are buffered in memory and written in batches by a background thread
+(USAGE_BATCH_SIZE rows, or every USAGE_FLUSH_INTERVAL seconds) to
+`llm_usage`, and the per-day totals in `llm_usage_daily` are upserted in the
+same transaction, so budgets and rollups never scan the raw rows.
+
+Budgets: every package has a monthly `llm_budget_usd` (users without a row
+are on the free package). `check_build()` runs before a build starts and
+rejects it once the month is spent, or downgrades it (no web search, then
+fewer agents) when the worst-case estimate does not fit the remaining
+budget; a single build is also capped at LLM_BUILD_BUDGET_USD. During the
+build `start_build()` tracks what it actually spends, and the builder stops
+scheduling agents once that allowance is used up.
+
+Spend seen by budgets is the flushed daily totals plus this worker's
+unflushed rows, so other workers' last few seconds may not be counted yet.
+"""
+
+import atexit
+import contextvars
+import logging
+import os
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import case, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+import llm_gateway
+import repository
+from models import db, LLMUsage, LLMUsageDaily, User
+
+BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+BUILD_BUDGET_USD = float(os.getenv("LLM_BUILD_BUDGET_USD", "2.0"))  # 0 = no per-build cap
+FREE_PACKAGE_ID = 1
+MAX_BUFFERED = 50 * BATCH_SIZE  # Rows kept for retry while the database is unreachable
+
+# Worst-case shape of one build agent (see builder.build_project_stream)
+AGENT_PROMPT_TOKENS = 2500
+AGENT_MAX_TOKENS = 4096
+SUMMARY_PROMPT_TOKENS = 3000
+SUMMARY_MAX_TOKENS = 1024
+
+logger = logging.getLogger(__name__)
+
+_scope = contextvars.ContextVar("usage_scope", default=(None, None))  # (user, project)
+_build = contextvars.ContextVar("usage_build", default=None)
+
+_daily = LLMUsageDaily.__table__
+_SUMS = ("calls", "prompt_tokens", "completion_tokens", "cost_usd", "latency_ms")
+
+
+# ------------------------------------------------------------------
+# Context
+# ------------------------------------------------------------------
+def bind(user_id, project_name=None):
+    """Attribute completions made in this context to `user_id` (and project); ends any build budget."""
+    _scope.set((user_id, project_name))
+    _build.set(None)
+
+
+def bind_project(project_name):
+    _scope.set((_scope.get()[0], project_name))
+
+
+def current_user():
+    return _scope.get()[0]
+
+
+class BuildBudget:
+    """What one build has spent so far, against its allowance (None = uncapped)."""
+
+    def __init__(self, allowance_usd=None):
+        self.allowance_usd = allowance_usd
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self._lock = threading.Lock()  # Sharded generation records from pool threads
+
+    def add(self, prompt_tokens, completion_tokens, cost_usd):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost_usd += cost_usd
+
+    @property
+    def exhausted(self):
+        return self.allowance_usd is not None and self.cost_usd >= self.allowance_usd
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 4),
+            "allowance_usd": None if self.allowance_usd is None else round(self.allowance_usd, 4),
+        }
+
+
+def start_build(allowance_usd=None):
+    """Track the spend of completions made from here on in this context."""
+    budget = BuildBudget(allowance_usd)
+    _build.set(budget)
+    return budget
+
+
+# ------------------------------------------------------------------
+# Batched writes
+# ------------------------------------------------------------------
+def _upsert_daily(connection, totals):
+    """Add `totals` ({(day, user, call_site, model): {column: n}}) to llm_usage_daily."""
+    rows = [dict(zip(("day", "user_identifier", "call_site", "model"), key), **sums) for key, sums in totals.items()]
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(_daily).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[_daily.c.day, _daily.c.user_identifier, _daily.c.call_site, _daily.c.model],
+            set_={name: _daily.c[name] + stmt.excluded[name] for name in _SUMS}
+        )
+        connection.execute(stmt)
+        return
+    for row in rows:
+        key = (_daily.c.day == row["day"]) & (_daily.c.user_identifier == row["user_identifier"]) & \
+              (_daily.c.call_site == row["call_site"]) & (_daily.c.model == row["model"])
+        result = connection.execute(_daily.update().where(key).values(
+            **{name: _daily.c[name] + row[name] for name in _SUMS}))
+        if result.rowcount == 0:
+            connection.execute(_daily.insert().values(**row))
+
+
+def _daily_totals(rows):
+    totals = defaultdict(lambda: dict.fromkeys(_SUMS, 0))
+    for row in rows:
+        sums = totals[(row["created_at"].strftime("%Y-%m-%d"), row["user_identifier"] or "",
+                       row["call_site"], row["model"])]
+        sums["calls"] += 1
+        for name in ("prompt_tokens", "completion_tokens", "cost_usd", "latency_ms"):
+            sums[name] += row[name]
+    return totals
+
+
+class UsageRecorder:
+    def __init__(self):
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending_cost = defaultdict(float)  # user -> cost of rows not yet written
+        self._app = None
+        self.stats = {"recorded": 0, "written": 0, "batches": 0, "errors": 0, "dropped": 0}
+
+    def init_app(self, app):
+        """Start the background writer; it needs the app for database access."""
+        if self._app is None:
+            self._app = app
+            threading.Thread(target=self._run, name="usage-writer", daemon=True).start()
+            atexit.register(self.flush)
+
+    def record(self, call_site, model, prompt_tokens, completion_tokens, cost_usd, latency):
+        user_id, project_name = _scope.get()
+        row = {
+            "created_at": datetime.utcnow(),
+            "user_identifier": user_id,
+            "project_name": project_name,
+            "trace_id": llm_gateway.current_trace_id(),
+            "call_site": call_site,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": cost_usd,
+            "latency_ms": int(latency * 1000),
+        }
+        build = _build.get()
+        if build is not None:
+            build.add(prompt_tokens, completion_tokens, cost_usd)
+        if self._app is None:
+            return  # Outside the web app (CLI): nowhere to write it
+        with self._lock:
+            self._rows.append(row)
+            self._pending_cost[user_id or ""] += cost_usd
+            self.stats["recorded"] += 1
+            full = len(self._rows) >= BATCH_SIZE
+        if full:
+            self._wake.set()
+
+    def pending_cost(self, user_id):
+        with self._lock:
+            return self._pending_cost.get(user_id or "", 0.0)
+
+    def _run(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows and their daily totals in one transaction."""
+        if self._app is None:
+            return
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return
+            try:
+                with self._app.app_context():
+                    with db.engine.begin() as connection:
+                        connection.execute(LLMUsage.__table__.insert(), rows)
+                        _upsert_daily(connection, _daily_totals(rows))
+            except Exception as e:
+                logger.warning(f"Usage write failed, will retry: {e}")
+                with self._lock:
+                    self.stats["errors"] += 1
+                    self._rows[:0] = rows
+                    if len(self._rows) > MAX_BUFFERED:
+                        dropped = self._rows[:len(self._rows) - MAX_BUFFERED]
+                        del self._rows[:len(dropped)]
+                        self.stats["dropped"] += len(dropped)
+                        self._forget(dropped)
+                return
+            with self._lock:
+                self.stats["written"] += len(rows)
+                self.stats["batches"] += 1
+                self._forget(rows)
+
+    def _forget(self, rows):
+        for row in rows:
+            user = row["user_identifier"] or ""
+            self._pending_cost[user] -= row["cost_usd"]
+            if self._pending_cost[user] <= 1e-9:
+                del self._pending_cost[user]
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, buffered=len(self._rows))
+
+
+# ------------------------------------------------------------------
+# Budgets
+# ------------------------------------------------------------------
+@dataclass
+class BuildDecision:
+    allowed: bool
+    max_agents: int
+    allow_search: bool = True
+    allowance_usd: Optional[float] = None
+    reason: Optional[str] = None
+
+
+def _month_start():
+    return datetime.utcnow().strftime("%Y-%m-01")
+
+
+def month_spend(user_id):
+    flushed = (
+        db.session.query(func.coalesce(func.sum(LLMUsageDaily.cost_usd), 0.0))
+        .filter(LLMUsageDaily.user_identifier == (user_id or ""), LLMUsageDaily.day >= _month_start())
+        .scalar()
+    )
+    return float(flushed or 0.0) + recorder.pending_cost(user_id)
+
+
+def monthly_budget(user_id):
+    """(package name, monthly USD budget or None) for `user_id`."""
+    user = repository.get_user(user_id) if user_id else None
+    package_id = user.package_id if user and user.package_id else FREE_PACKAGE_ID
+    packages = {p["id"]: p for p in repository.list_packages()}
+    package = packages.get(package_id) or packages.get(FREE_PACKAGE_ID) or {}
+    return package.get("name", "Free"), package.get("llm_budget_usd")
+
+
+def agent_cost(search=True):
+    """Worst-case cost of one build agent, on each call site's preferred model."""
+    import model_router  # model_router records through this module
+
+    cost = model_router.estimate_cost("artifacts", AGENT_PROMPT_TOKENS, AGENT_MAX_TOKENS)
+    if search:
+        # SEARCH request, summary of the results, then the artifacts themselves
+        cost = 2 * cost + model_router.estimate_cost("summarize", SUMMARY_PROMPT_TOKENS, SUMMARY_MAX_TOKENS)
+    return cost
+
+
+def check_build(user_id, agent_count):
+    """Decide before a build starts whether it runs in full, downgraded, or not at all."""
+    _, budget = monthly_budget(user_id)
+    remaining = None if budget is None else budget - month_spend(user_id)
+    caps = [c for c in (remaining, BUILD_BUDGET_USD if BUILD_BUDGET_USD > 0 else None) if c is not None]
+    allowance = min(caps) if caps else None
+
+    if allowance is None:
+        return BuildDecision(True, agent_count)
+    if remaining is not None and remaining <= 0:
+        return BuildDecision(False, 0, False, 0.0, f"Monthly LLM budget of ${budget:.2f} is used up")
+    if agent_count * agent_cost(search=True) <= allowance:
+        return BuildDecision(True, agent_count, True, allowance)
+    if agent_count * agent_cost(search=False) <= allowance:
+        return BuildDecision(True, agent_count, False, allowance,
+                             f"Web search disabled to fit the LLM budget (${allowance:.2f})")
+    affordable = int(allowance // agent_cost(search=False))
+    if affordable < 1:
+        return BuildDecision(False, 0, False, allowance,
+                             f"Remaining LLM budget (${allowance:.2f}) does not cover a single agent")
+    return BuildDecision(True, affordable, False, allowance,
+                         f"Building {affordable} of {agent_count} agents without web search "
+                         f"to fit the LLM budget (${allowance:.2f})")
+
+
+# ------------------------------------------------------------------
+# Rollups
+# ------------------------------------------------------------------
+def user_summary(user_id):
+    """This month's spend, budget and per call site totals for one user."""
+    package, budget = monthly_budget(user_id)
+    rows = (
+        db.session.query(
+            LLMUsageDaily.call_site, func.sum(LLMUsageDaily.calls), func.sum(LLMUsageDaily.prompt_tokens),
+            func.sum(LLMUsageDaily.completion_tokens), func.sum(LLMUsageDaily.cost_usd))
+        .filter(LLMUsageDaily.user_identifier == (user_id or ""), LLMUsageDaily.day >= _month_start())
+        .group_by(LLMUsageDaily.call_site)
+        .all()
+    )
+    spent = month_spend(user_id)
+    return {
+        "package": package,
+        "budget_usd": budget,
+        "spent_usd": round(spent, 4),
+        "remaining_usd": None if budget is None else round(max(0.0, budget - spent), 4),
+        "call_sites": [
+            {"call_site": site, "calls": calls, "prompt_tokens": prompt, "completion_tokens": completion,
+             "cost_usd": round(cost or 0.0, 4)}
+            for site, calls, prompt, completion, cost in rows
+        ],
+    }
+
+
+def tier_rollup(days=30):
+    """Usage over the last `days` days per package tier (users' current package)."""
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    package_id = case(
+        (LLMUsageDaily.user_identifier == "", None),  # Background work, no user
+        else_=func.coalesce(User.package_id, FREE_PACKAGE_ID)
+    )
+    rows = (
+        db.session.query(
+            package_id, func.count(func.distinct(LLMUsageDaily.user_identifier)), func.sum(LLMUsageDaily.calls),
+            func.sum(LLMUsageDaily.prompt_tokens), func.sum(LLMUsageDaily.completion_tokens),
+            func.sum(LLMUsageDaily.cost_usd), func.sum(LLMUsageDaily.latency_ms))
+        .select_from(LLMUsageDaily)
+        .outerjoin(User, User.username == LLMUsageDaily.user_identifier)
+        .filter(LLMUsageDaily.day >= since)
+        .group_by(package_id)
+        .all()
+    )
+    names = {p["id"]: p["name"] for p in repository.list_packages()}
+    return sorted((
+        {
+            "package": names.get(pid, f"#{pid}") if pid is not None else "Unattributed",
+            "users": users if pid is not None else 0,
+            "calls": calls,
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "cost_usd": round(cost or 0.0, 4),
+            "avg_latency_ms": round((latency or 0) / calls, 1) if calls else 0.0,
+        }
+        for pid, users, calls, prompt, completion, cost, latency in rows
+    ), key=lambda row: -row["cost_usd"])
+
+
+# Global Instance
+recorder = UsageRecorder()